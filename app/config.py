@@ -18,6 +18,7 @@ def get_project_root() -> Path:
 PROJECT_ROOT = get_project_root()
 APP_PATH = PROJECT_ROOT / "app"
 DB_PATH = APP_PATH / "db"
+CACHE_PATH = PROJECT_ROOT / "cache"
 WORKSPACE_ROOT = PROJECT_ROOT / "workspace"
 
 
@@ -1,6 +1,6 @@
 # db.py
 import sqlite3
-from app.config import DB_PATH
+from app.config import CACHE_PATH, DB_PATH
 
 def init_db(db_path=DB_PATH/'keywords.db'):
     conn = sqlite3.connect(db_path)
@@ -33,8 +33,35 @@ def init_db(db_path=DB_PATH/'keywords.db'):
         UNIQUE(keyword_id),
         FOREIGN KEY (keyword_id) REFERENCES keywords(id)
     );
+
+    CREATE INDEX IF NOT EXISTS features_feature_text ON features (feature_text);
     """)
 
     conn.commit()
     return conn
 
+
+
+def init_llm_cache_db(db_path=CACHE_PATH/'llm_cache.db'):
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL;")
+
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS llm_responses (
+        agent TEXT NOT NULL,
+        model TEXT NOT NULL,
+        instructions_hash TEXT NOT NULL,
+        prompt_hash TEXT NOT NULL,
+        response TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        PRIMARY KEY (agent, model, instructions_hash, prompt_hash)
+    );
+
+    CREATE INDEX IF NOT EXISTS llm_responses_accessed_at ON llm_responses (accessed_at);
+    """)
+
+    conn.commit()
+    return conn
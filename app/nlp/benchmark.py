@@ -0,0 +1,410 @@
+"""
+Retrieval benchmarks.
+
+    python -m app.nlp.benchmark ann --n 200000 --types ivf hnsw ivfpq
+    python -m app.nlp.benchmark ann --vectors claims.npy --nprobe 8 32 --ef-search 32 128
+    python -m app.nlp.benchmark quant --n 200000 --types flat hnsw
+    python -m app.nlp.benchmark shards --n 1000000 --shards 1 8 32 64
+    python -m app.nlp.benchmark hybrid --n 20000 --budget-ms 50 200
+    python -m app.nlp.benchmark hybrid --patents patents.jsonl
+    python -m app.nlp.benchmark embed --patents patents.jsonl --n 2000
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from app.nlp.vector_index import VectorIndex
+
+
+# ----------------------------
+# Data
+# ----------------------------
+def synthetic_vectors(n: int, dim: int = 384, n_clusters: int = 1024, seed: int = 0) -> np.ndarray:
+    """
+    Unit vectors drawn around random centroids. Sentence embeddings are strongly
+    clustered, so uniform random vectors would flatter recall of the ANN indexes.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    vecs = centroids[rng.integers(0, n_clusters, n)] + 1.2 * rng.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(vecs)
+    return vecs
+
+
+def load_vectors(args) -> np.ndarray:
+    if args.vectors:
+        vecs = np.load(args.vectors).astype(np.float32)
+    elif args.from_index:
+        index = VectorIndex.load(args.from_index, mmap=False)
+        # reconstruct by label (the id map is not positional) and skip tombstones;
+        # raw rescoring vectors, when kept, are the unquantized originals.
+        labels = np.sort(faiss.vector_to_array(index.index.id_map))
+        labels = labels[~np.isin(labels, np.fromiter(index.deleted, dtype=np.int64, count=len(index.deleted)))]
+        vecs = index.raw.gather(labels) if index.raw is not None else index.index.reconstruct_batch(labels)
+    else:
+        vecs = synthetic_vectors(args.n + args.queries, args.dim, seed=args.seed)
+    return np.ascontiguousarray(vecs)
+
+
+def synthetic_patents(n: int, vocab: int = 5000, seed: int = 0) -> List[Dict]:
+    """
+    Claims drawn from a Zipf-weighted vocabulary, each with a unique part number,
+    the kind of exact token sentence embeddings tend to blur.
+    """
+    rng = random.Random(seed)
+    words = [f"term{i}" for i in range(vocab)]
+    weights = [1 / (i + 1) for i in range(vocab)]
+    return [
+        {
+            "id": f"S{i}",
+            "claim": f"A device comprising {' '.join(rng.choices(words, weights, k=rng.randint(20, 80)))} part PN-{i:07d}",
+            "cpc": [f"G06F {rng.randint(1, 99)}/{rng.randint(0, 99):02d}"],
+        }
+        for i in range(n)
+    ]
+
+
+def load_patents(args) -> List[Dict]:
+    if args.patents:
+        with open(args.patents) as f:
+            return [json.loads(line) for line in f if line.strip()][:args.n]
+    return synthetic_patents(args.n, seed=args.seed)
+
+
+def patent_queries(patents: List[Dict], n_queries: int, seed: int = 0):
+    """(query text, source patent id): half of a claim's words, in order, so the source is the expected hit."""
+    rng = random.Random(seed)
+    queries = []
+    for p in rng.sample(patents, min(n_queries, len(patents))):
+        words = p["claim"].split()
+        keep = sorted(rng.sample(range(len(words)), max(1, len(words) // 2)))
+        queries.append((" ".join(words[i] for i in keep), p["id"]))
+    return queries
+
+
+def split_queries(vecs: np.ndarray, n_queries: int, seed: int = 0):
+    """Hold out n_queries vectors, perturbed so they are not exact corpus members."""
+    rng = np.random.default_rng(seed)
+    perm = rng.permutation(len(vecs))
+    queries = vecs[perm[:n_queries]] + 0.05 * rng.standard_normal((n_queries, vecs.shape[1])).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return np.ascontiguousarray(vecs[perm[n_queries:]]), np.ascontiguousarray(queries)
+
+
+# ----------------------------
+# Metrics
+# ----------------------------
+def recall_at_k(found: np.ndarray, truth: np.ndarray, k: int) -> float:
+    """Fraction of the exact top-k that the approximate search returned in its top-k."""
+    hits = sum(len(np.intersect1d(f[:k], t[:k])) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def time_search(index: VectorIndex, queries: np.ndarray, k: int, **params):
+    start = time.perf_counter()
+    scores, ids = index.search_raw(queries, k, **params)
+    elapsed = time.perf_counter() - start
+    return ids, len(queries) / elapsed if elapsed > 0 else float("inf")
+
+
+def print_row(row: Dict):
+    print(
+        f"{row['index']:<8} {row['param']:<14} recall@{row['k']}={row['recall']:.4f} "
+        f"qps={row['qps']:>10.1f} mem={row['memory_mb']:>9.1f}MB build={row['build_s']:.1f}s"
+    )
+
+
+# ----------------------------
+# ANN vs flat
+# ----------------------------
+def bench_ann(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    types: List[str] = ("ivf", "hnsw", "ivfpq"),
+    nlist: Optional[int] = None,
+    nprobes: List[int] = (1, 8, 32, 128),
+    ef_searches: List[int] = (16, 64, 256),
+) -> List[Dict]:
+    dim = corpus.shape[1]
+    # rule of thumb: ~sqrt(n) cells, each trained with >= 39 points.
+    nlist = nlist or max(1, min(int(np.sqrt(len(corpus))), len(corpus) // 39))
+
+    start = time.perf_counter()
+    flat = VectorIndex(dim, "flat")
+    flat.add(corpus, list(range(len(corpus))))
+    flat_build = time.perf_counter() - start
+    truth, flat_qps = time_search(flat, queries, k)
+    rows = [{
+        "index": "flat", "param": "-", "k": k, "recall": 1.0, "qps": flat_qps,
+        "memory_mb": flat.memory_bytes() / 2**20, "build_s": flat_build,
+    }]
+    print_row(rows[0])
+
+    for index_type in types:
+        start = time.perf_counter()
+        index = VectorIndex(dim, index_type, nlist=nlist)
+        index.add(corpus, list(range(len(corpus))))
+        build_s = time.perf_counter() - start
+        memory_mb = index.memory_bytes() / 2**20
+
+        if index_type == "hnsw":
+            sweep = [("efSearch", {"ef_search": ef}) for ef in ef_searches]
+        else:
+            sweep = [("nprobe", {"nprobe": p}) for p in nprobes if p <= nlist]
+        for name, params in sweep:
+            found, qps = time_search(index, queries, k, **params)
+            row = {
+                "index": index_type, "param": f"{name}={next(iter(params.values()))}", "k": k,
+                "recall": recall_at_k(found, truth, k), "qps": qps,
+                "memory_mb": memory_mb, "build_s": build_s,
+            }
+            rows.append(row)
+            print_row(row)
+    return rows
+
+
+# ----------------------------
+# Scalar quantization
+# ----------------------------
+def bench_quantization(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    types: List[str] = ("flat", "hnsw"),
+    quantizations: List[str] = ("fp16", "sq8"),
+    rescore_factor: int = 4,
+    nlist: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Recall loss and memory saved by fp16 / sq8 storage against the float32 index of
+    the same type, with and without exact re-scoring from the raw vectors.
+    """
+    dim = corpus.shape[1]
+    nlist = nlist or max(1, min(int(np.sqrt(len(corpus))), len(corpus) // 39))
+    ids = list(range(len(corpus)))
+    flat = VectorIndex(dim, "flat")
+    flat.add(corpus, ids)
+    truth, _ = time_search(flat, queries, k)
+
+    rows = []
+    for index_type in types:
+        baseline_mb = None
+        for quantization in [None] + list(quantizations):
+            start = time.perf_counter()
+            index = VectorIndex(
+                dim, index_type, nlist=nlist, quantization=quantization,
+                rescore=quantization is not None, rescore_factor=rescore_factor,
+            )
+            index.add(corpus, ids)
+            build_s = time.perf_counter() - start
+            memory_mb = index.memory_bytes() / 2**20
+            baseline_mb = baseline_mb or memory_mb
+            for rescore in ([False, True] if quantization else [False]):
+                found, qps = time_search(index, queries, k, rescore=rescore)
+                row = {
+                    "index": index_type, "param": f"{quantization or 'float32'}{'+rescore' if rescore else ''}",
+                    "k": k, "recall": recall_at_k(found, truth, k), "qps": qps,
+                    "memory_mb": memory_mb, "build_s": build_s,
+                }
+                rows.append(row)
+                print_row(row)
+        print(f"{index_type}: " + ", ".join(
+            f"{r['param']} saves {baseline_mb / r['memory_mb']:.1f}x memory"
+            for r in rows if r["index"] == index_type and "rescore" not in r["param"] and r["param"] != "float32"
+        ))
+    return rows
+
+
+# ----------------------------
+# Sharded scatter-gather
+# ----------------------------
+def bench_shards(
+    corpus: np.ndarray, queries: np.ndarray, k: int = 10, shard_counts: List[int] = (1, 2, 4, 8),
+    batch_size: int = 64, index_type: str = "flat",
+) -> List[Dict]:
+    """QPS of ShardedIndex over n worker processes versus the single-process index."""
+    from app.nlp.sharded import ShardedIndex
+
+    index = VectorIndex(corpus.shape[1], index_type)
+    index.add(corpus, list(range(len(corpus))))
+    batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+
+    def run(search) -> float:
+        start = time.perf_counter()
+        for batch in batches:
+            search(batch, k)
+        return len(queries) / (time.perf_counter() - start)
+
+    rows = [{"shards": 0, "qps": run(index.search_raw)}]
+    print(f"{'single':<10} qps={rows[0]['qps']:>10.1f}")
+    truth = index.search_raw(queries, k)[1]
+    for n in shard_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            sharded = ShardedIndex.build(index, tmp, n)
+            try:
+                found = sharded.search_raw(queries, k)[1]
+                row = {"shards": n, "qps": run(sharded.search_raw), "recall": recall_at_k(found, truth, k)}
+            finally:
+                sharded.close()
+        rows.append(row)
+        print(f"{n:<3} shards qps={row['qps']:>10.1f} recall@{k}={row['recall']:.4f}")
+    return rows
+
+
+# ----------------------------
+# Hybrid vs dense-only
+# ----------------------------
+def bench_hybrid(patents: List[Dict], queries, k: int = 10, batch_size: int = 32, budgets: List[float] = ()) -> List[Dict]:
+    """QPS and hit@k (source patent in the top k) of dense-only versus hybrid BM25 + dense search."""
+    from app.nlp.feature_extraction import PatentSearchEngine
+
+    start = time.perf_counter()
+    engine = PatentSearchEngine()
+    engine.build_index(patents)
+    print(f"build {time.perf_counter() - start:.1f}s, bm25 {engine.bm25.memory_bytes() / 2**20:.1f}MB in memory")
+
+    texts = [q for q, _ in queries]
+    engine.search_many(texts[:batch_size], k)  # warm parse / embedding caches and models
+
+    modes = [("dense", {})] + [("hybrid", {"hybrid": True})]
+    modes += [(f"hybrid@{b:g}ms", {"hybrid": True, "budget_ms": b}) for b in budgets]
+    rows = []
+    for name, params in modes:
+        start = time.perf_counter()
+        results = []
+        for i in range(0, len(texts), batch_size):
+            results.extend(engine.search_many(texts[i:i + batch_size], k, **params))
+        elapsed = time.perf_counter() - start
+        hits = sum(any(p["id"] == pid for p, _ in res) for res, (_, pid) in zip(results, queries))
+        row = {"mode": name, "k": k, "hit_rate": hits / len(queries), "qps": len(queries) / elapsed}
+        rows.append(row)
+        print(f"{name:<16} hit@{k}={row['hit_rate']:.4f} qps={row['qps']:>9.1f}")
+    return rows
+
+
+# ----------------------------
+# Embedding backends
+# ----------------------------
+def bench_embed(texts: List[str], backends: List[str] = ("torch", "onnx"), k: int = 10) -> List[Dict]:
+    """
+    Throughput of each embedding backend over `texts`, and its agreement with the
+    first (reference) backend: per-text cosine and recall@k of nearest neighbours
+    among the texts.
+    """
+    from app.nlp.embedding import encode_bucketed, encode_stats
+
+    rows, reference = [], None
+    for backend in backends:
+        encode_bucketed(texts[:32], backend=backend)  # load the model and warm up
+        before = encode_stats()
+        start = time.perf_counter()
+        vecs = encode_bucketed(texts, backend=backend)
+        elapsed = time.perf_counter() - start
+        tokens = encode_stats()["tokens"] - before["tokens"]
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        row = {"backend": backend, "texts_per_sec": len(texts) / elapsed, "tokens_per_sec": tokens / elapsed}
+        if reference is None:
+            reference = vecs
+            truth = np.argsort(-(reference @ reference.T), axis=1)[:, 1:k + 1]
+        else:
+            cos = np.einsum("ij,ij->i", vecs, reference)
+            found = np.argsort(-(vecs @ vecs.T), axis=1)[:, 1:k + 1]
+            row.update({"mean_cos": float(cos.mean()), "min_cos": float(cos.min()),
+                        "recall": recall_at_k(found, truth, k)})
+        rows.append(row)
+        accuracy = f" cos={row['mean_cos']:.4f} (min {row['min_cos']:.4f}) recall@{k}={row['recall']:.4f}" if "recall" in row else ""
+        print(f"{backend:<8} texts/s={row['texts_per_sec']:>8.1f} tokens/s={row['tokens_per_sec']:>10.0f}{accuracy}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Patent retrieval benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ann = sub.add_parser("ann", help="recall@k / QPS / memory of ANN indexes versus the flat index")
+    ann.add_argument("--n", type=int, default=100_000, help="synthetic corpus size")
+    ann.add_argument("--dim", type=int, default=384)
+    ann.add_argument("--queries", type=int, default=1000)
+    ann.add_argument("--k", type=int, default=10)
+    ann.add_argument("--seed", type=int, default=0)
+    ann.add_argument("--vectors", help=".npy file of real claim embeddings")
+    ann.add_argument("--from-index", help="directory written by PatentSearchEngine.save() (flat index)")
+    ann.add_argument("--types", nargs="+", default=["ivf", "hnsw", "ivfpq"])
+    ann.add_argument("--nlist", type=int)
+    ann.add_argument("--nprobe", type=int, nargs="+", default=[1, 8, 32, 128])
+    ann.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+
+    quant = sub.add_parser("quant", help="recall loss / memory saved by fp16 and sq8 vector storage")
+    quant.add_argument("--n", type=int, default=100_000, help="synthetic corpus size")
+    quant.add_argument("--dim", type=int, default=384)
+    quant.add_argument("--queries", type=int, default=1000)
+    quant.add_argument("--k", type=int, default=10)
+    quant.add_argument("--seed", type=int, default=0)
+    quant.add_argument("--vectors", help=".npy file of real claim embeddings")
+    quant.add_argument("--from-index", help="directory written by PatentSearchEngine.save() (flat index)")
+    quant.add_argument("--types", nargs="+", default=["flat", "hnsw"])
+    quant.add_argument("--quantizations", nargs="+", default=["fp16", "sq8"])
+    quant.add_argument("--rescore-factor", type=int, default=4)
+    quant.add_argument("--nlist", type=int)
+
+    shards = sub.add_parser("shards", help="QPS of sharded scatter-gather search versus one process")
+    shards.add_argument("--n", type=int, default=1_000_000, help="synthetic corpus size")
+    shards.add_argument("--dim", type=int, default=384)
+    shards.add_argument("--queries", type=int, default=2048)
+    shards.add_argument("--k", type=int, default=10)
+    shards.add_argument("--seed", type=int, default=0)
+    shards.add_argument("--vectors", help=".npy file of real claim embeddings")
+    shards.add_argument("--from-index", help="directory written by PatentSearchEngine.save() (flat index)")
+    shards.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    shards.add_argument("--batch-size", type=int, default=64)
+    shards.add_argument("--index-type", default="flat")
+
+    hybrid = sub.add_parser("hybrid", help="QPS / hit@k of hybrid BM25 + dense search versus dense-only")
+    hybrid.add_argument("--n", type=int, default=20_000, help="corpus size")
+    hybrid.add_argument("--queries", type=int, default=500)
+    hybrid.add_argument("--k", type=int, default=10)
+    hybrid.add_argument("--seed", type=int, default=0)
+    hybrid.add_argument("--patents", help=".jsonl of {id, claim, cpc} patents instead of synthetic claims")
+    hybrid.add_argument("--batch-size", type=int, default=32)
+    hybrid.add_argument("--budget-ms", type=float, nargs="*", default=[], help="also run hybrid with these latency budgets")
+
+    embed = sub.add_parser("embed", help="throughput / accuracy of the onnx int8 embedding backend versus torch")
+    embed.add_argument("--n", type=int, default=2000, help="number of claims")
+    embed.add_argument("--k", type=int, default=10)
+    embed.add_argument("--seed", type=int, default=0)
+    embed.add_argument("--patents", help=".jsonl of {id, claim, cpc} patents instead of synthetic claims")
+    embed.add_argument("--backends", nargs="+", default=["torch", "onnx"], help="the first one is the reference")
+
+    args = parser.parse_args()
+    if args.command == "ann":
+        corpus, queries = split_queries(load_vectors(args), args.queries, args.seed)
+        print(f"corpus={len(corpus)} queries={len(queries)} dim={corpus.shape[1]}")
+        bench_ann(corpus, queries, args.k, args.types, args.nlist, args.nprobe, args.ef_search)
+    elif args.command == "quant":
+        corpus, queries = split_queries(load_vectors(args), args.queries, args.seed)
+        print(f"corpus={len(corpus)} queries={len(queries)} dim={corpus.shape[1]}")
+        bench_quantization(corpus, queries, args.k, args.types, args.quantizations, args.rescore_factor, args.nlist)
+    elif args.command == "shards":
+        corpus, queries = split_queries(load_vectors(args), args.queries, args.seed)
+        print(f"corpus={len(corpus)} queries={len(queries)} dim={corpus.shape[1]}")
+        bench_shards(corpus, queries, args.k, args.shards, args.batch_size, args.index_type)
+    elif args.command == "hybrid":
+        patents = load_patents(args)
+        queries = patent_queries(patents, args.queries, args.seed)
+        print(f"corpus={len(patents)} queries={len(queries)}")
+        bench_hybrid(patents, queries, args.k, args.batch_size, args.budget_ms)
+    elif args.command == "embed":
+        texts = [p["claim"] for p in load_patents(args)]
+        print(f"texts={len(texts)}")
+        bench_embed(texts, args.backends, args.k)
+
+
+if __name__ == "__main__":
+    main()
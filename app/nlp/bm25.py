@@ -0,0 +1,272 @@
+import json
+import math
+import os
+import re
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+from app.logger import logger
+
+TERMS_FILE = "terms.npz"
+POSTINGS_FILE = "postings.bin"
+DOCS_FILE = "doc_len.npy"
+META_FILE = "meta.json"
+
+# keeps part numbers, formulas and symbols whole: "a-123", "c6h12o6", "9/50", "1.5".
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+
+
+def bm25_tokens(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in ENGLISH_STOP_WORDS]
+
+
+# ----------------------------
+# Varint postings
+# ----------------------------
+def varint_encode(values: np.ndarray) -> bytes:
+    """LEB128 encoding of non-negative integers, 7 bits per byte."""
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b""
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        n_bytes += rest > 0
+        rest >>= np.uint64(7)
+    ends = np.cumsum(n_bytes)
+    out = np.zeros(ends[-1], dtype=np.uint8)
+    pos = ends - n_bytes
+    rest = values.copy()
+    for i in range(int(n_bytes.max())):
+        live = n_bytes > i
+        more = (n_bytes > i + 1)[live]
+        out[pos[live] + i] = (rest[live] & np.uint64(0x7F)).astype(np.uint8) | (more.astype(np.uint8) << 7)
+        rest >>= np.uint64(7)
+    return out.tobytes()
+
+
+def varint_decode(buf: np.ndarray) -> np.ndarray:
+    """Inverse of varint_encode over a uint8 array."""
+    if not len(buf):
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shift = 7 * (np.arange(len(buf)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((buf & 0x7F).astype(np.int64) << shift, starts)
+
+
+def encode_postings(labels: np.ndarray, tfs: np.ndarray) -> bytes:
+    """(label gap, tf) pairs of labels in increasing order."""
+    pairs = np.empty(2 * len(labels), dtype=np.int64)
+    pairs[0::2] = np.diff(labels, prepend=0)
+    pairs[1::2] = tfs
+    return varint_encode(pairs)
+
+
+def decode_postings(buf: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    pairs = varint_decode(buf)
+    return np.cumsum(pairs[0::2]), pairs[1::2]
+
+
+# ----------------------------
+# BM25 Inverted Index
+# ----------------------------
+class Bm25Index:
+    """
+    BM25 inverted index over claim text, keyed by the same labels as the
+    VectorIndex so its hits fuse with the dense scores directly.
+
+    The on-disk segment is a sorted term array with offsets into one
+    memory-mapped file of varint delta-encoded (label gap, tf) postings.
+    Documents added since the last save() sit in an in-memory delta, and
+    save() merges both into a new segment, dropping removed documents.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._doc_len = np.zeros(0, dtype=np.int32)  # label -> token count, 0 for absent or removed; grown by doubling
+        self.n_labels = 0
+        self.n_docs = 0
+        self.total_len = 0
+        # on-disk segment
+        self.terms = np.empty(0, dtype=str)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.df = np.empty(0, dtype=np.int32)
+        self.postings = np.empty(0, dtype=np.uint8)
+        # in-memory delta: term -> (labels, tfs)
+        self.delta: Dict[str, Tuple[array, array]] = {}
+        # searches cut short by their budget, and the query terms they skipped.
+        self.truncated = 0
+        self.skipped_terms = 0
+
+    def __len__(self):
+        return self.n_docs
+
+    @property
+    def doc_len(self) -> np.ndarray:
+        return self._doc_len[:self.n_labels]
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_len / self.n_docs if self.n_docs else 0.0
+
+    def add(self, labels: Iterable[int], texts: Iterable[str]):
+        """Index texts under labels, which must be larger than every label added before."""
+        for label, text in zip(labels, texts):
+            tokens = bm25_tokens(text)
+            if label >= len(self._doc_len):
+                grown = np.zeros(max(label + 1, 2 * len(self._doc_len), 1024), dtype=np.int32)
+                grown[:len(self._doc_len)] = self._doc_len
+                self._doc_len = grown
+            self.n_labels = max(self.n_labels, label + 1)
+            if not tokens:
+                continue
+            counts: Dict[str, int] = {}
+            for t in tokens:
+                counts[t] = counts.get(t, 0) + 1
+            for t, tf in counts.items():
+                posting = self.delta.get(t)
+                if posting is None:
+                    posting = self.delta[t] = (array("q"), array("i"))
+                posting[0].append(label)
+                posting[1].append(tf)
+            self._doc_len[label] = len(tokens)
+            self.n_docs += 1
+            self.total_len += len(tokens)
+
+    def remove(self, labels: Iterable[int]):
+        for label in labels:
+            if 0 <= label < self.n_labels and self._doc_len[label]:
+                self.n_docs -= 1
+                self.total_len -= int(self._doc_len[label])
+                self._doc_len[label] = 0
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        parts = []
+        i = int(np.searchsorted(self.terms, term))
+        if i < len(self.terms) and self.terms[i] == term:
+            parts.append(decode_postings(self.postings[self.offsets[i]:self.offsets[i + 1]]))
+        delta = self.delta.get(term)
+        if delta is not None:
+            # copies: the delta arrays keep growing.
+            parts.append((np.array(delta[0], dtype=np.int64), np.array(delta[1], dtype=np.int64)))
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def _df(self, term: str) -> int:
+        i = int(np.searchsorted(self.terms, term))
+        df = int(self.df[i]) if i < len(self.terms) and self.terms[i] == term else 0
+        delta = self.delta.get(term)
+        return df + (len(delta[0]) if delta is not None else 0)
+
+    def search(self, text: str, k: int = 100, budget_ms: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k (labels, scores) of a query. Terms are scored rarest first; the
+        rarest one always is, and once budget_ms has passed since the call
+        started the remaining (most common, least informative) terms are
+        skipped and the search counts as truncated.
+        """
+        deadline = time.perf_counter() + budget_ms / 1000 if budget_ms else None
+        terms = [(df, t) for df, t in sorted((self._df(t), t) for t in set(bm25_tokens(text))) if df > 0]
+        avgdl = self.avgdl or 1.0
+        all_labels, all_scores = [], []
+        for n_done, (df, term) in enumerate(terms):
+            if n_done and deadline is not None and time.perf_counter() > deadline:
+                self.truncated += 1
+                self.skipped_terms += len(terms) - n_done
+                logger.debug(f"BM25 budget exhausted after {n_done}/{len(terms)} terms")
+                break
+            labels, tfs = self._postings(term)
+            dl = self.doc_len[labels]
+            live = dl > 0
+            labels, tfs, dl = labels[live], tfs[live].astype(np.float32), dl[live]
+            idf = math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            all_labels.append(labels)
+            all_scores.append(idf * tfs * (self.k1 + 1) / (tfs + self.k1 * (1 - self.b + self.b * dl / avgdl)))
+
+        if not all_labels:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        labels, inverse = np.unique(np.concatenate(all_labels), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+        if len(labels) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            labels, scores = labels[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return labels[order], scores[order]
+
+    def stats(self) -> Dict:
+        return {"docs": self.n_docs, "terms": len(self.terms) + len(self.delta),
+                "truncated": self.truncated, "skipped_terms": self.skipped_terms}
+
+    def memory_bytes(self) -> int:
+        delta = sum(len(l) * 8 + len(t) * 4 for l, t in self.delta.values())
+        return self.terms.nbytes + self.offsets.nbytes + self.df.nbytes + self._doc_len.nbytes + delta
+
+    # ----------------------------
+    # Persistence
+    # ----------------------------
+    def save(self, path: Union[str, Path]):
+        """Write the merged segment (base + delta, removed documents dropped) into directory `path`."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        doc_len = self.doc_len
+        terms = sorted(set(self.terms.tolist()) | set(self.delta))
+        kept_terms, offsets, dfs = [], [0], []
+        tmp = path / (POSTINGS_FILE + ".tmp")
+        with open(tmp, "wb") as f:
+            for term in terms:
+                labels, tfs = self._postings(term)
+                live = doc_len[labels] > 0
+                if not live.any():
+                    continue
+                data = encode_postings(labels[live], tfs[live])
+                f.write(data)
+                kept_terms.append(term)
+                offsets.append(offsets[-1] + len(data))
+                dfs.append(int(live.sum()))
+        # release the old mapping before replacing the file under it.
+        self.postings = np.empty(0, dtype=np.uint8)
+        os.replace(tmp, path / POSTINGS_FILE)
+        np.savez(path / (TERMS_FILE + ".tmp.npz"), terms=np.array(kept_terms, dtype=str),
+                 offsets=np.array(offsets, dtype=np.int64), df=np.array(dfs, dtype=np.int32))
+        os.replace(path / (TERMS_FILE + ".tmp.npz"), path / TERMS_FILE)
+        np.save(path / (DOCS_FILE + ".tmp.npy"), doc_len)
+        os.replace(path / (DOCS_FILE + ".tmp.npy"), path / DOCS_FILE)
+        with open(path / (META_FILE + ".tmp"), "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "n_docs": self.n_docs, "total_len": self.total_len}, f)
+        os.replace(path / (META_FILE + ".tmp"), path / META_FILE)
+
+        self.delta = {}
+        self._open(path)
+        logger.info(f"Saved BM25 index: {self.n_docs} docs, {len(self.terms)} terms, {self.offsets[-1] / 2**20:.1f}MB postings")
+
+    def _open(self, path: Path):
+        with np.load(path / TERMS_FILE) as data:
+            self.terms, self.offsets, self.df = data["terms"], data["offsets"], data["df"]
+        if self.offsets[-1]:
+            self.postings = np.memmap(path / POSTINGS_FILE, dtype=np.uint8, mode="r")
+        else:
+            self.postings = np.empty(0, dtype=np.uint8)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "Bm25Index":
+        path = Path(path)
+        with open(path / META_FILE) as f:
+            meta = json.load(f)
+        bm25 = cls(k1=meta["k1"], b=meta["b"])
+        bm25.n_docs, bm25.total_len = meta["n_docs"], meta["total_len"]
+        bm25._doc_len = np.load(path / DOCS_FILE)
+        bm25.n_labels = len(bm25._doc_len)
+        bm25._open(path)
+        return bm25
@@ -0,0 +1,165 @@
+"""
+Corpus-level claim feature extraction.
+
+    python -m app.nlp.bulk_extract claims.jsonl --n-process 8 --batch-size 128
+    python -m app.nlp.bulk_extract claims/evtol.claims
+"""
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+from app.config import DB_PATH
+from app.db.db import init_db
+from app.logger import logger
+from app.nlp.feature_extraction import features_from_doc
+from app.nlp.models import SPACY_MODEL, get_spacy
+
+# components features_from_doc reads: POS tags, lemmas, dependency parse (noun chunks).
+# everything else in the pipeline (ner, textcat, ...) is disabled during bulk runs.
+EXTRACTOR_COMPONENTS = {
+    "transformer", "tok2vec", "tagger", "morphologizer", "attribute_ruler", "lemmatizer", "parser",
+}
+
+_CLAIM_START = re.compile(r'^\s*\d+\.\s')
+
+
+def iter_claims(path: Union[str, Path]) -> Iterator[str]:
+    """
+    Stream claim texts from a file without reading it whole.
+    .jsonl: one object per line with a "claim" field.
+    anything else: numbered claims ("1. ...", "2. ..."), continuation lines appended.
+    """
+    path = Path(path)
+    with open(path) as f:
+        if path.suffix == ".jsonl":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)["claim"]
+            return
+
+        claim: List[str] = []
+        for line in f:
+            if _CLAIM_START.match(line) and claim:
+                yield " ".join(claim)
+                claim = []
+            if line.strip():
+                claim.append(line.strip())
+        if claim:
+            yield " ".join(claim)
+
+
+def disabled_components(nlp) -> List[str]:
+    return [name for name in nlp.pipe_names if name not in EXTRACTOR_COMPONENTS]
+
+
+def keywords_of(feature: str) -> List[str]:
+    from spacy.lang.en.stop_words import STOP_WORDS
+    return [w for w in re.findall(r"[\w/-]+", feature) if len(w) > 2 and w not in STOP_WORDS]
+
+
+class FeatureWriter:
+    """
+    Buffered writer into the features / keywords tables. Each distinct feature
+    text is stored once: texts already in the table (e.g. from an earlier run)
+    reuse their id and get no new keyword rows. Rows are inserted with
+    executemany, one transaction per flush.
+    """
+
+    def __init__(self, conn, flush_every: int = 5000, lookup_chunk: int = 500):
+        self.conn = conn
+        self.flush_every = flush_every
+        self.lookup_chunk = lookup_chunk
+        self.feature_ids: Dict[str, int] = {}
+        self.pending: Dict[str, None] = {}  # insertion-ordered set of texts not flushed yet
+        self.inserted = 0
+
+    def add(self, features: Iterable[str]):
+        for feature in features:
+            if feature not in self.feature_ids:
+                self.pending[feature] = None
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        texts = list(self.pending)
+        with self.conn:
+            for start in range(0, len(texts), self.lookup_chunk):
+                chunk = texts[start:start + self.lookup_chunk]
+                self.feature_ids.update(self.conn.execute(
+                    f"SELECT feature_text, MIN(id) FROM features WHERE feature_text IN ({', '.join('?' * len(chunk))}) "
+                    "GROUP BY feature_text", chunk,
+                ))
+            next_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM features").fetchone()[0] + 1
+            features = list(enumerate((t for t in texts if t not in self.feature_ids), next_id))
+            keywords = [(kw, feature_id) for feature_id, feature in features for kw in keywords_of(feature)]
+            self.conn.executemany("INSERT INTO features (id, feature_text) VALUES (?, ?)", features)
+            self.conn.executemany("INSERT INTO keywords (keyword, feature_id) VALUES (?, ?)", keywords)
+        self.feature_ids.update((feature, feature_id) for feature_id, feature in features)
+        self.inserted += len(features)
+        self.pending.clear()
+
+
+def extract_corpus(
+    claims: Iterable[str],
+    conn,
+    model_name: str = SPACY_MODEL,
+    n_process: int = 1,
+    batch_size: int = 64,
+    log_every: int = 1000,
+) -> Dict:
+    """
+    Extract features of every claim with nlp.pipe and write them to the
+    features / keywords tables. Returns throughput stats.
+    """
+    nlp = get_spacy(model_name)
+    disable = disabled_components(nlp)
+    logger.info(f"Bulk extraction with {model_name}, n_process={n_process}, batch_size={batch_size}, disabled={disable}")
+
+    writer = FeatureWriter(conn)
+    n_docs = 0
+    start = time.perf_counter()
+    for doc in nlp.pipe(claims, batch_size=batch_size, n_process=n_process, disable=disable):
+        writer.add(features_from_doc(doc))
+        n_docs += 1
+        if n_docs % log_every == 0:
+            elapsed = time.perf_counter() - start
+            logger.info(f"{n_docs} docs, {n_docs / elapsed:.1f} docs/sec, "
+                        f"{len(writer.feature_ids) + len(writer.pending)} features")
+    writer.flush()
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        "docs": n_docs,
+        "features": len(writer.feature_ids),
+        "new_features": writer.inserted,
+        "seconds": elapsed,
+        "docs_per_sec": n_docs / elapsed if elapsed > 0 else 0.0,
+    }
+    logger.info(f"Bulk extraction done: {stats}")
+    return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk noun/verb feature extraction over a claim corpus")
+    parser.add_argument("path", help=".jsonl with a claim field, or a numbered .claims text file")
+    parser.add_argument("--db", default=str(DB_PATH / "keywords.db"))
+    parser.add_argument("--model", default=SPACY_MODEL)
+    parser.add_argument("--n-process", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    conn = init_db(args.db)
+    try:
+        stats = extract_corpus(iter_claims(args.path), conn, args.model, args.n_process, args.batch_size)
+    finally:
+        conn.close()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+All-pairs claim similarity over a claim set, e.g. for portfolio review.
+
+    python -m app.nlp.claim_matrix portfolio.jsonl --out pairs.tsv --jaccard 0.3 --cosine 0.8
+
+Feature Jaccard (claim_overlap features) and embedding cosine of every claim
+pair are computed block by block with sparse / dense matrix products; only
+the pairs reaching a threshold are streamed to the output file, so the N x N
+matrix never exists in memory.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from app.logger import logger
+from app.nlp.claim_overlap import noun_verb_phrases
+from app.nlp.embedding import embed_text
+from app.nlp.parse_cache import parse_many
+
+JACCARD_THRESHOLD = 0.3
+COSINE_THRESHOLD = 0.8
+BLOCK_SIZE = 512
+
+
+def feature_incidence(feature_lists: Sequence[Sequence[str]]) -> Tuple[sparse.csr_matrix, List[str]]:
+    """(claims x features) 0/1 CSR matrix of the feature lists, and its feature vocabulary."""
+    vocab: Dict[str, int] = {}
+    indptr, indices = [0], []
+    for features in feature_lists:
+        cols = {vocab.setdefault(f, len(vocab)) for f in features}
+        indices.extend(sorted(cols))
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.float32)
+    matrix = sparse.csr_matrix((data, np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+                               shape=(len(feature_lists), len(vocab)))
+    return matrix, list(vocab)
+
+
+# ----------------------------
+# Blocked all-pairs similarity
+# ----------------------------
+def similar_pairs(
+    incidence: sparse.csr_matrix,
+    embeddings: Optional[np.ndarray] = None,
+    jaccard_threshold: float = JACCARD_THRESHOLD,
+    cosine_threshold: float = COSINE_THRESHOLD,
+    block_size: int = BLOCK_SIZE,
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Yield (i, j, jaccard, cosine) arrays of the pairs i < j whose feature Jaccard
+    reaches jaccard_threshold or whose embedding cosine reaches cosine_threshold,
+    one block of block_size rows at a time. Without embeddings, cosine is NaN
+    and only Jaccard selects pairs.
+
+    Per block: intersections = X[block] @ X.T (sparse), unions from the row
+    sizes; cosines = E[block] @ E.T (dense, block_size x n).
+    """
+    n = incidence.shape[0]
+    sizes = np.asarray(incidence.sum(axis=1)).ravel()
+    incidence_t = incidence.T.tocsc()
+    if embeddings is not None:
+        embeddings = normalize(np.asarray(embeddings, dtype=np.float32))
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        inter = (incidence[start:stop] @ incidence_t).tocoo()
+        rows, cols, shared = inter.row, inter.col, inter.data
+        jaccard = np.zeros((stop - start, n), dtype=np.float32)
+        jaccard[rows, cols] = shared / (sizes[rows + start] + sizes[cols] - shared)
+
+        keep = jaccard >= jaccard_threshold
+        if embeddings is not None:
+            cosine = embeddings[start:stop] @ embeddings.T
+            keep |= cosine >= cosine_threshold
+        # upper triangle only: j > i.
+        i, j = np.nonzero(np.triu(keep, k=start + 1))
+        cos = cosine[i, j] if embeddings is not None else np.full(len(i), np.nan, dtype=np.float32)
+        yield i + start, j, jaccard[i, j], cos
+
+
+def write_pairs(
+    out: Union[str, Path],
+    ids: Sequence[str],
+    incidence: sparse.csr_matrix,
+    embeddings: Optional[np.ndarray] = None,
+    jaccard_threshold: float = JACCARD_THRESHOLD,
+    cosine_threshold: float = COSINE_THRESHOLD,
+    block_size: int = BLOCK_SIZE,
+) -> int:
+    """Stream similar_pairs() to a TSV (id_a, id_b, jaccard, cosine); returns the number of pairs."""
+    n_pairs = 0
+    with open(out, "w") as f:
+        f.write("id_a\tid_b\tjaccard\tcosine\n")
+        for i, j, jaccard, cosine in similar_pairs(incidence, embeddings, jaccard_threshold, cosine_threshold, block_size):
+            f.writelines(f"{ids[a]}\t{ids[b]}\t{jac:.4f}\t{cos:.4f}\n"
+                         for a, b, jac, cos in zip(i.tolist(), j.tolist(), jaccard.tolist(), cosine.tolist()))
+            n_pairs += len(i)
+    return n_pairs
+
+
+def claim_pairs(
+    claims: Sequence[str],
+    ids: Sequence[str],
+    out: Union[str, Path],
+    jaccard_threshold: float = JACCARD_THRESHOLD,
+    cosine_threshold: float = COSINE_THRESHOLD,
+    block_size: int = BLOCK_SIZE,
+) -> Dict:
+    """
+    Extract features and embeddings of `claims` in batches, then write their
+    similar pairs to `out`. Returns stats.
+    """
+    start = time.perf_counter()
+    features = [noun_verb_phrases(doc) for doc in parse_many(list(claims))]
+    incidence, vocab = feature_incidence(features)
+    embeddings = embed_text(list(claims))
+    prepared = time.perf_counter()
+    n_pairs = write_pairs(out, ids, incidence, embeddings, jaccard_threshold, cosine_threshold, block_size)
+    elapsed = time.perf_counter() - start
+    stats = {
+        "claims": len(claims),
+        "features": len(vocab),
+        "pairs": n_pairs,
+        "extract_seconds": prepared - start,
+        "pairs_seconds": elapsed - (prepared - start),
+    }
+    logger.info(f"Claim similarity pairs: {stats}")
+    return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="All-pairs claim similarity above a threshold")
+    parser.add_argument("path", help=".jsonl of {id, claim}")
+    parser.add_argument("--out", required=True, help="output .tsv of similar pairs")
+    parser.add_argument("--jaccard", type=float, default=JACCARD_THRESHOLD)
+    parser.add_argument("--cosine", type=float, default=COSINE_THRESHOLD)
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    args = parser.parse_args(argv)
+
+    with open(args.path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    stats = claim_pairs([r["claim"] for r in records], [str(r["id"]) for r in records], args.out,
+                        args.jaccard, args.cosine, args.block_size)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,7 @@
-import spacy
-import numpy as np
-import faiss
-import networkx as nx
 import re
-from sentence_transformers import SentenceTransformer
-from sklearn.preprocessing import normalize
-from typing import List, Dict
+from typing import List
 from app.logger import logger
-
-# python -m spacy download en_core_web_sm
-# Load English language model
-nlp = spacy.load("en_core_web_sm")
-
-EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2" # 384 dim
-sentence_transformer = SentenceTransformer(EMBED_MODEL)
-def embed_text(texts: List[str]):
-    vecs = sentence_transformer.encode(texts)
-    return vecs
+from app.nlp.parse_cache import parse
 
 def preprocess_claim(text):
     """Clean patent claim text"""
@@ -30,8 +15,17 @@ def extract_noun_verb_phrase(claim: str) -> List[str]:
     """
     NLP-based claim tech feature extraction using dependency + noun phrase parsing
     """
-    claim = preprocess_claim(claim)
-    doc = nlp(claim)  # full linguistic parse tree of the claim.
+    # the parse cache applies preprocess_claim's normalization and shares
+    # the parse with extract_features_nlp.
+    doc = parse(claim)  # full linguistic parse tree of the claim.
+    features = noun_verb_phrases(doc)
+    logger.info(f"Extracted features: {features}")
+    return features
+
+def noun_verb_phrases(doc) -> List[str]:
+    """
+    Noun chunk and verb lemma features of an already parsed claim, e.g. from parse_many().
+    """
     # Filter out very short noun chunks and stopwords
     noun_chunks = [
         chunk.text.lower().strip() 
@@ -47,9 +41,7 @@ def extract_noun_verb_phrase(claim: str) -> List[str]:
     ]
     
     # Combine for Jaccard
-    features = set(noun_chunks + verbs)
-    logger.info(f"Extracted features: {features}")
-    return list(features)
+    return list(set(noun_chunks + verbs))
 
 def jaccard_similarity(set1, set2):
     """Calculate Jaccard similarity between two sets (or lists)"""
@@ -0,0 +1,589 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from app.config import CACHE_PATH, DB_PATH
+from app.logger import logger
+
+# tab separated scheme file, one line per code: code<TAB>parent[<TAB>title]; empty parent for roots.
+CPC_SCHEME = os.getenv("CPC_SCHEME", str(DB_PATH / "cpc_scheme.tsv"))
+CPC_EXPAND_CACHE = int(os.getenv("CPC_EXPAND_CACHE", "65536"))
+
+# CpcPostings.save() files.
+CPC_CODES_FILE = "codes.npz"
+CPC_LABELS_FILE = "labels.npy"
+
+# used when no scheme file is available.
+TOY_EDGES = [
+    ("G06F 9/50", "G06F 9/52"),
+    ("G06F 9/52", "G06F 9/54"),
+    ("G06F 9/54", "G06F 9/56"),
+    ("G06F 9/48", "G06F 9/50"),
+]
+
+# seed keyword -> code table, used when the expanded_keywords table is empty.
+TOY_KEYWORDS = {
+    "consensus": "G06F 9/50",
+    "leader election": "G06F 9/54",
+    "distributed": "G06F 9/52",
+    "lock": "G06F 9/48",
+}
+# vote weight of an expanded_keywords seed keyword and of each of its expansions.
+KEYWORD_WEIGHT = 1.0
+EXPANSION_WEIGHT = 0.5
+
+_CPC_SYMBOL = re.compile(r'^([A-HY]\d\d[A-Z])\s*(\d+)\s*/\s*(\d+)$')
+
+
+def normalize_cpc(code: str) -> str:
+    """Canonical "G06F 9/50" form of a CPC symbol ("g06f9/50", "G06F  9 / 50", ...)."""
+    code = code.strip().upper()
+    m = _CPC_SYMBOL.match(code)
+    if m:
+        return f"{m.group(1)} {int(m.group(2))}/{m.group(3)}"
+    return re.sub(r'\s+', '', code)
+
+
+# ----------------------------
+# CPC Hierarchy Graph
+# ----------------------------
+class CpcGraph:
+    """
+    Undirected CPC hierarchy (parent <-> child edges) in CSR form: the
+    neighbours of node i are indices[indptr[i]:indptr[i + 1]]. Code strings
+    live in one numpy array, so the full scheme costs a few MB instead of a
+    networkx dict-of-dicts. k-hop neighbourhoods are memoized per (code, hops).
+    """
+
+    def __init__(self, codes: np.ndarray, indptr: np.ndarray, indices: np.ndarray, cache_size: int = CPC_EXPAND_CACHE):
+        self.codes = codes
+        self.indptr = indptr
+        self.indices = indices
+        self.node_of: Dict[str, int] = {c: i for i, c in enumerate(codes.tolist())}
+        self._neighbourhood = functools.lru_cache(maxsize=cache_size)(self._bfs)
+
+    @classmethod
+    def from_edges(cls, edges: Iterable[Tuple[str, str]], nodes: Iterable[str] = ()) -> "CpcGraph":
+        node_of: Dict[str, int] = {}
+        for code in nodes:
+            node_of.setdefault(code, len(node_of))
+        src, dst = array("q"), array("q")
+        for a, b in edges:
+            i, j = node_of.setdefault(a, len(node_of)), node_of.setdefault(b, len(node_of))
+            src.extend((i, j))
+            dst.extend((j, i))
+        src, dst = np.frombuffer(src, dtype=np.int64), np.frombuffer(dst, dtype=np.int64)
+
+        order = np.lexsort((dst, src))
+        indices = dst[order].astype(np.int32)
+        indptr = np.zeros(len(node_of) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(node_of)), out=indptr[1:])
+        codes = np.array(list(node_of), dtype=str)
+        return cls(codes, indptr, indices)
+
+    @classmethod
+    def from_scheme(cls, path: Union[str, Path]) -> "CpcGraph":
+        """Build from a code<TAB>parent[<TAB>title] scheme file."""
+        nodes, edges = [], []
+        with open(path) as f:
+            for line in f:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                code = normalize_cpc(fields[0])
+                nodes.append(code)
+                if len(fields) > 1 and fields[1].strip():
+                    edges.append((normalize_cpc(fields[1]), code))
+        return cls.from_edges(edges, nodes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.node_of
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices) // 2
+
+    def neighbours(self, code: str) -> List[str]:
+        i = self.node_of.get(code)
+        if i is None:
+            return []
+        return self.codes[self.indices[self.indptr[i]:self.indptr[i + 1]]].tolist()
+
+    def _bfs(self, node: int, hops: int) -> np.ndarray:
+        seen = np.array([node], dtype=np.int64)
+        frontier = seen
+        for _ in range(hops):
+            starts, ends = self.indptr[frontier], self.indptr[frontier + 1]
+            if not (ends - starts).any():
+                break
+            # gather all neighbour ranges of the frontier at once.
+            lengths = ends - starts
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            frontier = np.setdiff1d(self.indices[offsets], seen)
+            if not len(frontier):
+                break
+            seen = np.union1d(seen, frontier)
+        seen.flags.writeable = False
+        return seen
+
+    def expand(self, codes: Sequence[str], hops: int = 2) -> List[str]:
+        """codes plus every node within `hops` edges of them. Codes not in the scheme are kept as-is."""
+        expanded = set(codes)
+        for code in codes:
+            i = self.node_of.get(code)
+            if i is not None:
+                expanded.update(self.codes[self._neighbourhood(i, hops)].tolist())
+        return list(expanded)
+
+    def precompute(self, hops: int = 2, codes: Optional[Iterable[str]] = None):
+        """Warm the neighbourhood cache, e.g. for the codes a classifier can emit."""
+        for code in (codes if codes is not None else self.codes.tolist()):
+            i = self.node_of.get(code)
+            if i is not None:
+                self._neighbourhood(i, hops)
+
+    def cache_info(self):
+        return self._neighbourhood.cache_info()
+
+    def memory_bytes(self) -> int:
+        return self.codes.nbytes + self.indptr.nbytes + self.indices.nbytes
+
+    # ----------------------------
+    # Persistence
+    # ----------------------------
+    def save(self, path: Union[str, Path]):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp, codes=self.codes, indptr=self.indptr, indices=self.indices)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "CpcGraph":
+        data = np.load(path)
+        return cls(data["codes"], data["indptr"], data["indices"])
+
+
+def load_cpc_graph(scheme: Union[str, Path] = CPC_SCHEME) -> CpcGraph:
+    """
+    CPC graph from the scheme file, through a compiled .npz cache under
+    CACHE_PATH that is rebuilt when the scheme file changes. Falls back to
+    the toy edges when there is no scheme file.
+    """
+    scheme = Path(scheme)
+    if not scheme.exists():
+        logger.warning(f"CPC scheme {scheme} not found, using the toy CPC graph")
+        return CpcGraph.from_edges(TOY_EDGES)
+
+    stat = scheme.stat()
+    compiled = CACHE_PATH / "cpc" / f"{scheme.stem}-{stat.st_size}-{int(stat.st_mtime)}.npz"
+    if compiled.exists():
+        return CpcGraph.load(compiled)
+    graph = CpcGraph.from_scheme(scheme)
+    graph.save(compiled)
+    logger.info(f"Compiled CPC graph: {len(graph)} codes, {graph.n_edges} edges, {graph.memory_bytes() / 2**20:.1f}MB")
+    return graph
+
+
+# ----------------------------
+# CPC Posting Lists
+# ----------------------------
+class CpcPostings:
+    """
+    Per-CPC-code posting lists of vector index labels.
+
+    Postings are int64 arrays of labels, keyed by normalize_cpc() codes: a
+    CSR segment (codes, offsets, labels) written by save() and memory-mapped
+    by load(), plus in-memory arrays of the labels added since. Packed bitmaps
+    (one bit per label, little bit order as faiss.IDSelectorBitmap expects) are
+    built from them on demand and kept in a bounded LRU, so memory stays
+    proportional to the postings rather than to codes x corpus size. Any
+    change to a code's posting drops its cached bitmap.
+
+    Removed patents are not taken out one by one: their tombstoned labels are
+    already excluded from vector search, and purge() drops them in one pass
+    when the vector index is compacted.
+    """
+
+    def __init__(self, max_bitmaps: int = 4096):
+        self.code_ids: Dict[str, int] = {}            # code -> segment row
+        self.offsets = np.zeros(1, dtype=np.int64)     # segment CSR offsets
+        self.base = np.empty(0, dtype=np.int64)        # segment labels
+        self.postings: Dict[str, array] = {}           # labels added since the segment
+        self.max_bitmaps = max_bitmaps
+        self._bitmaps: "OrderedDict[str, tuple]" = OrderedDict()  # code -> (n_labels, packed bitmap)
+        self._lock = threading.RLock()
+
+    def add(self, label: int, codes: Iterable[str]):
+        with self._lock:
+            for code in {normalize_cpc(c) for c in codes if c.strip()}:
+                self.postings.setdefault(code, array("q")).append(label)
+                self._bitmaps.pop(code, None)
+
+    def __contains__(self, code):
+        return code in self.postings or code in self.code_ids
+
+    def labels(self, code: str) -> np.ndarray:
+        with self._lock:
+            return self._labels(code)
+
+    def _labels(self, code: str) -> np.ndarray:
+        # copies: a live numpy view would stop the array from growing on the next add().
+        parts = []
+        row = self.code_ids.get(code)
+        if row is not None:
+            parts.append(np.asarray(self.base[self.offsets[row]:self.offsets[row + 1]]))
+        posting = self.postings.get(code)
+        if posting:
+            parts.append(np.frombuffer(posting, dtype=np.int64).copy())
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts) if len(parts) > 1 else np.array(parts[0])
+
+    def bitmap(self, code: str, n_labels: int) -> np.ndarray:
+        """Packed bitmap over labels [0, n_labels) of the patents classified under `code`."""
+        with self._lock:
+            cached = self._bitmaps.get(code)
+            if cached is not None and cached[0] == n_labels:
+                self._bitmaps.move_to_end(code)
+                return cached[1]
+            bits = np.zeros(n_labels, dtype=bool)
+            labels = self._labels(code)
+            bits[labels[labels < n_labels]] = True
+            packed = np.packbits(bits, bitorder="little")
+            self._bitmaps[code] = (n_labels, packed)
+            if len(self._bitmaps) > self.max_bitmaps:
+                self._bitmaps.popitem(last=False)
+            return packed
+
+    def union(self, codes: Iterable[str], n_labels: int) -> np.ndarray:
+        """Packed bitmap of the patents classified under any of `codes`."""
+        out = np.zeros((n_labels + 7) // 8, dtype=np.uint8)
+        for code in codes:
+            if code in self:
+                out |= self.bitmap(code, n_labels)
+        return out
+
+    def purge(self, dead: np.ndarray) -> int:
+        """
+        Drop the labels in `dead` (e.g. the ones compaction reclaimed) from every
+        posting with one np.isin pass over the segment. Returns how many were dropped.
+        """
+        dead = np.asarray(dead, dtype=np.int64)
+        if not len(dead):
+            return 0
+        with self._lock:
+            keep = ~np.isin(self.base, dead)
+            kept = np.concatenate([[0], np.cumsum(keep)])
+            offsets = kept[self.offsets]
+            changed = [code for code, row in self.code_ids.items()
+                       if offsets[row + 1] - offsets[row] != self.offsets[row + 1] - self.offsets[row]]
+            dropped = len(self.base) - int(keep.sum())
+            self.base, self.offsets = np.asarray(self.base)[keep], offsets
+            for code, posting in self.postings.items():
+                labels = np.frombuffer(posting, dtype=np.int64)
+                live = ~np.isin(labels, dead)
+                if not live.all():
+                    self.postings[code] = array("q", labels[live].tobytes())
+                    changed.append(code)
+                    dropped += int((~live).sum())
+                del labels
+            for code in changed:
+                self._bitmaps.pop(code, None)
+        return dropped
+
+    # ----------------------------
+    # Persistence
+    # ----------------------------
+    def save(self, path: Union[str, Path]):
+        """Merge the segment and the added labels into one CSR segment in directory `path`."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            codes = sorted(set(self.code_ids) | set(self.postings))
+            parts = [self._labels(code) for code in codes]
+            lengths = np.fromiter((len(p) for p in parts), dtype=np.int64, count=len(parts))
+            offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+            labels = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+            del parts
+            np.save(path / (CPC_LABELS_FILE + ".tmp.npy"), labels)
+            np.savez(path / (CPC_CODES_FILE + ".tmp.npz"), codes=np.array(codes, dtype=str), offsets=offsets)
+            os.replace(path / (CPC_LABELS_FILE + ".tmp.npy"), path / CPC_LABELS_FILE)
+            os.replace(path / (CPC_CODES_FILE + ".tmp.npz"), path / CPC_CODES_FILE)
+            self._open(path)
+        logger.info(f"Saved CPC postings: {len(codes)} codes, {len(labels)} labels")
+
+    @classmethod
+    def load(cls, path: Union[str, Path], max_bitmaps: int = 4096) -> "CpcPostings":
+        postings = cls(max_bitmaps)
+        postings._open(Path(path))
+        return postings
+
+    def _open(self, path: Path):
+        with np.load(path / CPC_CODES_FILE) as data:
+            self.code_ids = {code: i for i, code in enumerate(data["codes"].tolist())}
+            self.offsets = data["offsets"]
+        self.base = np.load(path / CPC_LABELS_FILE, mmap_mode="r") if self.offsets[-1] else np.empty(0, dtype=np.int64)
+        self.postings = {}
+        self._bitmaps.clear()
+
+    def overlap(self, labels: np.ndarray, codes_per_query: List[Iterable[str]], rows: np.ndarray, n_labels: int) -> np.ndarray:
+        """
+        For each candidate (rows[i], labels[i]): how many of its query's codes
+        the candidate patent is classified under. One bitmap probe per distinct code.
+        """
+        counts = np.zeros(len(labels), dtype=np.float64)
+        if not len(labels):
+            return counts
+        byte_idx, bit_idx = labels >> 3, (labels & 7).astype(np.uint8)
+
+        queries_of: Dict[str, List[int]] = {}
+        for row, codes in enumerate(codes_per_query):
+            for code in set(codes):
+                if code in self:
+                    queries_of.setdefault(code, []).append(row)
+
+        in_query = np.zeros(len(codes_per_query), dtype=bool)
+        for code, query_rows in queries_of.items():
+            in_query[:] = False
+            in_query[query_rows] = True
+            bits = (self.bitmap(code, n_labels)[byte_idx] >> bit_idx) & 1
+            counts += bits * in_query[rows]
+        return counts
+
+    def clear_cache(self):
+        self._bitmaps.clear()
+
+
+# ----------------------------
+# CPC Keyword Classifier
+# ----------------------------
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _stem(word: str) -> str:
+    # light suffix stripping, so "lock" also matches "locks" / "locking", like the old substring test did.
+    for suffix in ("ing", "ed", "es", "s", "e"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.endswith("ss"):
+            return word[:-len(suffix)]
+    return word
+
+
+def keyword_tokens(text: str) -> List[str]:
+    return [_stem(w) for w in _WORD.findall(text.lower())]
+
+
+class CpcKeywordClassifier:
+    """
+    Keyword -> CPC votes with a word-level Aho-Corasick automaton: every term
+    of the table is found in one left-to-right pass over the claim tokens,
+    whatever the size of the table. Terms match on whole (stemmed) words.
+
+    State is a handful of numpy arrays (goto transitions keyed by
+    state << 32 | word id, failure links, CSR term outputs and CSR term ->
+    (code, weight) votes), saved and loaded with np.savez.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.arrays = arrays
+        self.vocab: Dict[str, int] = {w: i for i, w in enumerate(arrays["vocab"].tolist())}
+        self.goto: Dict[int, int] = dict(zip(arrays["goto_keys"].tolist(), arrays["goto_states"].tolist()))
+        self.fail: List[int] = arrays["fail"].tolist()
+        out_indptr, out_terms = arrays["out_indptr"].tolist(), arrays["out_terms"].tolist()
+        self.outputs: List[Tuple[int, ...]] = [tuple(out_terms[a:b]) for a, b in zip(out_indptr, out_indptr[1:])]
+        vote_indptr = arrays["vote_indptr"].tolist()
+        codes, vote_codes, vote_weights = arrays["codes"].tolist(), arrays["vote_codes"].tolist(), arrays["vote_weights"].tolist()
+        self.votes: List[List[Tuple[str, float]]] = [
+            [(codes[c], w) for c, w in zip(vote_codes[a:b], vote_weights[a:b])]
+            for a, b in zip(vote_indptr, vote_indptr[1:])
+        ]
+
+    @classmethod
+    def build(cls, table: Iterable[Tuple[str, str, float]]) -> "CpcKeywordClassifier":
+        """table: (term, cpc code, weight) rows. A (term, code) pair listed twice keeps its max weight."""
+        term_of: Dict[Tuple[str, ...], int] = {}
+        term_votes: List[Dict[str, float]] = []
+        for term, code, weight in table:
+            tokens = tuple(keyword_tokens(term))
+            if not tokens or not code:
+                continue
+            t = term_of.setdefault(tokens, len(term_of))
+            if t == len(term_votes):
+                term_votes.append({})
+            code = normalize_cpc(code)
+            term_votes[t][code] = max(weight, term_votes[t].get(code, 0.0))
+
+        # trie
+        vocab: Dict[str, int] = {}
+        goto: Dict[int, int] = {}
+        children: List[List[Tuple[int, int]]] = [[]]
+        own: List[List[int]] = [[]]
+        for tokens, t in term_of.items():
+            state = 0
+            for token in tokens:
+                wid = vocab.setdefault(token, len(vocab))
+                nxt = goto.get(state << 32 | wid)
+                if nxt is None:
+                    nxt = goto[state << 32 | wid] = len(children)
+                    children[state].append((wid, nxt))
+                    children.append([])
+                    own.append([])
+                state = nxt
+            own[state].append(t)
+
+        # failure links, breadth first; outputs merged along the failure chain.
+        fail = [0] * len(children)
+        outputs = [list(o) for o in own]
+        queue = deque(child for _, child in children[0])
+        while queue:
+            state = queue.popleft()
+            for wid, child in children[state]:
+                f = fail[state]
+                while f and (f << 32 | wid) not in goto:
+                    f = fail[f]
+                fail[child] = goto.get(f << 32 | wid, 0)
+                outputs[child].extend(outputs[fail[child]])
+                queue.append(child)
+
+        codes = sorted({c for votes in term_votes for c in votes})
+        code_idx = {c: i for i, c in enumerate(codes)}
+        keys = np.fromiter(goto.keys(), dtype=np.int64, count=len(goto))
+        arrays = {
+            "vocab": np.array(list(vocab), dtype=str),
+            "terms": np.array([" ".join(tokens) for tokens in term_of], dtype=str),
+            "codes": np.array(codes, dtype=str),
+            "goto_keys": keys,
+            "goto_states": np.fromiter(goto.values(), dtype=np.int32, count=len(goto)),
+            "fail": np.array(fail, dtype=np.int32),
+            "out_indptr": np.cumsum([0] + [len(o) for o in outputs]).astype(np.int64),
+            "out_terms": np.array([t for o in outputs for t in o], dtype=np.int32),
+            "vote_indptr": np.cumsum([0] + [len(v) for v in term_votes]).astype(np.int64),
+            "vote_codes": np.array([code_idx[c] for v in term_votes for c in v], dtype=np.int32),
+            "vote_weights": np.array([w for v in term_votes for w in v.values()], dtype=np.float32),
+        }
+        return cls(arrays)
+
+    def __len__(self):
+        return len(self.votes)
+
+    def match(self, text: str) -> List[int]:
+        """Ids of the distinct terms occurring in `text`."""
+        found = set()
+        state = 0
+        goto, fail, outputs, vocab = self.goto, self.fail, self.outputs, self.vocab
+        for token in keyword_tokens(text):
+            wid = vocab.get(token)
+            if wid is None:
+                state = 0
+                continue
+            while state and (state << 32 | wid) not in goto:
+                state = fail[state]
+            state = goto.get(state << 32 | wid, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return sorted(found)
+
+    def vote(self, text: str) -> List[Tuple[str, float]]:
+        """Summed (code, weight) votes of the terms found in `text`, best first."""
+        scores: Dict[str, float] = {}
+        for t in self.match(text):
+            for code, weight in self.votes[t]:
+                scores[code] = scores.get(code, 0.0) + weight
+        return sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+
+    def predict(self, text: str, top_k: int = 5, min_share: float = 0.5) -> List[str]:
+        """Codes among the top_k votes with at least min_share of the best vote."""
+        votes = self.vote(text)
+        if not votes:
+            return []
+        best = votes[0][1]
+        return [code for code, score in votes[:top_k] if score >= min_share * best]
+
+    def save(self, path: Union[str, Path]):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp, **self.arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "CpcKeywordClassifier":
+        with np.load(path) as data:
+            return cls({k: data[k] for k in data.files})
+
+
+def keyword_table(conn) -> List[Tuple[str, str, float]]:
+    """
+    (term, code, weight) rows of the expanded_keywords table: the seed keyword
+    votes with KEYWORD_WEIGHT and each expansion with EXPANSION_WEIGHT for
+    every code in ipc_cpc_code (";" or "," separated).
+    """
+    table = []
+    for keyword, expanded, ipc_cpc_code in conn.execute(
+        "SELECT keyword, expanded_keywords, ipc_cpc_code FROM expanded_keywords"
+    ):
+        codes = [c for c in re.split(r"[;,]", ipc_cpc_code) if c.strip()]
+        try:
+            expansions = json.loads(expanded)
+        except json.JSONDecodeError:
+            expansions = []
+        for code in codes:
+            table.append((keyword, code, KEYWORD_WEIGHT))
+            table.extend((term, code, EXPANSION_WEIGHT) for term in expansions if isinstance(term, str))
+    return table
+
+
+def load_cpc_classifier(db_path: Union[str, Path] = DB_PATH / "keywords.db") -> CpcKeywordClassifier:
+    """
+    Classifier over the expanded_keywords table of db_path, persisted under
+    CACHE_PATH keyed by a hash of the table's contents, so any insert, update
+    or delete compiles a fresh one. Falls back to TOY_KEYWORDS when the table
+    is empty.
+    """
+    from app.db.db import init_db
+
+    conn = init_db(db_path)
+    try:
+        table = keyword_table(conn)
+    finally:
+        conn.close()
+    if not table:
+        logger.warning(f"No expanded_keywords in {db_path}, using the toy CPC keyword table")
+        return CpcKeywordClassifier.build((k, c, KEYWORD_WEIGHT) for k, c in TOY_KEYWORDS.items())
+
+    digest = hashlib.blake2b(json.dumps(sorted(table)).encode("utf-8"), digest_size=8).hexdigest()
+    compiled = CACHE_PATH / "cpc" / f"keywords-{Path(db_path).stem}-{digest}.npz"
+    if compiled.exists():
+        return CpcKeywordClassifier.load(compiled)
+    classifier = CpcKeywordClassifier.build(table)
+    classifier.save(compiled)
+    logger.info(f"Compiled CPC keyword classifier: {len(classifier)} terms, {len(classifier.goto)} transitions")
+    return classifier
+
+
+_classifier: Optional[CpcKeywordClassifier] = None
+
+
+def get_cpc_classifier() -> CpcKeywordClassifier:
+    global _classifier
+    if _classifier is None:
+        _classifier = load_cpc_classifier()
+    return _classifier
+
+
+def reset_cpc_classifier():
+    """Drop the process-wide classifier; call after writing expanded_keywords."""
+    global _classifier
+    _classifier = None
@@ -0,0 +1,345 @@
+import atexit
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from app.config import CACHE_PATH
+from app.logger import logger
+from app.nlp.models import EMBED_BACKEND, EMBED_MODEL, get_sentence_transformer
+
+EMBED_CACHE = os.getenv("EMBED_CACHE", "1") != "0"
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "1024"))
+# padded tokens per encode forward pass: short claims get large batches, long ones small.
+EMBED_TOKEN_BUDGET = int(os.getenv("EMBED_TOKEN_BUDGET", "16384"))
+
+VECTORS_FILE = "vectors.f16"
+KEYS_FILE = "keys.bin"
+INDEX_FILE = "index.npz"
+META_FILE = "meta.json"
+LOCK_FILE = "writer.lock"
+
+
+def text_key(model_name: str, text: str) -> bytes:
+    """16-byte content address of (model, whitespace-normalized text)."""
+    normalized = " ".join(text.split())
+    return hashlib.blake2b(f"{model_name}\0{normalized}".encode("utf-8"), digest_size=16).digest()
+
+
+# ----------------------------
+# Embedding Cache
+# ----------------------------
+class EmbeddingCache:
+    """
+    Content-addressed on-disk cache of sentence embeddings for one model.
+
+    Vectors are stored as float16 rows of a memory-mapped file, and keys.bin
+    holds the 16-byte text key of each row; index.npz maps each key to its row,
+    in LRU order. The file grows up to max_bytes, after which the least
+    recently used rows are overwritten. index.npz is only written on flush, so
+    a hit is served only when the row's stored key matches: after an unclean
+    exit, keys whose rows were reused since come back as misses.
+
+    The first process to open a directory holds its writer lock; others open
+    it read-only (lookups only, puts are dropped).
+    """
+
+    def __init__(self, model_name: str, path: Optional[Union[str, Path]] = None, max_bytes: int = EMBED_CACHE_MAX_MB << 20, flush_every: int = 1024):
+        self.model_name = model_name
+        self.path = Path(path) if path else CACHE_PATH / "embeddings" / re.sub(r"[^\w.-]+", "_", model_name)
+        self.max_bytes = max_bytes
+        self.flush_every = flush_every
+        self.dim: Optional[int] = None
+        self.capacity = 0
+        self.vectors: Optional[np.memmap] = None
+        self.row_keys: Optional[np.memmap] = None  # (capacity, 16) uint8, the key stored in each row
+        self.slots: "OrderedDict[bytes, int]" = OrderedDict()  # key -> row, least recently used first
+        self.free: List[int] = []
+        self.hits = 0
+        self.misses = 0
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self.read_only = not self._acquire_writer()
+        self._open()
+
+    def _acquire_writer(self) -> bool:
+        self.path.mkdir(parents=True, exist_ok=True)
+        f = open(self.path / LOCK_FILE, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            logger.warning(f"Embedding cache {self.path} has a writer in another process, opening it read-only")
+            return False
+        self._lock_file = f  # held, and the lock with it, for the life of the cache
+        return True
+
+    def _open(self):
+        if not (self.path / META_FILE).exists():
+            return
+        with open(self.path / META_FILE) as f:
+            meta = json.load(f)
+        self.dim, self.capacity = meta["dim"], meta["capacity"]
+        mode = "r" if self.read_only else "r+"
+        self.vectors = np.memmap(self.path / VECTORS_FILE, dtype=np.float16, mode=mode, shape=(self.capacity, self.dim))
+        if (self.path / INDEX_FILE).exists():
+            index = np.load(self.path / INDEX_FILE)
+            self.slots = OrderedDict(zip((k.tobytes() for k in index["keys"]), index["rows"].tolist()))
+        if not (self.path / KEYS_FILE).exists():
+            if self.read_only:
+                self.slots = OrderedDict()
+                return
+            # caches written before keys.bin existed: trust the index once.
+            self._resize_keys(self.capacity)
+            for k, row in self.slots.items():
+                self.row_keys[row] = np.frombuffer(k, dtype=np.uint8)
+        else:
+            self.row_keys = np.memmap(self.path / KEYS_FILE, dtype=np.uint8, mode=mode, shape=(self.capacity, 16))
+        used = set(self.slots.values())
+        self.free = [row for row in range(self.capacity - 1, -1, -1) if row not in used]
+
+    @property
+    def max_rows(self) -> int:
+        return max(1, self.max_bytes // (2 * self.dim)) if self.dim else 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def get_many(self, keys: List[bytes]):
+        """Returns (vectors, hit_mask); rows of vectors where hit_mask is False are undefined."""
+        with self._lock:
+            rows = [self.slots.get(k) for k in keys]
+            hit = np.array([r is not None for r in rows], dtype=bool)
+            if hit.any():
+                # a row reused after the index was last flushed holds another key.
+                idx = np.flatnonzero(hit)
+                hit_rows = np.array([rows[i] for i in idx], dtype=np.int64)
+                wanted = np.frombuffer(b"".join(keys[i] for i in idx), dtype=np.uint8).reshape(-1, 16)
+                stale = ~(self.row_keys[hit_rows] == wanted).all(axis=1)
+                for i in idx[stale]:
+                    if self.slots.pop(keys[i], None) is not None and not self.read_only:
+                        self.free.append(rows[i])
+                    rows[i] = None
+                hit[idx[stale]] = False
+            out = np.zeros((len(keys), self.dim or 0), dtype=np.float32)
+            if hit.any():
+                hit_rows = [r for r in rows if r is not None]
+                out[hit] = self.vectors[hit_rows]
+                for k, r in zip(keys, rows):
+                    if r is not None:
+                        self.slots.move_to_end(k)
+            self.hits += int(hit.sum())
+            self.misses += len(keys) - int(hit.sum())
+            return out, hit
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray):
+        if self.read_only:
+            return
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            for k, v in zip(keys, vectors):
+                row = self.slots.get(k)
+                if row is None:
+                    row = self._allocate()
+                    self.slots[k] = row
+                else:
+                    self.slots.move_to_end(k)
+                # clear the row's key while its vector is rewritten, then claim it.
+                self.row_keys[row] = 0
+                self.vectors[row] = v
+                self.row_keys[row] = np.frombuffer(k, dtype=np.uint8)
+            self._dirty += len(keys)
+            if self._dirty >= self.flush_every:
+                self._flush()
+
+    def _allocate(self) -> int:
+        if not self.free and self.capacity < self.max_rows:
+            self._grow(min(self.max_rows, max(1024, 2 * self.capacity)))
+        if self.free:
+            return self.free.pop()
+        # full: evict the least recently used entry and reuse its row.
+        _, row = self.slots.popitem(last=False)
+        return row
+
+    def _grow(self, capacity: int):
+        self.path.mkdir(parents=True, exist_ok=True)
+        if self.vectors is not None:
+            self.vectors.flush()
+        with open(self.path / VECTORS_FILE, "ab") as f:
+            f.truncate(capacity * self.dim * 2)
+        self.vectors = np.memmap(self.path / VECTORS_FILE, dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+        self._resize_keys(capacity)
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+        self._write_meta()
+
+    def _resize_keys(self, capacity: int):
+        if self.row_keys is not None:
+            self.row_keys.flush()
+        with open(self.path / KEYS_FILE, "ab") as f:
+            f.truncate(capacity * 16)
+        self.row_keys = np.memmap(self.path / KEYS_FILE, dtype=np.uint8, mode="r+", shape=(capacity, 16))
+
+    def _write_meta(self):
+        tmp = self.path / (META_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"model": self.model_name, "dim": self.dim, "capacity": self.capacity}, f)
+        os.replace(tmp, self.path / META_FILE)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self.vectors is None or self.read_only:
+            return
+        self.vectors.flush()
+        self.row_keys.flush()
+        keys = np.frombuffer(b"".join(self.slots.keys()), dtype="S16")
+        tmp = self.path / (INDEX_FILE + ".tmp.npz")
+        np.savez(tmp, keys=keys, rows=np.fromiter(self.slots.values(), dtype=np.int64, count=len(self.slots)))
+        os.replace(tmp, self.path / INDEX_FILE)
+        self._dirty = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "entries": len(self.slots),
+            "capacity": self.capacity,
+            "size_mb": self.capacity * (self.dim or 0) * 2 / 2**20,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "read_only": self.read_only,
+        }
+
+
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name: str = EMBED_MODEL) -> EmbeddingCache:
+    with _caches_lock:
+        cache = _caches.get(model_name)
+        if cache is None:
+            cache = _caches[model_name] = EmbeddingCache(model_name)
+            atexit.register(cache.flush)
+        return cache
+
+
+# ----------------------------
+# Length-bucketed encoding
+# ----------------------------
+def token_batches(lengths: np.ndarray, token_budget: int = EMBED_TOKEN_BUDGET) -> List[np.ndarray]:
+    """
+    Split text indices into batches of similar token length, longest first:
+    a batch pads to its first (longest) member, and holds as many texts as fit
+    token_budget padded tokens.
+    """
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    batches, start = [], 0
+    while start < len(order):
+        size = max(1, token_budget // max(1, int(lengths[order[start]])))
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+
+_encode_stats = {"texts": 0, "batches": 0, "tokens": 0, "padded_tokens": 0, "seconds": 0.0}
+_encode_stats_lock = threading.Lock()
+
+
+def encode_stats() -> Dict:
+    """Process-wide encoding throughput: tokens/sec and the share of padding in forward passes."""
+    with _encode_stats_lock:
+        stats = dict(_encode_stats)
+    stats["tokens_per_sec"] = stats["tokens"] / stats["seconds"] if stats["seconds"] else 0.0
+    stats["padding_ratio"] = 1 - stats["tokens"] / stats["padded_tokens"] if stats["padded_tokens"] else 0.0
+    return stats
+
+
+def encode_bucketed(texts: List[str], model_name: str = EMBED_MODEL, token_budget: int = EMBED_TOKEN_BUDGET,
+                    backend: str = EMBED_BACKEND) -> np.ndarray:
+    """
+    model.encode(texts) with batches sized by token count instead of a fixed
+    number of texts; rows come back in the order of `texts`.
+    """
+    model = get_sentence_transformer(model_name, backend)
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    start = time.perf_counter()
+    # token counts as the model will see them (special tokens, truncation to max_seq_length).
+    ids = model.tokenizer(texts, truncation=True, max_length=model.max_seq_length)["input_ids"]
+    lengths = np.fromiter((len(x) for x in ids), dtype=np.int64, count=len(ids))
+
+    out, padded = None, 0
+    batches = token_batches(lengths, token_budget)
+    for batch in batches:
+        vecs = np.asarray(
+            model.encode([texts[i] for i in batch], batch_size=len(batch), show_progress_bar=False), dtype=np.float32
+        )
+        if out is None:
+            out = np.empty((len(texts), vecs.shape[1]), dtype=np.float32)
+        out[batch] = vecs
+        padded += len(batch) * int(lengths[batch[0]])
+
+    elapsed = time.perf_counter() - start
+    tokens = int(lengths.sum())
+    with _encode_stats_lock:
+        _encode_stats["texts"] += len(texts)
+        _encode_stats["batches"] += len(batches)
+        _encode_stats["tokens"] += tokens
+        _encode_stats["padded_tokens"] += padded
+        _encode_stats["seconds"] += elapsed
+    logger.debug(f"Encoded {len(texts)} texts in {len(batches)} batches, {tokens / elapsed:.0f} tokens/sec, "
+                 f"{1 - tokens / padded:.1%} padding")
+    return out
+
+
+# ----------------------------
+# Embedding
+# ----------------------------
+def embed_text(texts: List[str], model_name: str = EMBED_MODEL, use_cache: bool = EMBED_CACHE,
+               backend: str = EMBED_BACKEND) -> np.ndarray:
+    """
+    Sentence embeddings of `texts` as a float32 (len(texts), dim) array.
+    Texts already in the embedding cache cost a lookup instead of a forward
+    pass; cached vectors round-trip through float16.
+    backend: torch or onnx (int8), see models.get_sentence_transformer(); both
+    produce vectors of the same space, but each has its own cache.
+    """
+    if not use_cache:
+        return encode_bucketed(texts, model_name, backend=backend)
+
+    cache_name = model_name if backend == "torch" else f"{model_name}@{backend}"
+    cache = get_embedding_cache(cache_name)
+    keys = [text_key(cache_name, t) for t in texts]
+    vecs, hit = cache.get_many(keys)
+    if hit.all():
+        return vecs
+
+    # encode each distinct missing text once.
+    missing: Dict[bytes, int] = {}
+    for i in np.flatnonzero(~hit):
+        missing.setdefault(keys[i], i)
+    encoded = encode_bucketed([texts[i] for i in missing.values()], model_name, backend=backend)
+    cache.put_many(list(missing), encoded)
+
+    if vecs.shape[1] == 0:
+        vecs = np.zeros((len(texts), encoded.shape[1]), dtype=np.float32)
+    by_key = dict(zip(missing, encoded))
+    for i in np.flatnonzero(~hit):
+        vecs[i] = by_key[keys[i]]
+    logger.debug(f"embed_text: {int(hit.sum())} cached, {len(missing)} encoded")
+    return vecs
@@ -1,25 +1,49 @@
-import spacy
+import json
+import os
+import threading
 import numpy as np
 import faiss
-import networkx as nx
-from sentence_transformers import SentenceTransformer
-from sklearn.preprocessing import normalize
-from typing import List, Dict
+from pathlib import Path
+from typing import Iterable, List, Dict, MutableMapping, Optional, Union
 from app.logger import logger
-
-EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2" # 384 dim
-sentence_transformer = SentenceTransformer(EMBED_MODEL)
-def embed_text(texts: List[str]):
-    vecs = sentence_transformer.encode(texts)
-    return vecs
-
-# python -m spacy download en_core_web_trf
-nlp = spacy.load("en_core_web_trf")
+from app.nlp.bm25 import Bm25Index
+from app.nlp.cpc import CpcGraph, CpcPostings, get_cpc_classifier, load_cpc_graph
+from app.nlp.embedding import embed_text
+from app.nlp.minhash import MinHashLsh
+from app.nlp.multivector import MultiVectorIndex
+from app.nlp.parse_cache import parse, parse_many
+from app.nlp.sharded import ShardedIndex
+from app.nlp.vector_index import VectorIndex
+
+PATENTS_FILE = "patents.jsonl"
+BM25_DIR = "bm25"
+CPC_DIR = "cpc"
+FEATURES_DIR = "features"
+DEDUP_FILE = "dedup.npz"
+FAMILIES_FILE = "families.json"
+
+# score fusion weights: claim vector, feature vector, per overlapping expanded CPC code.
+CLAIM_WEIGHT = 0.55
+FEATURE_WEIGHT = 0.30
+CPC_WEIGHT = 0.15
+# hybrid search: BM25 score, normalized by the query's best BM25 hit.
+BM25_WEIGHT = 0.25
+
+# models are loaded lazily and shared process-wide, see app/nlp/models.py;
+# parses are shared with claim_overlap.py through app/nlp/parse_cache.py.
 def extract_features_nlp(claim: str) -> List[str]:
     """
     NLP-based claim tech feature extraction using dependency + noun phrase parsing
     """
-    doc = nlp(claim)  # full linguistic parse tree of the claim.
+    doc = parse(claim)  # full linguistic parse tree of the claim.
+    features = features_from_doc(doc)
+    logger.info(f"Extracted features: {features}")
+    return features
+
+def features_from_doc(doc) -> List[str]:
+    """
+    Noun chunk and verb-object features of an already parsed claim, e.g. from nlp.pipe().
+    """
     features = set()
 
     # Extract noun chunks, minimal noun phrase, tech component of patent novelty.
@@ -35,7 +59,6 @@ def extract_features_nlp(claim: str) -> List[str]:
                 phrase = f"{token.lemma_} {obj.text}" # canonicalize verbs.
                 features.add(phrase.lower())
 
-    logger.info(f"Extracted features: {features}")
     return list(features)
 
 
@@ -59,124 +82,471 @@ def llm_refine_features(features: List[str]) -> List[str]:
 def predict_cpc_codes(claim: str) -> List[str]:
     """
     Replace with fine-tuned transformer classifier.
-    This stub maps keywords to CPC.
+    Keyword -> CPC votes from the expanded_keywords table, see CpcKeywordClassifier.
     """
-    mapping = {
-        "consensus": "G06F 9/50",
-        "leader election": "G06F 9/54",
-        "distributed": "G06F 9/52",
-        "lock": "G06F 9/48"
-    }
-
-    preds = set()
-    text = claim.lower()
-    # map claim keywords to cpc code.
-    for k, v in mapping.items():
-        if k in text:
-            preds.add(v)
-
-    return list(preds) if preds else ["G06F 9/50"]
+    return get_cpc_classifier().predict(claim) or ["G06F 9/50"]
 
 
 # ----------------------------
 # CPC Expansion Graph
 # ----------------------------
-def build_cpc_graph():
-    edges = [
-        ("G06F 9/50", "G06F 9/52"),
-        ("G06F 9/52", "G06F 9/54"),
-        ("G06F 9/54", "G06F 9/56"),
-        ("G06F 9/48", "G06F 9/50")
-    ]
-    G = nx.Graph()
-    G.add_edges_from(edges)
-    return G
-
-def expand_cpc(codes: List[str], graph, hops=2) -> List[str]:
-    expanded = set(codes)
-    for c in codes:
-        for node in nx.single_source_shortest_path_length(graph, c, cutoff=hops):
-            expanded.add(node)
-    return list(expanded)
-
-# ----------------------------
-# Vector Index (FAISS)
-# ----------------------------
-class VectorIndex:
-    def __init__(self, dim):
-        self.index = faiss.IndexFlatIP(dim)
-        self.patent_ids = []
-
-    # add n vectors at once. separately store patent_ids.
-    def add(self, vectors, patent_ids):
-        self.index.add(vectors)
-        self.patent_ids.extend(patent_ids)
-
-    def search(self, query_vec, k=10):
-        if query_vec.ndim == 1:
-            query_vec = query_vec.reshape(1, -1)
-        query_vec = np.ascontiguousarray(query_vec.astype(np.float32))
-
-        scores, ids = self.index.search(query_vec, k)
-        results = []
-        for i, idx in enumerate(ids[0]):
-            if idx != -1: # -1 is the default value for no match
-                results.append((self.patent_ids[idx], float(scores[0, i])))
-        return results
+def build_cpc_graph() -> CpcGraph:
+    return load_cpc_graph()
 
+def expand_cpc(codes: List[str], graph: CpcGraph, hops=2) -> List[str]:
+    return graph.expand(codes, hops)
 
 # ----------------------------
 # claims → features → CPC → vector → patent retrieval
 # ----------------------------
 class PatentSearchEngine:
-    def __init__(self):
+    def __init__(self, index_type: str = "flat", compact_threshold: float = 0.2, multi_vector: bool = False,
+                 dedup: bool = False, **index_params):
+        """
+        index_type: one of vector_index.INDEX_TYPES; index_params are passed to VectorIndex
+        (nlist, hnsw_m, pq_m, nprobe, ef_search, train_sample, quantization, rescore).
+        compact_threshold: tombstoned fraction of the index that triggers a background compaction.
+        multi_vector: also index one embedding per extracted claim feature and score
+        the feature signal by max-sim instead of one embedding of the joined features.
+        dedup: detect near-duplicate claims (continuations, family members) with MinHash
+        LSH; a duplicate is not embedded, and search returns it in its
+        representative's "family" list instead of as a separate hit.
+        """
         self.graph = build_cpc_graph()
         self.index = None
-        self.patents = []
+        self.index_type = index_type
+        self.index_params = index_params
+        self.compact_threshold = compact_threshold
         self.patent_map = {}
+        self._cpc_postings: Optional[CpcPostings] = CpcPostings()
+        self._bm25: Optional[Bm25Index] = Bm25Index()
+        self._compaction: Optional[threading.Thread] = None
+        self.shards: Optional[ShardedIndex] = None
+        self.multi_vector = multi_vector
+        self.features: Optional[MultiVectorIndex] = None
+        self.lsh: Optional[MinHashLsh] = MinHashLsh() if dedup else None
+        self.families: Dict[str, List[str]] = {}  # representative id -> duplicate ids
+        self.family_of: Dict[str, str] = {}       # duplicate id -> representative id
+
+    @property
+    def patents(self) -> List[Dict]:
+        return list(self.patent_map.values())
+
+    @property
+    def cpc_postings(self) -> CpcPostings:
+        # engines saved before postings were persisted: rebuilt from patent metadata on first use.
+        if self._cpc_postings is None:
+            postings = CpcPostings()
+            label_of = self.index.label_of
+            for pid, p in self.patent_map.items():
+                if pid in label_of:
+                    postings.add(label_of[pid], p.get("cpc", []))
+            self._cpc_postings = postings
+        return self._cpc_postings
+
+    @property
+    def bm25(self) -> Bm25Index:
+        # indexes saved before BM25 existed: rebuilt from patent metadata on first use.
+        if self._bm25 is None:
+            bm25 = Bm25Index()
+            label_of = self.index.label_of
+            ordered = sorted(((pid, p) for pid, p in self.patent_map.items() if pid in label_of),
+                             key=lambda kv: label_of[kv[0]])
+            bm25.add((label_of[pid] for pid, _ in ordered), (p["claim"] for _, p in ordered))
+            self._bm25 = bm25
+        return self._bm25
 
     def build_index(self, patents: List[Dict]):
-        self.patents = patents
-        self.patent_map = {p["id"]: p for p in patents}
+        self.patent_map = {}
+        self._cpc_postings = CpcPostings()
+        self._bm25 = Bm25Index()
+        self.index = None
+        self.features = None
+        if self.lsh is not None:
+            self.lsh = MinHashLsh(self.lsh.num_perm, self.lsh.bands, self.lsh.threshold, self.lsh.seed)
+            self.families, self.family_of = {}, {}
+        self.add_patents(patents)
+
+    # ----------------------------
+    # Incremental updates
+    # ----------------------------
+    def add_patents(self, patents: List[Dict]):
+        """
+        Embed and index `patents`. A patent whose id is already indexed is replaced.
+        """
+        if self.lsh is not None:
+            patents = self._collapse_duplicates(patents)
+        if not patents:
+            return
         embeddings = embed_text([p["claim"] for p in patents])
-
-        self.index = VectorIndex(embeddings.shape[1])
+        if self.index is None:
+            self.index = VectorIndex(embeddings.shape[1], self.index_type, **self.index_params)
+        postings, bm25 = self.cpc_postings, self.bm25
+        label_of = self.index.label_of
+        replaced = [label_of[p["id"]] for p in patents if p["id"] in label_of]
         self.index.add(embeddings, [p["id"] for p in patents])
+        bm25.remove(replaced)
+        bm25.add((label_of[p["id"]] for p in patents), (p["claim"] for p in patents))
+        for p in patents:
+            self.patent_map[p["id"]] = p
+            postings.add(label_of[p["id"]], p.get("cpc", []))
+        if self.multi_vector:
+            self._add_features(patents, replaced)
+        self._maybe_compact()
+
+    def _collapse_duplicates(self, patents: List[Dict]) -> List[Dict]:
+        """
+        Attach near duplicates of indexed (or earlier in the batch) claims to their
+        representative's family; returns the patents that still need indexing.
+        """
+        known = [p["id"] for p in patents if p["id"] in self.patent_map]
+        if known:
+            self.remove_patents(known)
+        unique = []
+        for p in patents:
+            sig = self.lsh.signature(p["claim"])
+            hit = self.lsh.query(sig) if sig is not None else None
+            if hit is None:
+                if sig is not None:
+                    self.lsh.add(p["id"], sig)
+                unique.append(p)
+                continue
+            rep = hit[0]
+            self.family_of[p["id"]] = rep
+            self.families.setdefault(rep, []).append(p["id"])
+            self.patent_map[p["id"]] = p
+        if len(unique) < len(patents):
+            logger.info(f"Collapsed {len(patents) - len(unique)} near-duplicate claims into families")
+        return unique
+
+    def _add_features(self, patents: List[Dict], replaced: List[int]):
+        """Extract every claim's features and index one embedding per feature."""
+        features = [features_from_doc(doc) for doc in parse_many([p["claim"] for p in patents])]
+        flat = [f for fs in features for f in fs]
+        vecs = embed_text(flat) if flat else np.zeros((0, self.index.dim), dtype=np.float32)
+        if self.features is None:
+            self.features = MultiVectorIndex(self.index.dim, "hnsw" if self.index_type == "hnsw" else "flat")
+        self.features.remove(replaced)
+        label_of = self.index.label_of
+        start = 0
+        for p, fs in zip(patents, features):
+            self.features.add(label_of[p["id"]], vecs[start:start + len(fs)])
+            start += len(fs)
+
+    def update_patent(self, patent: Dict):
+        self.add_patents([patent])
+
+    def remove_patents(self, patent_ids: Iterable[str]) -> int:
+        """
+        Drop patents from search results immediately; their vectors are reclaimed
+        by the next compaction. Returns how many patents were removed.
+        """
+        patent_ids = list(patent_ids)
+        if self.index is None:
+            return 0
+        orphans: List[Dict] = []
+        if self.lsh is not None:
+            patent_ids, n_duplicates, orphans = self._remove_from_families(patent_ids)
+        label_of = self.index.label_of
+        labels = [label_of[pid] for pid in patent_ids if pid in label_of]
+        self.bm25.remove(labels)
+        if self.features is not None:
+            self.features.remove(labels)
+        removed = self.index.remove(patent_ids)
+        for pid in patent_ids:
+            self.patent_map.pop(pid, None)
+        self._maybe_compact()
+        if self.lsh is not None:
+            # the family of a removed representative is re-indexed; its first member takes over.
+            self.add_patents(orphans)
+            removed += n_duplicates
+        return removed
+
+    def _remove_from_families(self, patent_ids: List[str]):
+        """Drop duplicates from their families; returns (representative ids, #duplicates, orphaned members)."""
+        removing = set(patent_ids)
+        representatives, n_duplicates, orphans = [], 0, []
+        for pid in patent_ids:
+            rep = self.family_of.pop(pid, None)
+            if rep is not None:
+                members = self.families[rep]
+                members.remove(pid)
+                if not members:
+                    del self.families[rep]
+                self.patent_map.pop(pid, None)
+                n_duplicates += 1
+                continue
+            representatives.append(pid)
+            self.lsh.remove([pid])
+            for member in self.families.pop(pid, []):
+                del self.family_of[member]
+                patent = self.patent_map.pop(member)
+                # a member removed in the same call is dropped, not re-elected.
+                if member in removing:
+                    n_duplicates += 1
+                else:
+                    orphans.append(patent)
+        return representatives, n_duplicates, orphans
+
+    def _maybe_compact(self):
+        if self.index.tombstone_ratio() >= self.compact_threshold:
+            self.compact(background=True)
+
+    def compact(self, background: bool = False):
+        """
+        Rebuild the vector index, and the feature index when there is one,
+        without tombstoned vectors. With background=True the rebuild runs in a
+        daemon thread while searches keep being served.
+        """
+        if not background:
+            return self._compact()
+        if self._compaction is None or not self._compaction.is_alive():
+            self._compaction = threading.Thread(
+                target=self._compact, name="vector-index-compaction", daemon=True
+            )
+            self._compaction.start()
+        return self._compaction
+
+    def _compact(self) -> int:
+        tombstoned = set(self.index.deleted)
+        dropped = self.index.compact()
+        if self.features is not None:
+            self.features.compact()
+        if dropped and self._cpc_postings is not None:
+            # CPC postings keep tombstoned labels until now: vector search already skips them.
+            reclaimed = tombstoned - self.index.deleted
+            self._cpc_postings.purge(np.fromiter(reclaimed, dtype=np.int64, count=len(reclaimed)))
+        return dropped
+
+    # ----------------------------
+    # Sharded search
+    # ----------------------------
+    def shard(self, n_shards: int, path: Union[str, Path], threads_per_shard: int = 1) -> ShardedIndex:
+        """
+        Serve dense retrieval from n_shards worker processes over memory-mapped
+        shards of the current index, written into directory `path`.
+        """
+        self.close_shards()
+        self.shards = ShardedIndex.build(self.index, path, n_shards, threads_per_shard)
+        return self.shards
+
+    def close_shards(self):
+        if self.shards is not None:
+            self.shards.close()
+            self.shards = None
+
+    def save(self, path: Union[str, Path]):
+        """
+        Persist the vector index, its id sidecar, the BM25 index and the patent
+        metadata into directory `path`, so a restart can load() instead of re-embedding.
+        """
+        path = Path(path)
+        self.save_indexes(path)
+        tmp = path / (PATENTS_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            for p in self.patents:
+                f.write(json.dumps(p) + "\n")
+        os.replace(tmp, path / PATENTS_FILE)
+
+    def save_indexes(self, path: Path):
+        """Everything save() writes except patents.jsonl."""
+        self.index.save(path)
+        self.bm25.save(path / BM25_DIR)
+        self.cpc_postings.save(path / CPC_DIR)
+        if self.features is not None:
+            self.features.save(path / FEATURES_DIR)
+        if self.lsh is not None:
+            self.lsh.save(path / DEDUP_FILE)
+            tmp = path / (FAMILIES_FILE + ".tmp")
+            with open(tmp, "w") as f:
+                json.dump(self.families, f)
+            os.replace(tmp, path / FAMILIES_FILE)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], mmap: bool = True,
+             patent_map: Optional[MutableMapping[str, Dict]] = None) -> "PatentSearchEngine":
+        """
+        Load an engine written by save(). The vectors are memory-mapped by default,
+        see VectorIndex.load(). patent_map: patent metadata by id to use instead
+        of reading path/patents.jsonl into memory, e.g. ingest.PatentStore.
+        """
+        path = Path(path)
+        engine = cls()
+        engine.index = VectorIndex.load(path, mmap=mmap)
+        engine.index_type = engine.index.index_type
+        if patent_map is None:
+            with open(path / PATENTS_FILE) as f:
+                patents = [json.loads(line) for line in f if line.strip()]
+            patent_map = {p["id"]: p for p in patents}
+        engine.patent_map = patent_map
+        # engines saved before postings were persisted rebuild them on first use.
+        engine._cpc_postings = CpcPostings.load(path / CPC_DIR) if (path / CPC_DIR).exists() else None
+        engine._bm25 = Bm25Index.load(path / BM25_DIR) if (path / BM25_DIR).exists() else None
+        if (path / FEATURES_DIR).exists():
+            engine.features = MultiVectorIndex.load(path / FEATURES_DIR, mmap=mmap)
+            engine.multi_vector = True
+        if (path / DEDUP_FILE).exists():
+            engine.lsh = MinHashLsh.load(path / DEDUP_FILE)
+            with open(path / FAMILIES_FILE) as f:
+                engine.families = json.load(f)
+            engine.family_of = {m: rep for rep, members in engine.families.items() for m in members}
+        logger.info(f"Loaded {len(engine.index)} vectors, {len(engine.patent_map)} patents from {path}")
+        return engine
 
     def search(self, claim: str, k=10):
-        features = extract_features_nlp(claim)
-        #features = llm_refine_features(features)
-
-        cpc = predict_cpc_codes(claim)
-        expanded_cpc = expand_cpc(cpc, self.graph)
-
-        # --- Dual embeddings ---
-        q_claim = embed_text([claim])[0]  
-        q_feat  = embed_text([" ".join(features)])[0]
-        vec_results_claim = self.index.search(q_claim, k=100)
-        vec_results_feat  = self.index.search(q_feat,  k=100)
+        return self.search_many([claim], k)[0]
+
+    def search_many(
+        self, claims: List[str], k=10, candidates=100, batch_size=64, cpc_filter=False,
+        hybrid=False, budget_ms: Optional[float] = None,
+    ) -> List[List]:
+        """
+        Batched search: uncached claims are parsed with nlp.pipe, claims and feature strings
+        are embedded in one encode call, and all query vectors go to faiss
+        as a single matrix query. Returns one [(patent, score), ...] list per claim.
+
+        cpc_filter: only retrieve patents classified under one of the query's expanded
+        CPC codes; each query then searches faiss with its own CPC bitmap ID selector.
+        With dedup, each hit carries the ids of its near duplicates in "family".
+        With multi_vector, feature candidates also come from the per-feature index and
+        every candidate's feature score is the mean max-sim of the query features.
+        hybrid: also retrieve BM25 candidates over the claim text and fuse their
+        normalized scores, so exact terms (part numbers, chemical names) count.
+        budget_ms: BM25 latency budget per query, started when that query's BM25
+        scoring starts; past it the commonest terms are skipped (the rarest one is
+        always scored). Truncated queries are counted in bm25.stats() and logged.
+        """
+        if not claims:
+            return []
+        n = len(claims)
+        docs = parse_many(claims, batch_size=batch_size)
+        features = [features_from_doc(doc) for doc in docs]
+        #features = [llm_refine_features(f) for f in features]
+
+        expanded_cpc = [expand_cpc(predict_cpc_codes(claim), self.graph) for claim in claims]
+
+        # --- Dual embeddings, one matrix query ---
+        multi = self.features is not None
+        if not multi:
+            queries = embed_text(claims + [" ".join(f) for f in features])
+            weights = np.array([CLAIM_WEIGHT, FEATURE_WEIGHT])
+        else:
+            vecs = embed_text(claims + [f for fs in features for f in fs])
+            queries, feature_vecs = vecs[:n], vecs[n:]
+            feature_rows = np.repeat(np.arange(n), [len(fs) for fs in features])
+            weights = np.array([CLAIM_WEIGHT])
+        if cpc_filter:
+            scores, labels = self._search_cpc_filtered(queries, expanded_cpc, candidates)
+        else:
+            scores, labels = (self.shards or self.index).search_raw(queries, k=candidates)
 
         # --- Score fusion ---
-        scores = {}
-        for pid, score in vec_results_claim:
-            scores[pid] = scores.get(pid, 0) + 0.55 * score
-
-        for pid, score in vec_results_feat:
-            scores[pid] = scores.get(pid, 0) + 0.30 * score
-
-        # CPC filter + rerank
-        final = []
-        for pid, base_score in scores.items():
-            p = self.patent_map[pid]
-            cpc_overlap = len(set(p["cpc"]) & set(expanded_cpc)) # claim expanded cpc overlap with patent cpc
-            total = (
-                base_score
-                + 0.15 * cpc_overlap
-            )
-            final.append((p, total))
+        # (query row, label) pairs from all query vectors, summed with np.unique + bincount.
+        rows = np.tile(np.repeat(np.arange(n), candidates), len(weights))
+        labels = labels.ravel()
+        weighted = (scores * np.repeat(weights, n)[:, None]).ravel()
+        valid = labels != -1 # -1 is the default value for no match
+        rows, labels, weighted = rows[valid], labels[valid], weighted[valid]
+        if hybrid:
+            cpc_codes = expanded_cpc if cpc_filter else None
+            rows, labels, weighted = self._add_bm25(claims, candidates, budget_ms, cpc_codes, rows, labels, weighted)
+        if multi:
+            feature_rows_hit, feature_labels = self.features.candidates(feature_vecs, feature_rows, m=candidates)
+            if cpc_filter:
+                keep = self._in_cpc(feature_labels, feature_rows_hit, expanded_cpc)
+                feature_rows_hit, feature_labels = feature_rows_hit[keep], feature_labels[keep]
+            rows = np.concatenate([rows, feature_rows_hit])
+            labels = np.concatenate([labels, feature_labels])
+            weighted = np.concatenate([weighted, np.zeros(len(feature_labels))])
+
+        span = np.int64(len(self.index.patent_ids) + 1)
+        pairs, inverse = np.unique(rows * span + labels, return_inverse=True)
+        base = np.bincount(inverse, weights=weighted)
+        rows, labels = pairs // span, pairs % span
+        if multi:
+            base += FEATURE_WEIGHT * self._feature_maxsim(feature_vecs, feature_rows, rows, labels, n)
+
+        # CPC rerank: claim expanded cpc overlap with patent cpc, via posting bitmaps.
+        overlap = self.cpc_postings.overlap(labels, expanded_cpc, rows, len(self.index.patent_ids))
+        total = base + CPC_WEIGHT * overlap
+
+        # top-k per query: sort by (row, -score), then keep the first k of each row.
+        order = np.lexsort((-total, rows))
+        rows, labels, total = rows[order], labels[order], total[order]
+        row_start = np.searchsorted(rows, np.arange(n))
+        keep = np.arange(len(rows)) - row_start[rows] < k
+
+        results = [[] for _ in range(n)]
+        for row, label, score in zip(rows[keep], labels[keep], total[keep]):
+            pid = str(self.index.patent_ids[label])
+            patent = self.patent_map[pid]
+            if pid in self.families:
+                patent = {**patent, "family": list(self.families[pid])}
+            results[row].append((patent, float(score)))
+        return results
 
-        final.sort(key=lambda x: -x[1])
-        return final[:k]
+    def _add_bm25(self, claims: List[str], candidates: int, budget_ms: Optional[float], cpc_codes, rows, labels, weighted):
+        """
+        Append each claim's BM25 top candidates, scaled to [0, BM25_WEIGHT], to the fusion
+        arrays. With cpc_codes, candidates outside the claim's CPC bitmap are dropped.
+        """
+        all_rows, all_labels, all_weighted = [rows], [labels], [weighted]
+        truncated = self.bm25.truncated
+        for i, claim in enumerate(claims):
+            bm25_labels, bm25_scores = self.bm25.search(claim, k=candidates, budget_ms=budget_ms)
+            if cpc_codes is not None and len(bm25_labels):
+                keep = self._in_cpc(bm25_labels, np.zeros(len(bm25_labels), dtype=np.int64), [cpc_codes[i]])
+                bm25_labels, bm25_scores = bm25_labels[keep], bm25_scores[keep]
+            if not len(bm25_labels):
+                continue
+            all_rows.append(np.full(len(bm25_labels), i, dtype=rows.dtype))
+            all_labels.append(bm25_labels)
+            all_weighted.append(BM25_WEIGHT * bm25_scores / bm25_scores[0])
+        if self.bm25.truncated > truncated:
+            logger.warning(f"BM25 budget of {budget_ms}ms truncated {self.bm25.truncated - truncated}/{len(claims)} queries")
+        return np.concatenate(all_rows), np.concatenate(all_labels), np.concatenate(all_weighted)
+
+    def _in_cpc(self, labels: np.ndarray, rows: np.ndarray, codes_per_query: List[List[str]]) -> np.ndarray:
+        """Mask of the candidates (rows[i], labels[i]) classified under one of their query's codes."""
+        return self.cpc_postings.overlap(labels, codes_per_query, rows, len(self.index.patent_ids)) > 0
+
+    def _feature_maxsim(self, feature_vecs: np.ndarray, feature_rows: np.ndarray, rows: np.ndarray, labels: np.ndarray, n: int):
+        """
+        Mean over each query's features of the best match among the candidate's
+        features (sum of max-sims / number of query features, so it stays on the
+        cosine scale FEATURE_WEIGHT was set for). rows must be sorted.
+        """
+        out = np.zeros(len(rows))
+        bounds = np.searchsorted(rows, np.arange(n + 1))
+        for i in range(n):
+            q = feature_vecs[feature_rows == i]
+            a, b = bounds[i], bounds[i + 1]
+            if len(q) and b > a:
+                out[a:b] = self.features.maxsim(q, labels[a:b]) / len(q)
+        return out
+
+    def _search_cpc_filtered(self, queries: np.ndarray, expanded_cpc: List[List[str]], candidates: int):
+        """
+        Per-query faiss search restricted, through an IDSelectorBitmap, to the union
+        of the posting lists of the query's expanded CPC codes.
+        """
+        n = len(expanded_cpc)
+        n_labels = len(self.index.patent_ids)
+        per_query = len(queries) // n  # query i owns rows i, n + i, ...
+        if self.shards is not None:
+            bitmaps = [self.cpc_postings.union(codes, n_labels) for codes in expanded_cpc]
+            return self.shards.search_raw(queries, k=candidates, bitmaps=bitmaps * per_query)
+        scores = np.full((len(queries), candidates), -np.inf, dtype=np.float32)
+        labels = np.full((len(queries), candidates), -1, dtype=np.int64)
+        for i, codes in enumerate(expanded_cpc):
+            bitmap = self.cpc_postings.union(codes, n_labels)
+            if not bitmap.any():
+                continue
+            sel = faiss.IDSelectorBitmap(bitmap)
+            own = list(range(i, len(queries), n))
+            s, l = self.index.search_raw(queries[own], k=candidates, sel=sel)
+            scores[own], labels[own] = s, l
+        return scores, labels
 
 if __name__ == "__main__":
     patents = [
@@ -0,0 +1,311 @@
+"""
+Streaming corpus ingestion into a PatentSearchEngine directory.
+
+    python -m app.nlp.ingest patents.jsonl more.parquet --out index/ --chunk-size 1024
+    python -m app.nlp.ingest patents.jsonl --out index/            # resumes after a crash
+
+Patents are read lazily, embedded and indexed chunk by chunk. Periodically
+the indexes are saved into a new checkpoint-<n>/
+directory and manifest.json, replaced atomically, names it and records how
+far into each source file it got, so a rerun continues from the last commit.
+Patent metadata is appended to patents.jsonl; only ids and file offsets are
+kept in memory. Load the result with load_ingested().
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+from collections.abc import MutableMapping
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from app.logger import logger
+from app.nlp.embedding import encode_stats
+from app.nlp.feature_extraction import PATENTS_FILE, PatentSearchEngine
+
+MANIFEST_FILE = "manifest.json"
+CHECKPOINT_PREFIX = "checkpoint-"
+# a checkpoint rewrites the whole index, so its cost grows with the corpus.
+# Commits are spaced to at least COMMIT_INTERVAL_S and to at most COMMIT_SHARE
+# of ingestion time: the gap grows with the checkpoint cost, commits get
+# geometrically rarer, and total checkpoint I/O stays linear in corpus size.
+COMMIT_INTERVAL_S = float(os.getenv("INGEST_COMMIT_INTERVAL_S", "60"))
+COMMIT_SHARE = float(os.getenv("INGEST_COMMIT_SHARE", "0.2"))
+
+
+def _patent(record: Dict) -> Dict:
+    cpc = record.get("cpc") or []
+    if isinstance(cpc, str):
+        cpc = [c.strip() for c in re.split(r"[;,]", cpc) if c.strip()]
+    return {**record, "id": str(record["id"]), "cpc": list(cpc)}
+
+
+# ----------------------------
+# Readers
+# ----------------------------
+def iter_jsonl(path: Union[str, Path], position: int = 0) -> Iterator[Tuple[int, Dict]]:
+    """(byte offset after the record, patent) from `position` on."""
+    with open(path, "rb") as f:
+        f.seek(position)
+        for line in iter(f.readline, b""):
+            if line.strip():
+                yield f.tell(), _patent(json.loads(line))
+
+
+def iter_parquet(path: Union[str, Path], position: int = 0, batch_size: int = 4096) -> Iterator[Tuple[int, Dict]]:
+    """(rows read, patent) from row `position` on; row groups before it are not read."""
+    import pyarrow.parquet as pq
+
+    pf = pq.ParquetFile(path)
+    row = 0
+    for group in range(pf.num_row_groups):
+        n_rows = pf.metadata.row_group(group).num_rows
+        if row + n_rows <= position:
+            row += n_rows
+            continue
+        for batch in pf.iter_batches(batch_size=batch_size, row_groups=[group]):
+            for record in batch.to_pylist():
+                row += 1
+                if row > position:
+                    yield row, _patent(record)
+
+
+def iter_patents(path: Union[str, Path], position: int = 0) -> Iterator[Tuple[int, Dict]]:
+    """
+    Stream patents ({id, claim, cpc}) from a .jsonl or .parquet file, each with
+    the position to resume from once it has been committed.
+    """
+    if Path(path).suffix == ".parquet":
+        return iter_parquet(path, position)
+    return iter_jsonl(path, position)
+
+
+# ----------------------------
+# Patent metadata
+# ----------------------------
+class PatentStore(MutableMapping):
+    """
+    Patents by id in an append-only jsonl file; only each id's (offset, length)
+    is kept in memory and records are read back on access. Writing a patent
+    appends a line, and a later line for an id supersedes earlier ones.
+    Lines past `end` bytes are ignored.
+    """
+
+    def __init__(self, path: Union[str, Path], end: Optional[int] = None, writable: bool = True):
+        self.path = Path(path)
+        self._file = open(self.path, "a+b" if writable else "rb")
+        self._file.seek(0)
+        self.offsets: Dict[str, Tuple[int, int]] = {}
+        position = 0
+        for line in iter(self._file.readline, b""):
+            if end is not None and position + len(line) > end:
+                break
+            if line.strip():
+                self.offsets[json.loads(line)["id"]] = (position, len(line))
+            position += len(line)
+        self.size = position
+
+    def __getitem__(self, pid: str) -> Dict:
+        offset, length = self.offsets[pid]
+        self._file.flush()
+        return json.loads(os.pread(self._file.fileno(), length, offset))
+
+    def __setitem__(self, pid: str, patent: Dict):
+        line = (json.dumps(patent) + "\n").encode("utf-8")
+        self._file.write(line)
+        self.offsets[pid] = (self.size, len(line))
+        self.size += len(line)
+
+    def __delitem__(self, pid: str):
+        del self.offsets[pid]
+
+    def __contains__(self, pid) -> bool:
+        return pid in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+# ----------------------------
+# Manifest
+# ----------------------------
+def read_manifest(out: Path) -> Dict:
+    if not (out / MANIFEST_FILE).exists():
+        return {"files": {}, "patents_bytes": 0, "chunks": 0}
+    with open(out / MANIFEST_FILE) as f:
+        return json.load(f)
+
+
+def write_manifest(out: Path, manifest: Dict):
+    tmp = out / (MANIFEST_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, out / MANIFEST_FILE)
+
+
+def _fsync_tree(path: Path):
+    for file in path.rglob("*"):
+        if file.is_file():
+            fd = os.open(file, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+def _commit(engine: PatentSearchEngine, out: Path, store: PatentStore, manifest: Dict):
+    # every commit writes a fresh checkpoint directory that only becomes live
+    # when the manifest naming it replaces the old one: a crash at any point
+    # leaves the previous checkpoint and manifest intact, and replays its chunks.
+    store.sync()
+    generation = manifest.get("generation", 0) + 1
+    checkpoint = out / f"{CHECKPOINT_PREFIX}{generation}"
+    if checkpoint.exists():
+        shutil.rmtree(checkpoint)  # left behind by a crashed commit
+    engine.save_indexes(checkpoint)
+    _fsync_tree(checkpoint)
+    manifest["generation"] = generation
+    manifest["checkpoint"] = checkpoint.name
+    manifest["patents_bytes"] = store.size
+    write_manifest(out, manifest)
+    for old in out.glob(f"{CHECKPOINT_PREFIX}*"):
+        if old != checkpoint:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def load_ingested(out: Union[str, Path], mmap: bool = True, writable: bool = False) -> PatentSearchEngine:
+    """The engine of the last commit of ingest() into `out`, patents served from patents.jsonl."""
+    out = Path(out)
+    manifest = read_manifest(out)
+    store = PatentStore(out / PATENTS_FILE, end=manifest["patents_bytes"], writable=writable)
+    # directories ingested before checkpoints existed keep their indexes in `out` itself.
+    path = out / manifest["checkpoint"] if "checkpoint" in manifest else out
+    return PatentSearchEngine.load(path, mmap=mmap, patent_map=store)
+
+
+# ----------------------------
+# Ingestion
+# ----------------------------
+def ingest(
+    sources: Sequence[Union[str, Path]],
+    out: Union[str, Path],
+    chunk_size: int = 1024,
+    commit_interval_s: float = COMMIT_INTERVAL_S,
+    index_type: str = "flat",
+    commit_share: float = COMMIT_SHARE,
+    **index_params,
+) -> Dict:
+    """
+    Embed and index the patents of `sources` into ingestion directory `out`,
+    chunk_size patents per embed call. Resumes from out/manifest.json when present.
+    Index types that need training get a first chunk of train_sample patents.
+    A checkpoint is committed once commit_interval_s have passed since the last
+    one and checkpointing would take at most commit_share of the time.
+    Returns ingestion stats.
+    """
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(out)
+    # drop metadata rows written after the last commit.
+    with open(out / PATENTS_FILE, "ab") as f:
+        f.truncate(manifest["patents_bytes"])
+
+    if manifest["chunks"]:
+        engine = load_ingested(out, mmap=False, writable=True)
+        logger.info(f"Resuming ingestion at chunk {manifest['chunks']}, {len(engine.patent_map)} patents indexed")
+    else:
+        engine = PatentSearchEngine(index_type=index_type, **index_params)
+        engine.patent_map = PatentStore(out / PATENTS_FILE)
+        manifest["index_type"] = index_type
+    store = engine.patent_map
+
+    n_patents, start = 0, time.perf_counter()
+    n_commits, commit_seconds = 0, 0.0
+    last_commit, last_commit_cost = start, 0.0
+    try:
+        for source in sources:
+            state = manifest["files"].setdefault(str(source), {"position": 0, "done": False})
+            if state["done"]:
+                continue
+            stream = iter_patents(source, state["position"])
+            size = chunk_size
+            if engine.index is None and index_type in ("ivf", "ivfpq"):
+                size = max(chunk_size, index_params.get("train_sample", 100_000))
+            while True:
+                chunk = list(islice(stream, size))
+                if not chunk:
+                    break
+                size = chunk_size
+                patents = [p for _, p in chunk]
+                engine.add_patents(patents)
+                state["position"] = chunk[-1][0]
+                manifest["chunks"] += 1
+                n_patents += len(patents)
+                now = time.perf_counter()
+                if now - last_commit >= max(commit_interval_s, last_commit_cost / commit_share):
+                    _commit(engine, out, store, manifest)
+                    last_commit = time.perf_counter()
+                    last_commit_cost = last_commit - now
+                    n_commits += 1
+                    commit_seconds += last_commit_cost
+                    elapsed = last_commit - start
+                    logger.info(f"Committed chunk {manifest['chunks']} in {last_commit_cost:.1f}s: {n_patents} patents, "
+                                f"{n_patents / elapsed:.1f} patents/sec, {encode_stats()['tokens_per_sec']:.0f} tokens/sec")
+            state["done"] = True
+        if engine.index is not None:
+            now = time.perf_counter()
+            _commit(engine, out, store, manifest)
+            n_commits += 1
+            commit_seconds += time.perf_counter() - now
+    finally:
+        store.close()
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        "patents": n_patents,
+        "indexed": len(engine.index) if engine.index is not None else 0,
+        "chunks": manifest["chunks"],
+        "commits": n_commits,
+        "commit_seconds": commit_seconds,
+        "seconds": elapsed,
+        "patents_per_sec": n_patents / elapsed if elapsed > 0 else 0.0,
+        "encode": encode_stats(),
+    }
+    logger.info(f"Ingestion done: {stats}")
+    return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Stream patent files into a search index directory")
+    parser.add_argument("sources", nargs="+", help=".jsonl or .parquet files of {id, claim, cpc} patents")
+    parser.add_argument("--out", required=True, help="ingestion directory, see load_ingested()")
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--commit-interval", type=float, default=COMMIT_INTERVAL_S,
+                        help="minimum seconds between checkpoints")
+    parser.add_argument("--commit-share", type=float, default=COMMIT_SHARE,
+                        help="largest share of ingestion time spent writing checkpoints")
+    parser.add_argument("--index-type", default="flat")
+    args = parser.parse_args(argv)
+
+    stats = ingest(args.sources, args.out, args.chunk_size, args.commit_interval, args.index_type,
+                   commit_share=args.commit_share)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
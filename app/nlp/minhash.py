@@ -0,0 +1,136 @@
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from app.logger import logger
+
+# near-duplicate threshold on estimated Jaccard similarity of claim shingles.
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+SHINGLE_SIZE = 3
+NUM_PERM = 128
+BANDS = 16  # 16 bands of 8 rows: candidate pairs from a Jaccard of ~0.7 up
+
+_WORD = re.compile(r"[a-z0-9]+")
+_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """crc32 hashes of the distinct word `size`-grams of text."""
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(g.encode()) for g in grams), dtype=np.uint64)
+
+
+# ----------------------------
+# MinHash LSH
+# ----------------------------
+class MinHashLsh:
+    """
+    MinHash signatures of claim shingles, banded into hash buckets so near
+    duplicates are found without comparing against every indexed claim.
+    Keys are patent ids. Candidates sharing a bucket in any band are
+    verified by the fraction of equal signature slots (estimated Jaccard).
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = BANDS, threshold: float = DEDUP_THRESHOLD, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm {num_perm} is not a multiple of bands {bands}")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.threshold = threshold
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        # universal hashes (a * x + b) mod 2^61 - 1; a < 2^29 keeps a * x inside uint64.
+        self.a = rng.integers(1, 1 << 29, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+        self.keys: List[Optional[str]] = []
+        self.row_of: Dict[str, int] = {}
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+
+    def __len__(self):
+        return len(self.row_of)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """MinHash signature of text, None when it has no words."""
+        hashes = shingles(text)
+        if not len(hashes):
+            return None
+        return (((hashes[:, None] * self.a + self.b) % _PRIME) & _MAX_HASH).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, sig: np.ndarray) -> List[bytes]:
+        return [band.tobytes() for band in sig.reshape(self.bands, -1)]
+
+    def add(self, key: str, sig: np.ndarray):
+        if key in self.row_of:
+            self.remove([key])
+        row = len(self.keys)
+        self.keys.append(key)
+        self.row_of[key] = row
+        if row >= len(self.signatures):
+            grown = np.zeros((max(row + 1, 2 * len(self.signatures), 1024), self.num_perm), dtype=np.uint32)
+            grown[:len(self.signatures)] = self.signatures
+            self.signatures = grown
+        self.signatures[row] = sig
+        for buckets, band in zip(self.buckets, self._band_keys(sig)):
+            buckets.setdefault(band, []).append(row)
+
+    def remove(self, keys: Iterable[str]):
+        for key in keys:
+            row = self.row_of.pop(key, None)
+            if row is None:
+                continue
+            self.keys[row] = None
+            for buckets, band in zip(self.buckets, self._band_keys(self.signatures[row])):
+                rows = buckets[band]
+                rows.remove(row)
+                if not rows:
+                    del buckets[band]
+
+    def query(self, sig: np.ndarray) -> Optional[Tuple[str, float]]:
+        """(key, estimated Jaccard) of the closest indexed near duplicate of sig, or None."""
+        candidates = set()
+        for buckets, band in zip(self.buckets, self._band_keys(sig)):
+            candidates.update(buckets.get(band, ()))
+        if not candidates:
+            return None
+        rows = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarity = (self.signatures[rows] == sig).mean(axis=1)
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.threshold:
+            return None
+        return self.keys[rows[best]], float(similarity[best])
+
+    # ----------------------------
+    # Persistence
+    # ----------------------------
+    def save(self, path: Union[str, Path]):
+        path = Path(path)
+        rows = np.fromiter(self.row_of.values(), dtype=np.int64, count=len(self.row_of))
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(
+            tmp,
+            keys=np.array(list(self.row_of), dtype=str),
+            signatures=self.signatures[rows],
+            params=np.array([self.num_perm, self.bands, self.seed]),
+            threshold=np.array(self.threshold),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "MinHashLsh":
+        with np.load(path) as data:
+            num_perm, bands, seed = (int(x) for x in data["params"])
+            lsh = cls(num_perm, bands, float(data["threshold"]), seed)
+            for key, sig in zip(data["keys"].tolist(), data["signatures"]):
+                lsh.add(key, sig)
+        logger.info(f"Loaded MinHash LSH of {len(lsh)} claims from {path}")
+        return lsh
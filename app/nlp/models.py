@@ -0,0 +1,183 @@
+import os
+import resource
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from app.config import CACHE_PATH
+from app.logger import logger
+
+# ----------------------------
+# Default model names
+# ----------------------------
+EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2") # 384 dim
+# torch, or onnx: int8 dynamically quantized ONNX graph on onnxruntime (CPU).
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+EMBED_BACKENDS = ("torch", "onnx")
+# onnxruntime quantization target: avx512_vnni, avx512, avx2 or arm64.
+EMBED_ONNX_QUANTIZATION = os.getenv("EMBED_ONNX_QUANTIZATION", "avx512_vnni")
+# python -m spacy download en_core_web_trf
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_trf")
+
+
+def _rss_mb() -> float:
+    """Current resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # no procfs (macOS): fall back to peak RSS, reported in bytes on darwin, KB elsewhere.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+@dataclass
+class ModelStats:
+    kind: str
+    name: str
+    load_seconds: float
+    rss_before_mb: float
+    rss_after_mb: float
+
+    @property
+    def rss_delta_mb(self) -> float:
+        return self.rss_after_mb - self.rss_before_mb
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of heavyweight NLP models.
+    Each (kind, name) is loaded once, on first use, and the same instance is
+    shared by every module in the process.
+    """
+
+    def __init__(self):
+        self._models: Dict[Tuple[str, str], Any] = {}
+        self._stats: Dict[Tuple[str, str], ModelStats] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+    def get(self, kind: str, name: str, loader: Callable[[], Any]) -> Any:
+        key = (kind, name)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        # per-model lock: two threads asking for the same model load it once,
+        # while different models can load concurrently.
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            model = self._models.get(key)
+            if model is None:
+                rss_before = _rss_mb()
+                start = time.perf_counter()
+                model = loader()
+                stats = ModelStats(
+                    kind=kind,
+                    name=name,
+                    load_seconds=time.perf_counter() - start,
+                    rss_before_mb=rss_before,
+                    rss_after_mb=_rss_mb(),
+                )
+                self._models[key] = model
+                self._stats[key] = stats
+                logger.info(
+                    f"Loaded {kind} model {name} in {stats.load_seconds:.2f}s, "
+                    f"rss +{stats.rss_delta_mb:.1f}MB (now {stats.rss_after_mb:.1f}MB)"
+                )
+        return model
+
+    def is_loaded(self, kind: str, name: str) -> bool:
+        return (kind, name) in self._models
+
+    def stats(self) -> List[Dict]:
+        return [
+            {**asdict(s), "rss_delta_mb": s.rss_delta_mb}
+            for s in self._stats.values()
+        ]
+
+    def clear(self):
+        """Drop every loaded model (mainly for tests and memory sizing runs)."""
+        with self._lock:
+            self._models.clear()
+            self._stats.clear()
+            self._key_locks.clear()
+
+
+registry = ModelRegistry()
+
+
+def get_spacy(name: str = SPACY_MODEL):
+    """Shared spaCy pipeline, loaded on first use."""
+    def load():
+        import spacy
+        return spacy.load(name)
+    return registry.get("spacy", name, load)
+
+
+def get_sentence_transformer(name: str = EMBED_MODEL, backend: str = EMBED_BACKEND):
+    """Shared SentenceTransformer, loaded on first use."""
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {EMBED_BACKENDS}")
+    def load():
+        from sentence_transformers import SentenceTransformer
+        if backend == "onnx":
+            return _load_onnx_int8(name)
+        return SentenceTransformer(name)
+    key = name if backend == "torch" else f"{name}@{backend}"
+    return registry.get("sentence_transformer", key, load)
+
+
+def _load_onnx_int8(name: str, quantization: str = EMBED_ONNX_QUANTIZATION):
+    """
+    The model's int8 ONNX graph: the published one when the hub repo ships it
+    (all-MiniLM-L6-v2 does), else exported and quantized once into CACHE_PATH/onnx.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    file_name = f"onnx/model_qint8_{quantization}.onnx"
+    local = CACHE_PATH / "onnx" / name.replace("/", "__")
+    if (local / file_name).exists():
+        return SentenceTransformer(str(local), backend="onnx", model_kwargs={"file_name": file_name})
+    try:
+        return SentenceTransformer(name, backend="onnx", model_kwargs={"file_name": file_name})
+    except Exception as e:
+        logger.info(f"No published {file_name} for {name} ({e}), exporting and quantizing")
+    model = SentenceTransformer(name, backend="onnx")  # exports the fp32 graph
+    model.save(str(local))
+    export_dynamic_quantized_onnx_model(model, quantization, str(local))
+    return SentenceTransformer(str(local), backend="onnx", model_kwargs={"file_name": file_name})
+
+
+def warmup(
+    spacy_models: Iterable[str] = (SPACY_MODEL,),
+    embed_models: Iterable[str] = (EMBED_MODEL,),
+) -> List[Dict]:
+    """
+    Eagerly load models, e.g. at server start, so the first request does not
+    pay the load cost. Returns the per-model load stats.
+    """
+    for name in spacy_models:
+        get_spacy(name)
+    for name in embed_models:
+        get_sentence_transformer(name)
+    return model_stats()
+
+
+def model_stats() -> List[Dict]:
+    """Load time and RSS growth of every model loaded so far."""
+    return registry.stats()
+
+
+if __name__ == "__main__":
+    # python -m app.nlp.models [spacy_model ...]
+    spacy_models = sys.argv[1:] or [SPACY_MODEL]
+    for s in warmup(spacy_models=spacy_models):
+        print(
+            f"{s['kind']:<22} {s['name']:<45} "
+            f"load={s['load_seconds']:.2f}s rss_delta={s['rss_delta_mb']:.1f}MB"
+        )
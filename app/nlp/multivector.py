@@ -0,0 +1,232 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Tuple, Union
+
+import faiss
+import numpy as np
+
+from app.logger import logger
+from app.nlp.vector_index import _MMAP_FLAG, _atomic_path, index_factory_string, search_params
+
+INDEX_FILE = "features.faiss"
+OWNER_FILE = "owner.npy"
+SPANS_FILE = "spans.npz"
+META_FILE = "meta.json"
+
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(size, 2 * len(array), 1024), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+# ----------------------------
+# Multi-vector (per-feature) Index
+# ----------------------------
+class MultiVectorIndex:
+    """
+    One embedding per extracted claim feature, for late-interaction scoring:
+    score(query, patent) = sum over query features of the best cosine against
+    the patent's features.
+
+    Feature vectors are stored fp16 in a faiss index (flat or hnsw) whose
+    row ids are feature rows; owner maps a row to its patent label (same
+    labels as VectorIndex), and each label's rows are the contiguous span
+    start[label] : start[label] + count[label]. Removing or replacing a
+    patent tombstones its old rows, which searches skip until compact().
+    """
+
+    def __init__(self, dim: int, index_type: str = "flat", hnsw_m: int = 32, ef_search: int = 64):
+        if index_type not in ("flat", "hnsw"):
+            raise ValueError(f"feature index_type must be flat or hnsw, got {index_type!r}")
+        self.dim = dim
+        self.index_type = index_type
+        self.ef_search = ef_search
+        self.index = faiss.index_factory(dim, index_factory_string(index_type, dim, hnsw_m=hnsw_m, quantization="fp16"),
+                                         faiss.METRIC_INNER_PRODUCT)
+        self.owner = np.zeros(0, dtype=np.int64)
+        self.start = np.zeros(0, dtype=np.int64)
+        self.count = np.zeros(0, dtype=np.int32)
+        self.n_labels = 0
+        self.deleted = set()
+        self._selector = None
+        self.read_only = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        """Number of patents with live features."""
+        return int(np.count_nonzero(self.count[:self.n_labels]))
+
+    @property
+    def n_features(self) -> int:
+        return self.index.ntotal
+
+    def add(self, label: int, vectors: np.ndarray):
+        """Store the feature vectors of the patent at `label`, replacing earlier ones."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._make_writable()
+            first = self.index.ntotal
+            self.start = _grow(self.start, label + 1)
+            self.count = _grow(self.count, label + 1)
+            self.n_labels = max(self.n_labels, label + 1)
+            self._tombstone(label)
+            self.start[label], self.count[label] = first, len(vectors)
+            if not len(vectors):
+                return
+            self.owner = _grow(self.owner, first + len(vectors))
+            self.owner[first:first + len(vectors)] = label
+            self.index.add(vectors)
+
+    def remove(self, labels):
+        with self._lock:
+            for label in labels:
+                if 0 <= label < self.n_labels:
+                    self._tombstone(label)
+                    self.count[label] = 0
+
+    def _tombstone(self, label: int):
+        start, count = int(self.start[label]), int(self.count[label])
+        if count:
+            self.deleted.update(range(start, start + count))
+            self._selector = None
+
+    def _live_selector(self):
+        if not self.deleted:
+            return None
+        if self._selector is None:
+            batch = faiss.IDSelectorBatch(np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted)))
+            # keep `batch` referenced alongside the selector that points to it.
+            self._selector = (faiss.IDSelectorNot(batch), batch)
+        return self._selector[0]
+
+    def candidates(self, query_vecs: np.ndarray, query_rows: np.ndarray, m: int = 100) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (query row, label) pairs of the patents owning one of the m nearest
+        features of any query feature; query_rows[i] is the query of query_vecs[i].
+        """
+        if not len(query_vecs):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        with self._lock:
+            params = search_params(self.index_type, 0, self.ef_search, self._live_selector())
+            _, hits = self.index.search(np.ascontiguousarray(query_vecs, dtype=np.float32), m, params=params)
+            found = hits >= 0
+            rows = np.broadcast_to(np.asarray(query_rows)[:, None], hits.shape)[found]
+            labels = self.owner[hits[found]]
+        pairs = np.unique(np.stack([rows, labels]), axis=1)
+        return pairs[0], pairs[1]
+
+    def maxsim(self, query_vecs: np.ndarray, labels: np.ndarray) -> np.ndarray:
+        """
+        Late-interaction scores of one query's feature vectors against each
+        patent in `labels`: sum over query features of the max similarity.
+        One matrix product per call; patents without features score 0.
+        """
+        scores = np.zeros(len(labels), dtype=np.float32)
+        if not len(query_vecs) or not len(labels):
+            return scores
+        with self._lock:
+            counts = self.count[labels].astype(np.int64)
+            has = counts > 0
+            counts, starts = counts[has], self.start[labels[has]]
+            if not len(counts):
+                return scores
+            # feature rows of every patent, patent after patent.
+            offsets = np.cumsum(counts) - counts
+            rows = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+            vecs = self.index.reconstruct_batch(rows)
+        sims = np.ascontiguousarray(query_vecs, dtype=np.float32) @ vecs.T   # (query features, patent features)
+        best = np.maximum.reduceat(sims, offsets, axis=1)                      # (query features, patents)
+        scores[has] = best.sum(axis=0)
+        return scores
+
+    def memory_bytes(self) -> int:
+        return faiss.serialize_index(self.index).nbytes + self.owner.nbytes + self.start.nbytes + self.count.nbytes
+
+    # ----------------------------
+    # Compaction
+    # ----------------------------
+    def compact(self, chunk_size: int = 65536) -> int:
+        """
+        Rebuild the feature index without tombstoned rows, keeping each
+        patent's rows contiguous. Returns the number of rows dropped.
+        """
+        with self._lock:
+            if not self.deleted:
+                return 0
+            dropped = len(self.deleted)
+            labels = np.flatnonzero(self.count[:self.n_labels])
+            counts = self.count[labels].astype(np.int64)
+            offsets = np.cumsum(counts) - counts
+            rows = np.repeat(self.start[labels] - offsets, counts) + np.arange(counts.sum())
+            index = faiss.index_factory(self.dim, self._factory_string(), faiss.METRIC_INNER_PRODUCT)
+            for first in range(0, len(rows), chunk_size):
+                index.add(self.index.reconstruct_batch(rows[first:first + chunk_size]))
+            self.index = index
+            self.read_only = False
+            self.owner = np.repeat(labels, counts)
+            self.start[labels] = offsets
+            self.deleted = set()
+            self._selector = None
+        logger.info(f"Compacted feature index: dropped {dropped} rows, kept {self.index.ntotal}")
+        return dropped
+
+    def _factory_string(self) -> str:
+        hnsw_m = self.index.hnsw.nb_neighbors(1) if self.index_type == "hnsw" else 32
+        return index_factory_string(self.index_type, self.dim, hnsw_m=hnsw_m, quantization="fp16")
+
+    # ----------------------------
+    # Persistence
+    # ----------------------------
+    def save(self, path: Union[str, Path]):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            tmp = _atomic_path(path / INDEX_FILE)
+            faiss.write_index(self.index, str(tmp))
+            os.replace(tmp, path / INDEX_FILE)
+            tmp = _atomic_path(path / OWNER_FILE)
+            with open(tmp, "wb") as f:
+                np.save(f, self.owner[:self.index.ntotal])
+            os.replace(tmp, path / OWNER_FILE)
+            tmp = path / (SPANS_FILE + ".tmp.npz")
+            np.savez(tmp, start=self.start[:self.n_labels], count=self.count[:self.n_labels])
+            os.replace(tmp, path / SPANS_FILE)
+            with open(_atomic_path(path / META_FILE), "w") as f:
+                json.dump({"index_type": self.index_type, "ef_search": self.ef_search}, f)
+            os.replace(_atomic_path(path / META_FILE), path / META_FILE)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], mmap: bool = True) -> "MultiVectorIndex":
+        path = Path(path)
+        with open(path / META_FILE) as f:
+            meta = json.load(f)
+        obj = cls.__new__(cls)
+        flags = (_MMAP_FLAG | faiss.IO_FLAG_READ_ONLY) if mmap else 0
+        obj.index = faiss.read_index(str(path / INDEX_FILE), flags)
+        obj.dim = obj.index.d
+        obj.index_type = meta["index_type"]
+        obj.ef_search = meta["ef_search"]
+        obj.owner = np.load(path / OWNER_FILE)
+        with np.load(path / SPANS_FILE) as spans:
+            obj.start, obj.count = spans["start"], spans["count"]
+        obj.n_labels = len(obj.start)
+        # rows outside their owner's current span are tombstones.
+        rows = np.arange(len(obj.owner))
+        first = obj.start[obj.owner]
+        obj.deleted = set(np.flatnonzero((rows < first) | (rows >= first + obj.count[obj.owner])).tolist())
+        obj._selector = None
+        obj.read_only = mmap
+        obj._lock = threading.RLock()
+        logger.info(f"Loaded {obj.n_features} feature vectors of {len(obj)} patents from {path}")
+        return obj
+
+    def _make_writable(self):
+        # a memory-mapped index is read-only: copy it into process memory on first write.
+        if self.read_only:
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self.read_only = False
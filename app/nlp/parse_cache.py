@@ -0,0 +1,131 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+from app.nlp.embedding import text_key
+from app.nlp.models import SPACY_MODEL, get_spacy
+
+PARSE_CACHE_MAX_MB = int(os.getenv("PARSE_CACHE_MAX_MB", "256"))
+
+
+def normalize_claim(text: str) -> str:
+    """Drop a leading claim number and collapse whitespace, so equal claims share one parse."""
+    text = re.sub(r'^\s*\d+\.\s*', '', text)
+    return ' '.join(text.split())
+
+
+# ----------------------------
+# Parse Cache
+# ----------------------------
+class ParseCache:
+    """
+    LRU cache of spaCy parses for one pipeline, keyed by normalized text hash.
+    Docs are kept DocBin-serialized (a few KB each instead of the live Doc with
+    its transformer tensors) and rebuilt against the pipeline vocab on a hit.
+    """
+
+    def __init__(self, model_name: str = SPACY_MODEL, max_bytes: int = PARSE_CACHE_MAX_MB << 20):
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nlp(self):
+        return get_spacy(self.model_name)
+
+    def parse(self, text: str):
+        return self.parse_many([text])[0]
+
+    def parse_many(self, texts: List[str], batch_size: int = 64) -> List:
+        """Parses of `texts` in order; cache misses go through one nlp.pipe call."""
+        texts = [normalize_claim(t) for t in texts]
+        keys = [text_key(self.model_name, t) for t in texts]
+        docs: List = [None] * len(texts)
+        missing: Dict[bytes, List[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                data = self.entries.get(key)
+                if data is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self.entries.move_to_end(key)
+                    docs[i] = data
+            self.hits += len(texts) - sum(len(v) for v in missing.values())
+            self.misses += sum(len(v) for v in missing.values())
+
+        for i, data in enumerate(docs):
+            if data is not None:
+                docs[i] = self._from_bytes(data)
+
+        if missing:
+            parsed = self.nlp.pipe((texts[idx[0]] for idx in missing.values()), batch_size=batch_size)
+            for (key, idx), doc in zip(missing.items(), parsed):
+                for i in idx:
+                    docs[i] = doc
+                self._put(key, self._to_bytes(doc))
+        return docs
+
+    def _to_bytes(self, doc) -> bytes:
+        from spacy.tokens import DocBin
+        doc_bin = DocBin(store_user_data=False)
+        doc_bin.add(doc)
+        return doc_bin.to_bytes()
+
+    def _from_bytes(self, data: bytes):
+        from spacy.tokens import DocBin
+        return next(DocBin().from_bytes(data).get_docs(self.nlp.vocab))
+
+    def _put(self, key: bytes, data: bytes):
+        with self._lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size_bytes -= len(old)
+            self.entries[key] = data
+            self.size_bytes += len(data)
+            while self.size_bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size_bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "entries": len(self.entries),
+            "size_mb": self.size_bytes / 2**20,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_caches: Dict[str, ParseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_parse_cache(model_name: str = SPACY_MODEL) -> ParseCache:
+    with _caches_lock:
+        cache = _caches.get(model_name)
+        if cache is None:
+            cache = _caches[model_name] = ParseCache(model_name)
+        return cache
+
+
+def parse(text: str, model_name: str = SPACY_MODEL):
+    """Shared, cached spaCy parse of a claim."""
+    return get_parse_cache(model_name).parse(text)
+
+
+def parse_many(texts: List[str], model_name: str = SPACY_MODEL, batch_size: int = 64) -> List:
+    return get_parse_cache(model_name).parse_many(texts, batch_size)
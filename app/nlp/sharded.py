@@ -0,0 +1,241 @@
+import json
+import multiprocessing as mp
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import faiss
+import numpy as np
+
+from app.logger import logger
+from app.nlp.vector_index import _MMAP_FLAG, VectorIndex, _atomic_path, search_params
+
+SHARDS_FILE = "shards.json"
+
+
+def shard_file(i: int) -> str:
+    return f"shard-{i:03d}.faiss"
+
+
+def merge_topk(scores: Sequence[np.ndarray], labels: Sequence[np.ndarray], k: int):
+    """Merge per-shard (n, k_i) results into the global (n, k) top-k by score."""
+    scores, labels = np.concatenate(scores, axis=1), np.concatenate(labels, axis=1)
+    top = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(scores, top, axis=1), np.take_along_axis(labels, top, axis=1)
+
+
+def write_shards(index: VectorIndex, path: Union[str, Path], n_shards: int, chunk_size: int = 65536) -> Dict:
+    """
+    Split the live vectors of `index` into n_shards contiguous label ranges, each
+    written as its own faiss index under `path`. Labels stay global, so shard
+    hits need no remapping; meta["ranges"] holds each shard's [first, end) label
+    range. Labels added to `index` afterwards are at >= next_label.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    with index._lock:
+        labels = np.sort(faiss.vector_to_array(index.index.id_map))
+        if index.deleted:
+            labels = labels[~np.isin(labels, np.fromiter(index.deleted, dtype=np.int64, count=len(index.deleted)))]
+        next_label = len(index.patent_ids)
+
+    ranges = []
+    for i, part in enumerate(np.array_split(labels, n_shards)):
+        ranges.append([int(part[0]), int(part[-1]) + 1] if len(part) else [0, 0])
+        shard = index._wrap(index._empty_inner())
+        for start in range(0, len(part), chunk_size):
+            batch = part[start:start + chunk_size]
+            with index._lock:
+                vectors = index.raw.gather(batch) if index.raw is not None else index.index.reconstruct_batch(batch)
+            shard.add_with_ids(vectors, batch)
+        tmp = _atomic_path(path / shard_file(i))
+        faiss.write_index(shard, str(tmp))
+        os.replace(tmp, path / shard_file(i))
+
+    meta = {
+        "n_shards": n_shards,
+        "index_type": index.index_type,
+        "nprobe": index.nprobe,
+        "ef_search": index.ef_search,
+        "next_label": next_label,
+        "ranges": ranges,
+    }
+    tmp = _atomic_path(path / SHARDS_FILE)
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, path / SHARDS_FILE)
+    logger.info(f"Wrote {n_shards} shards of ~{len(labels) // max(1, n_shards)} vectors to {path}")
+    return meta
+
+
+# ----------------------------
+# Shard worker process
+# ----------------------------
+def _shard_worker(conn, shard_path: str, meta: Dict, threads: int, label_range: Sequence[int]):
+    faiss.omp_set_num_threads(threads)
+    # memory-mapped read-only: all workers on a host share the vectors through the page cache.
+    index = faiss.read_index(shard_path, _MMAP_FLAG | faiss.IO_FLAG_READ_ONLY)
+    deleted_sel = None
+    # bitmaps arrive as the slice over this shard's label range, from byte `first`
+    # on; they are copied into a buffer addressed by global label.
+    first = label_range[0] // 8
+    bitmap = np.zeros((label_range[1] + 7) // 8, dtype=np.uint8)
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        queries, k, nprobe, ef_search, deleted, bitmaps = msg
+        try:
+            if deleted is not None:
+                deleted_sel = None
+                if len(deleted):
+                    batch = faiss.IDSelectorBatch(deleted)
+                    # keep `batch` referenced alongside the selector that points to it.
+                    deleted_sel = (faiss.IDSelectorNot(batch), batch)
+            live = deleted_sel[0] if deleted_sel is not None else None
+            if bitmaps is None:
+                params = search_params(meta["index_type"], nprobe, ef_search, live)
+                conn.send(index.search(queries, k, params=params))
+                continue
+            scores = np.empty((len(queries), k), dtype=np.float32)
+            labels = np.empty((len(queries), k), dtype=np.int64)
+            for i, part in enumerate(bitmaps):
+                bitmap[first:first + len(part)] = part
+                bitmap_sel = faiss.IDSelectorBitmap(bitmap)
+                sel = faiss.IDSelectorAnd(bitmap_sel, live) if live is not None else bitmap_sel
+                params = search_params(meta["index_type"], nprobe, ef_search, sel)
+                scores[i:i + 1], labels[i:i + 1] = index.search(queries[i:i + 1], k, params=params)
+            conn.send((scores, labels))
+        except Exception as e:
+            conn.send(e)
+
+
+# ----------------------------
+# Sharded Index
+# ----------------------------
+class ShardedIndex:
+    """
+    Scatter-gather search over shards written by write_shards(), one worker
+    process per shard. A query batch is sent to every worker, with only the
+    slice of any label bitmaps that covers the worker's shard, and the per-shard
+    top-k results are merged. Vectors added to the wrapped VectorIndex after
+    sharding (labels >= next_label) are searched locally and merged too, and
+    its tombstones are forwarded to the workers. Re-shard to reclaim them.
+    """
+
+    def __init__(self, index: VectorIndex, path: Union[str, Path], threads_per_shard: int = 1):
+        self.index = index
+        self.path = Path(path)
+        with open(self.path / SHARDS_FILE) as f:
+            self.meta = json.load(f)
+        # shards written before ranges were recorded: every shard gets whole bitmaps.
+        self.meta.setdefault("ranges", [[0, self.meta["next_label"]]] * self.meta["n_shards"])
+        self.threads_per_shard = threads_per_shard
+        self._lock = threading.Lock()
+        self._tombstones_seen: Optional[int] = None
+        self._conns: List = []
+        self._procs: List = []
+        self._start()
+
+    @classmethod
+    def build(cls, index: VectorIndex, path: Union[str, Path], n_shards: int, threads_per_shard: int = 1) -> "ShardedIndex":
+        write_shards(index, path, n_shards)
+        return cls(index, path, threads_per_shard)
+
+    @property
+    def n_shards(self) -> int:
+        return self.meta["n_shards"]
+
+    def _start(self):
+        # spawn, not fork: a forked faiss / OpenMP runtime can deadlock.
+        ctx = mp.get_context("spawn")
+        for i in range(self.n_shards):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(
+                target=_shard_worker,
+                args=(child, str(self.path / shard_file(i)), self.meta, self.threads_per_shard, self.meta["ranges"][i]),
+                name=f"vector-shard-{i}",
+                daemon=True,
+            )
+            proc.start()
+            self._conns.append(parent)
+            self._procs.append(proc)
+        logger.info(f"Started {self.n_shards} shard workers over {self.path}")
+
+    def search_raw(self, query_vecs, k=10, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                   bitmaps: Optional[List[np.ndarray]] = None, rescore: Optional[bool] = None):
+        """
+        Same contract as VectorIndex.search_raw. bitmaps: optional per-query packed
+        label bitmaps (see CpcPostings) restricting each query's search.
+        """
+        if query_vecs.ndim == 1:
+            query_vecs = query_vecs.reshape(1, -1)
+        query_vecs = np.ascontiguousarray(query_vecs, dtype=np.float32)
+        index = self.index
+        rescore = index.raw is not None if rescore is None else rescore and index.raw is not None
+        fetch = k * index.rescore_factor if rescore else k
+        nprobe, ef_search = nprobe or self.meta["nprobe"], ef_search or self.meta["ef_search"]
+
+        with self._lock:
+            changed = None
+            if index.tombstones != self._tombstones_seen:
+                changed = self._dead_labels()
+            for conn, (first, end) in zip(self._conns, self.meta["ranges"]):
+                parts = None if bitmaps is None else [b[first // 8:(end + 7) // 8] for b in bitmaps]
+                conn.send((query_vecs, fetch, nprobe, ef_search, changed, parts))
+            results = [conn.recv() for conn in self._conns]
+        for r in results:
+            if isinstance(r, Exception):
+                raise r
+        scores, labels = [r[0] for r in results], [r[1] for r in results]
+
+        # vectors added since sharding live only in the local index.
+        if len(index.patent_ids) > self.meta["next_label"]:
+            s, l = self._search_local(query_vecs, fetch, nprobe, ef_search, bitmaps)
+            scores.append(s)
+            labels.append(l)
+
+        scores, labels = merge_topk(scores, labels, fetch)
+        if not rescore:
+            return scores, labels
+        with index._lock:
+            vecs = index.raw.gather(np.maximum(labels, 0).ravel()).reshape(*labels.shape, index.dim)
+        return VectorIndex._rescore(query_vecs, vecs, labels, k)
+
+    def _dead_labels(self) -> np.ndarray:
+        # tombstoned labels, plus those compaction already dropped from the index but not from the shards.
+        with self.index._lock:
+            self._tombstones_seen = self.index.tombstones
+            deleted = np.fromiter(self.index.deleted, dtype=np.int64, count=len(self.index.deleted))
+            vacated = np.flatnonzero(np.asarray(self.index.patent_ids[:self.meta["next_label"]], dtype=str) == "")
+        return np.union1d(deleted, vacated)
+
+    def _search_local(self, query_vecs, k, nprobe, ef_search, bitmaps):
+        recent = faiss.IDSelectorRange(self.meta["next_label"], np.iinfo(np.int64).max)
+        if bitmaps is None:
+            return self.index.search_raw(query_vecs, k, nprobe, ef_search, sel=recent, rescore=False)
+        scores = np.empty((len(query_vecs), k), dtype=np.float32)
+        labels = np.empty((len(query_vecs), k), dtype=np.int64)
+        for i, bitmap in enumerate(bitmaps):
+            bitmap_sel = faiss.IDSelectorBitmap(bitmap)
+            sel = faiss.IDSelectorAnd(recent, bitmap_sel)
+            scores[i:i + 1], labels[i:i + 1] = self.index.search_raw(
+                query_vecs[i:i + 1], k, nprobe, ef_search, sel=sel, rescore=False
+            )
+        return scores, labels
+
+    def close(self):
+        with self._lock:
+            for conn in self._conns:
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+            for proc in self._procs:
+                proc.join(timeout=5)
+            self._conns, self._procs = [], []
+
+    def __del__(self):
+        if self._procs:
+            self.close()
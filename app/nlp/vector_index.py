@@ -0,0 +1,483 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+import faiss
+import numpy as np
+
+from app.logger import logger
+
+INDEX_FILE = "index.faiss"
+IDS_FILE = "ids.npy"
+META_FILE = "meta.json"
+RAW_FILE = "vectors.npy"
+
+# flat: exact brute-force scan. ivf / ivfpq: inverted lists over k-means cells,
+# optionally product-quantized. hnsw: graph index, no training needed.
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+# scalar quantization of the stored vectors: fp16 halves memory, sq8 (8 bits per dim) quarters it.
+QUANTIZATIONS = (None, "fp16", "sq8")
+_SQ_CODES = {"fp16": "SQfp16", "sq8": "SQ8"}
+
+# faiss >= 1.8 can mmap the code array of flat indexes (IndexFlatCodes).
+_MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+def _atomic_path(path: Path) -> Path:
+    # write next to the target and os.replace() it, so a reader never mmaps a half-written file.
+    return path.with_name(path.name + ".tmp")
+
+
+def index_factory_string(
+    index_type: str, dim: int, nlist: int = 1024, hnsw_m: int = 32, pq_m: Optional[int] = None,
+    quantization: Optional[str] = None,
+) -> str:
+    """faiss.index_factory description for one of INDEX_TYPES, optionally with one of QUANTIZATIONS."""
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+    codes = _SQ_CODES.get(quantization, "Flat")
+    if index_type == "flat":
+        return codes if quantization else "Flat"
+    if index_type == "ivf":
+        return f"IVF{nlist},{codes}"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m},{codes}"
+    if index_type == "ivfpq":
+        if quantization:
+            raise ValueError("ivfpq vectors are already product-quantized")
+        # 8 dims per 8-bit sub-quantizer: 384 dims -> 48 bytes per vector.
+        pq_m = pq_m or dim // 8
+        if dim % pq_m:
+            raise ValueError(f"pq_m={pq_m} must divide the vector dimension {dim}")
+        return f"IVF{nlist},PQ{pq_m}x8"
+    raise ValueError(f"Unknown index_type {index_type!r}, expected one of {INDEX_TYPES}")
+
+
+def search_params(index_type: str, nprobe: int, ef_search: int, sel=None):
+    """faiss SearchParameters for an index of `index_type`, None for an unfiltered flat search."""
+    if index_type in ("ivf", "ivfpq"):
+        return faiss.SearchParametersIVF(nprobe=nprobe, sel=sel)
+    if index_type == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search, sel=sel)
+    return faiss.SearchParameters(sel=sel) if sel is not None else None
+
+
+# ----------------------------
+# Full-precision vector store
+# ----------------------------
+class RawVectors:
+    """
+    float32 copies of the indexed vectors, row = label, for exact re-scoring of
+    quantized search results. Rows up to the last save() are read from a
+    memory-mapped .npy; rows added since live in an in-memory tail until the
+    next save().
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.base = np.empty((0, dim), dtype=np.float32)
+        self.tail = np.empty((0, dim), dtype=np.float32)  # grown by doubling
+        self.n_tail = 0
+
+    def __len__(self):
+        return len(self.base) + self.n_tail
+
+    def append(self, vectors: np.ndarray):
+        if self.n_tail + len(vectors) > len(self.tail):
+            grown = np.empty((max(2 * len(self.tail), self.n_tail + len(vectors), 1024), self.dim), dtype=np.float32)
+            grown[:self.n_tail] = self.tail[:self.n_tail]
+            self.tail = grown
+        self.tail[self.n_tail:self.n_tail + len(vectors)] = vectors
+        self.n_tail += len(vectors)
+
+    def gather(self, labels: np.ndarray) -> np.ndarray:
+        out = np.empty((len(labels), self.dim), dtype=np.float32)
+        in_base = labels < len(self.base)
+        # sorted reads keep memory-mapped access sequential.
+        rows = labels[in_base]
+        order = np.argsort(rows)
+        out[np.flatnonzero(in_base)[order]] = self.base[rows[order]]
+        out[~in_base] = self.tail[labels[~in_base] - len(self.base)]
+        return out
+
+    def save(self, path: Path):
+        """Write all rows to `path` and re-open it memory-mapped."""
+        tmp = _atomic_path(path)
+        with open(tmp, "wb") as f:
+            np.lib.format.write_array_header_1_0(f, {"descr": "<f4", "fortran_order": False, "shape": (len(self), self.dim)})
+            for start in range(0, len(self.base), 65536):
+                f.write(np.ascontiguousarray(self.base[start:start + 65536]).tobytes())
+            f.write(self.tail[:self.n_tail].tobytes())
+        os.replace(tmp, path)
+        self.base = np.load(path, mmap_mode="r")
+        self.tail = np.empty((0, self.dim), dtype=np.float32)
+        self.n_tail = 0
+
+    @classmethod
+    def load(cls, path: Path) -> "RawVectors":
+        raw = cls.__new__(cls)
+        raw.base = np.load(path, mmap_mode="r")
+        raw.dim = raw.base.shape[1]
+        raw.tail = np.empty((0, raw.dim), dtype=np.float32)
+        raw.n_tail = 0
+        return raw
+
+
+# ----------------------------
+# Vector Index (FAISS)
+# ----------------------------
+class VectorIndex:
+    """
+    FAISS index wrapped in an IndexIDMap2. Vectors are stored under stable int64
+    labels; a label is the position of its patent id in self.patent_ids.
+
+    Removing or replacing a patent only tombstones its label (searches skip it
+    through an IDSelector); compact() later rebuilds the faiss index without the
+    tombstoned vectors. Labels are never renumbered, so they stay valid across
+    compactions.
+
+    With quantization ("fp16" / "sq8") faiss stores scalar-quantized codes. With
+    rescore=True float32 copies are also kept in a memory-mapped side file, and
+    searches re-rank rescore_factor * k quantized candidates by exact inner product.
+    """
+
+    def __init__(
+        self,
+        dim,
+        index_type: str = "flat",
+        nlist: int = 1024,
+        hnsw_m: int = 32,
+        pq_m: Optional[int] = None,
+        nprobe: int = 16,
+        ef_search: int = 64,
+        train_sample: int = 100_000,
+        quantization: Optional[str] = None,
+        rescore: bool = False,
+        rescore_factor: int = 4,
+    ):
+        self.dim = dim
+        self.index_type = index_type
+        self.quantization = quantization
+        self.factory = index_factory_string(index_type, dim, nlist, hnsw_m, pq_m, quantization)
+        self.ef_construction = max(40, 2 * hnsw_m)
+        self.index = self._wrap(self._new_inner())
+        # query-time defaults, can be overridden per search() call.
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.train_sample = train_sample
+        self.rescore_factor = rescore_factor
+        self.raw: Optional[RawVectors] = RawVectors(dim) if rescore else None
+        self.patent_ids = []
+        self.deleted = set()
+        self.read_only = False
+        self._init_runtime()
+
+    def _init_runtime(self):
+        self._lock = threading.RLock()
+        self._label_of = None      # patent id -> live label, built lazily
+        self._selector = None      # cached IDSelector excluding self.deleted
+        self._template = None      # empty trained inner index, used by compact()
+        self._compacting = False
+        self.tombstones = 0        # labels tombstoned by this process, lets readers notice removals
+
+    def _new_inner(self):
+        inner = faiss.index_factory(self.dim, self.factory, faiss.METRIC_INNER_PRODUCT)
+        if self.index_type == "hnsw":
+            inner.hnsw.efConstruction = self.ef_construction
+        return inner
+
+    @staticmethod
+    def _wrap(inner):
+        ivf = faiss.try_extract_index_ivf(inner)
+        if ivf is not None:
+            # IVF needs a direct map to reconstruct vectors during compaction.
+            ivf.make_direct_map()
+        return faiss.IndexIDMap2(inner)
+
+    def train(self, vectors, sample_size: Optional[int] = None, seed: int = 0):
+        """
+        Train the coarse quantizer / PQ codebooks on a random sample of `vectors`.
+        A no-op for flat and hnsw indexes without sq8 quantization.
+        """
+        if self.index.is_trained:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        sample_size = sample_size or self.train_sample
+        if len(vectors) > sample_size:
+            rng = np.random.default_rng(seed)
+            vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        nlist = getattr(faiss.try_extract_index_ivf(self.index.index), "nlist", 0)
+        if len(vectors) < nlist:
+            raise ValueError(
+                f"{self.index_type} index needs at least nlist={nlist} training vectors, got {len(vectors)}"
+            )
+        logger.info(f"Training {self.index_type} index on {len(vectors)} vectors")
+        self.index.train(vectors)
+
+    @property
+    def label_of(self) -> Dict[str, int]:
+        if self._label_of is None:
+            self._label_of = {
+                str(pid): label
+                for label, pid in enumerate(self.patent_ids)
+                if pid and label not in self.deleted
+            }
+        return self._label_of
+
+    # add n vectors at once. separately store patent_ids.
+    # an id that is already indexed is replaced: its old vector is tombstoned.
+    def add(self, vectors, patent_ids):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._make_writable()
+            if not self.index.is_trained:
+                self.train(vectors)
+            start = len(self.patent_ids)
+            labels = np.arange(start, start + len(patent_ids), dtype=np.int64)
+            for label, pid in zip(labels, patent_ids):
+                self._tombstone(pid)
+                self.label_of[pid] = int(label)
+            self.patent_ids.extend(patent_ids)
+            self.index.add_with_ids(vectors, labels)
+            if self.raw is not None:
+                self.raw.append(vectors)
+
+    def remove(self, patent_ids: Iterable[str]) -> int:
+        """Tombstone the vectors of `patent_ids`. Returns how many were indexed."""
+        with self._lock:
+            return sum(self._tombstone(pid) for pid in patent_ids)
+
+    def _tombstone(self, pid) -> bool:
+        label = self.label_of.pop(pid, None)
+        if label is None:
+            return False
+        self.deleted.add(label)
+        self._selector = None
+        self.tombstones += 1
+        return True
+
+    def __contains__(self, pid):
+        return pid in self.label_of
+
+    def __len__(self):
+        return self.index.ntotal - len(self.deleted)
+
+    def tombstone_ratio(self) -> float:
+        return len(self.deleted) / self.index.ntotal if self.index.ntotal else 0.0
+
+    def search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None, sel=None):
+        return search_params(self.index_type, nprobe or self.nprobe, ef_search or self.ef_search, sel)
+
+    def _live_selector(self):
+        if not self.deleted:
+            return None
+        if self._selector is None:
+            batch = faiss.IDSelectorBatch(np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted)))
+            # keep `batch` referenced alongside the selector that points to it.
+            self._selector = (faiss.IDSelectorNot(batch), batch)
+        return self._selector[0]
+
+    def search_raw(
+        self, query_vecs, k=10, nprobe: Optional[int] = None, ef_search: Optional[int] = None, sel=None,
+        rescore: Optional[bool] = None,
+    ):
+        """
+        Matrix query: returns faiss (scores, labels) arrays of shape (n_queries, k).
+        Tombstoned vectors are skipped; map labels with self.patent_ids.
+        sel: optional faiss IDSelector over labels restricting the search.
+        rescore: re-rank by exact float32 scores; defaults to on when the index keeps raw vectors.
+        """
+        if query_vecs.ndim == 1:
+            query_vecs = query_vecs.reshape(1, -1)
+        query_vecs = np.ascontiguousarray(query_vecs.astype(np.float32))
+        rescore = self.raw is not None if rescore is None else rescore and self.raw is not None
+        fetch = k * self.rescore_factor if rescore else k
+        with self._lock:
+            live = self._live_selector()
+            if sel is not None and live is not None:
+                combined = faiss.IDSelectorAnd(sel, live)
+            else:
+                combined = sel if sel is not None else live
+            scores, labels = self.index.search(query_vecs, fetch, params=self.search_params(nprobe, ef_search, combined))
+            if not rescore:
+                return scores, labels
+            vecs = self.raw.gather(np.maximum(labels, 0).ravel()).reshape(*labels.shape, self.dim)
+        return self._rescore(query_vecs, vecs, labels, k)
+
+    @staticmethod
+    def _rescore(query_vecs: np.ndarray, vecs: np.ndarray, labels: np.ndarray, k: int):
+        exact = np.einsum("nd,nkd->nk", query_vecs, vecs)
+        exact[labels == -1] = -np.inf
+        top = np.argsort(-exact, axis=1, kind="stable")[:, :k]
+        scores = np.take_along_axis(exact, top, axis=1).astype(np.float32)
+        labels = np.take_along_axis(labels, top, axis=1)
+        scores[labels == -1] = -np.inf
+        return scores, labels
+
+    def search(self, query_vec, k=10, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        scores, ids = self.search_raw(query_vec, k, nprobe, ef_search)
+        results = []
+        for i, idx in enumerate(ids[0]):
+            if idx != -1: # -1 is the default value for no match
+                results.append((str(self.patent_ids[idx]), float(scores[0, i])))
+        return results
+
+    def memory_bytes(self) -> int:
+        """Size of the serialized index, a close proxy for its resident memory (raw rescoring vectors excluded)."""
+        return faiss.serialize_index(self.index).nbytes
+
+    # ----------------------------
+    # Compaction
+    # ----------------------------
+    def compact(self, chunk_size: int = 65536) -> int:
+        """
+        Rebuild the faiss index without tombstoned vectors. Searches and writes
+        may run while the new index is built; the lock is only held to copy
+        vectors out in chunks and to swap the new index in. Returns the number
+        of vectors dropped.
+        """
+        with self._lock:
+            if self._compacting or not self.deleted:
+                return 0
+            self._compacting = True
+            dropped = set(self.deleted)
+            next_label = len(self.patent_ids)
+            labels = faiss.vector_to_array(self.index.id_map)
+            survivors = labels[~np.isin(labels, np.fromiter(dropped, dtype=np.int64, count=len(dropped)))]
+            new_inner = self._empty_inner()
+
+        try:
+            vectors = np.empty((len(survivors), self.dim), dtype=np.float32)
+            for start in range(0, len(survivors), chunk_size):
+                with self._lock:
+                    batch = survivors[start:start + chunk_size]
+                    # raw vectors, when kept, avoid quantizing already quantized codes again.
+                    vectors[start:start + chunk_size] = (
+                        self.raw.gather(batch) if self.raw is not None else self.index.reconstruct_batch(batch)
+                    )
+            new_index = self._wrap(new_inner)
+            new_index.add_with_ids(vectors, survivors)
+
+            with self._lock:
+                # replay writes that landed while the new index was being built.
+                current = faiss.vector_to_array(self.index.id_map)
+                added = current[current >= next_label]
+                if len(added):
+                    vectors = self.raw.gather(added) if self.raw is not None else self.index.reconstruct_batch(added)
+                    new_index.add_with_ids(vectors, added)
+                self._make_writable(copy_index=False)
+                self.index = new_index
+                for label in dropped:
+                    self.patent_ids[label] = ""
+                self.deleted -= dropped
+                self._selector = None
+        finally:
+            self._compacting = False
+
+        logger.info(f"Compacted {self.index_type} index: dropped {len(dropped)}, kept {self.index.ntotal}")
+        return len(dropped)
+
+    def _empty_inner(self):
+        inner = self._new_inner()
+        if inner.is_trained:
+            return inner
+        # an empty copy of the index that keeps its training (centroids, PQ codebooks, SQ ranges).
+        if self._template is None:
+            # serialize round-trip rather than clone_index(): it also copies memory-mapped storage.
+            template = faiss.deserialize_index(faiss.serialize_index(self.index.index))
+            template.reset()
+            self._template = template
+        return faiss.clone_index(self._template)
+
+    # ----------------------------
+    # Persistence
+    # ----------------------------
+    def save(self, path: Union[str, Path]):
+        """
+        Write the faiss index and its patent id sidecar into directory `path`.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        with self._lock:
+            self._save(path)
+
+    def _save(self, path: Path):
+        tmp = _atomic_path(path / INDEX_FILE)
+        faiss.write_index(self.index, str(tmp))
+        os.replace(tmp, path / INDEX_FILE)
+
+        tmp = _atomic_path(path / IDS_FILE)
+        with open(tmp, "wb") as f:
+            np.save(f, np.asarray(self.patent_ids, dtype=str))
+        os.replace(tmp, path / IDS_FILE)
+
+        if self.raw is not None:
+            self.raw.save(path / RAW_FILE)
+
+        tmp = _atomic_path(path / META_FILE)
+        with open(tmp, "w") as f:
+            json.dump(self._meta(), f)
+        os.replace(tmp, path / META_FILE)
+
+    def _meta(self) -> dict:
+        return {
+            "index_type": self.index_type,
+            "factory": self.factory,
+            "ef_construction": self.ef_construction,
+            "nprobe": self.nprobe,
+            "ef_search": self.ef_search,
+            "train_sample": self.train_sample,
+            "quantization": self.quantization,
+            "rescore": self.raw is not None,
+            "rescore_factor": self.rescore_factor,
+            "deleted": sorted(self.deleted),
+        }
+
+    @classmethod
+    def load(cls, path: Union[str, Path], mmap: bool = True) -> "VectorIndex":
+        """
+        Load an index written by save(). With mmap=True the vectors and ids are
+        memory-mapped read-only, so worker processes on one host share a single
+        copy through the page cache and loading does not read the whole file.
+        """
+        path = Path(path)
+        flags = (_MMAP_FLAG | faiss.IO_FLAG_READ_ONLY) if mmap else 0
+        index = faiss.read_index(str(path / INDEX_FILE), flags)
+
+        meta = {"index_type": "flat", "nprobe": 16, "ef_search": 64, "train_sample": 100_000, "deleted": []}
+        if (path / META_FILE).exists():
+            with open(path / META_FILE) as f:
+                meta.update(json.load(f))
+
+        obj = cls.__new__(cls)
+        obj.dim = index.d
+        obj.index = index
+        obj.index_type = meta["index_type"]
+        obj.factory = meta.get("factory") or index_factory_string(obj.index_type, obj.dim)
+        obj.ef_construction = meta.get("ef_construction", 64)
+        obj.nprobe = meta["nprobe"]
+        obj.ef_search = meta["ef_search"]
+        obj.train_sample = meta["train_sample"]
+        obj.quantization = meta.get("quantization")
+        obj.rescore_factor = meta.get("rescore_factor", 4)
+        # rescoring reads the raw vectors from the memory-mapped file whatever `mmap` says.
+        obj.raw = RawVectors.load(path / RAW_FILE) if meta.get("rescore") else None
+        obj.patent_ids = np.load(path / IDS_FILE, mmap_mode="r" if mmap else None)
+        if not mmap:
+            obj.patent_ids = obj.patent_ids.tolist()
+        obj.read_only = mmap
+        obj.deleted = set(meta["deleted"])
+        obj._init_runtime()
+        return obj
+
+    def _make_writable(self, copy_index: bool = True):
+        # a memory-mapped index is read-only: copy it into process memory on first write.
+        if self.read_only:
+            if copy_index:
+                self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self.read_only = False
+        if not isinstance(self.patent_ids, list):
+            self.patent_ids = [str(pid) for pid in self.patent_ids]
@@ -7,7 +7,7 @@ and a file-reading tool (str_replace_editor).
 Available tool groups:
 1. **File tools** (str_replace_editor): Read files from disk.
 
-2. **MCP tools** (mcp_*): Patent analysis tools — extract_features, compare_features, compare_claims.
+2. **MCP tools** (mcp_*): Patent analysis tools — extract_features, compare_features, compare_claims, compare_claims_batch (many claims against many claims in one call).
 
 Workflow for file-based tasks:
 - If the task mentions a file path (e.g. "claim_a.txt"), use str_replace_editor to read it first.
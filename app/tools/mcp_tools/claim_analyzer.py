@@ -1,48 +1,190 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
 from .claim_feature_extractor import LLMClaimFeatureExtractor, RuleBasedClaimFeatureExtractor
 from .feature_comparator import FeatureComparator, LLMFeatureComparator
 
+# extract_features calls in flight at once, across all comparisons of this analyzer.
+EXTRACT_CONCURRENCY = int(os.getenv("CLAIM_EXTRACT_CONCURRENCY", "4"))
+# feature_comparator.compare calls in flight at once, for batch comparisons.
+COMPARE_CONCURRENCY = int(os.getenv("CLAIM_COMPARE_CONCURRENCY", "8"))
+# largest N x M a batch comparison accepts; 20 claims x 30 references is 600.
+COMPARE_MAX_PAIRS = int(os.getenv("CLAIM_COMPARE_MAX_PAIRS", "2500"))
+
+# progress callback: (pairs done, total pairs).
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
+def _ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
 class ClaimAnalyzer:
     """
     Orchestrates the patent claim comparison process.
     """
-    
-    def __init__(self, parser_type: str = "llm", comparator_type: str = "llm"):
+
+    def __init__(self, parser_type: str = "llm", comparator_type: str = "llm", max_concurrency: int = EXTRACT_CONCURRENCY,
+                 compare_concurrency: int = COMPARE_CONCURRENCY, max_pairs: int = COMPARE_MAX_PAIRS):
         if parser_type == "llm":
             self.claim_feature_extractor = LLMClaimFeatureExtractor()
         else:
             self.claim_feature_extractor = RuleBasedClaimFeatureExtractor()
-        
+
         if comparator_type == "llm":
             self.feature_comparator = LLMFeatureComparator()
         else:
             self.feature_comparator = FeatureComparator()
 
-    async def compare_claims(self, claim_text_a: str, claim_text_b: str) -> str:
+        self.max_concurrency = max_concurrency
+        self._extract_slots = asyncio.Semaphore(max_concurrency)
+        self.compare_concurrency = compare_concurrency
+        self._compare_slots = asyncio.Semaphore(compare_concurrency)
+        self.max_pairs = max_pairs
+
+    async def _extract(self, claim_text: str, latency: Dict[str, float], stage: str) -> List[str]:
+        async with self._extract_slots:
+            start = time.perf_counter()
+            features = await self.claim_feature_extractor.extract_features(claim_text)
+            latency[stage] = _ms(start)
+            return features
+
+    async def extract_many(self, claim_texts: List[str], latency: Dict[str, float] = None,
+                           names: List[str] = None, return_exceptions: bool = False) -> List[List[str]]:
         """
-        Analyzes two claims and returns a human-readable report.
+        Extract features of every claim concurrently, at most max_concurrency
+        extractor calls at a time; identical claim texts are extracted once.
+        latency collects extract_<name>_ms per extraction (name defaults to the claim index).
+        return_exceptions: a failed extraction yields its exception in place of
+        the claim's features instead of failing the whole call.
+        """
+        latency = {} if latency is None else latency
+        names = names or [str(i) for i in range(len(claim_texts))]
+        distinct: Dict[str, str] = {}
+        for text, name in zip(claim_texts, names):
+            distinct.setdefault(text, name)
+        features = await asyncio.gather(
+            *(self._extract(text, latency, f"extract_{name}_ms") for text, name in distinct.items()),
+            return_exceptions=return_exceptions,
+        )
+        by_text = dict(zip(distinct, features))
+        return [by_text[text] for text in claim_texts]
+
+    async def analyze_claims(self, claim_text_a: str, claim_text_b: str) -> Dict:
+        """
+        Extract both claims' features concurrently, then compare them. Returns the
+        features, the comparator result and metadata with per-stage latency in ms.
         """
-        features_a = await self.claim_feature_extractor.extract_features(claim_text_a)
-        features_b = await self.claim_feature_extractor.extract_features(claim_text_b)
-        
+        start = time.perf_counter()
+        latency: Dict[str, float] = {}
+        features_a, features_b = await self.extract_many([claim_text_a, claim_text_b], latency, ["a", "b"])
+        latency["extract_ms"] = _ms(start)
+
         print(f"DEBUG: claim A features: {features_a}")
         print(f"DEBUG: claim B features: {features_b}")
-        
+
+        compare_start = time.perf_counter()
         result = await self.feature_comparator.compare(features_a, features_b)
-        
+        latency["compare_ms"] = _ms(compare_start)
+        latency["total_ms"] = _ms(start)
+        return {
+            "features_a": features_a,
+            "features_b": features_b,
+            "result": result,
+            "metadata": {"latency": latency, "max_concurrency": self.max_concurrency},
+        }
+
+    async def compare_matrix(self, claims_a: List[str], claims_b: List[str],
+                             on_progress: Optional[ProgressCallback] = None) -> Dict:
+        """
+        Compare every claim of claims_a with every claim of claims_b. Each distinct
+        claim is extracted once; the comparator runs over the N x M pairs with at
+        most compare_concurrency calls in flight, and on_progress is awaited as
+        pairs finish. Returns a compact matrix result; a pair whose extraction or
+        comparison failed has similarity None and an entry in "errors".
+        Raises ValueError above max_pairs pairs.
+        """
+        total = len(claims_a) * len(claims_b)
+        if total > self.max_pairs:
+            raise ValueError(f"{len(claims_a)} x {len(claims_b)} = {total} claim pairs exceeds the limit of {self.max_pairs}")
+        start = time.perf_counter()
+        features = await self.extract_many(claims_a + claims_b, return_exceptions=True)
+        latency = {"extract_ms": _ms(start)}
+        features_a, features_b = features[:len(claims_a)], features[len(claims_a):]
+
+        similarity: List[List[Optional[float]]] = [[None] * len(claims_b) for _ in claims_a]
+        errors: List[Dict] = []
+        done = 0
+
+        async def compare(i: int, j: int):
+            nonlocal done
+            failed = next((f for f in (features_a[i], features_b[j]) if isinstance(f, Exception)), None)
+            if failed is not None:
+                errors.append({"a": i, "b": j, "stage": "extract", "error": repr(failed)})
+            else:
+                try:
+                    async with self._compare_slots:
+                        result = await self.feature_comparator.compare(features_a[i], features_b[j])
+                    similarity[i][j] = round(float(result["overall_similarity"]), 3)
+                except Exception as e:
+                    errors.append({"a": i, "b": j, "stage": "compare", "error": repr(e)})
+            done += 1
+            if on_progress is not None:
+                await on_progress(done, total)
+
+        compare_start = time.perf_counter()
+        await asyncio.gather(*(compare(i, j) for i in range(len(claims_a)) for j in range(len(claims_b))))
+        latency["compare_ms"] = _ms(compare_start)
+        latency["total_ms"] = _ms(start)
+
+        best_b = [
+            max((j for j, score in enumerate(row) if score is not None), key=row.__getitem__, default=None)
+            for row in similarity
+        ]
+        return {
+            "shape": [len(claims_a), len(claims_b)],
+            "similarity": similarity,
+            "best_match_b": [
+                {"b": j, "score": similarity[i][j]} if j is not None else None for i, j in enumerate(best_b)
+            ],
+            "errors": sorted(errors, key=lambda e: (e["a"], e["b"])),
+            "metadata": {
+                "latency": latency,
+                "distinct_claims": len(set(claims_a + claims_b)),
+                "pairs": total,
+            },
+        }
+
+    async def compare_claims(self, claim_text_a: str, claim_text_b: str) -> str:
+        """
+        Analyzes two claims and returns a human-readable report.
+        """
+        analysis = await self.analyze_claims(claim_text_a, claim_text_b)
+        return self.render_report(analysis)
+
+    @staticmethod
+    def render_report(analysis: Dict) -> str:
+        result = analysis["result"]
         report = []
         report.append("# Patent Claim Comparison Report\n")
         report.append(f"**Overall Similarity Score**: {result['overall_similarity']:.2f}\n")
-        
+
         report.append("## Feature Matches\n")
         for match in result['matches']:
             report.append(f"- **Score**: {match['score']:.2f}")
             report.append(f"  - Claim A: {match['feature_a']}")
             report.append(f"  - Claim B: {match['feature_b']}")
             report.append("")
-            
+
         if result['unmatched_b']:
             report.append("## Unmatched Features in Claim B (Potential Added Matter)\n")
             for feat in result['unmatched_b']:
                 report.append(f"- {feat}")
-        
+
+        latency = analysis["metadata"]["latency"]
+        report.append("\n## Metadata\n")
+        report.append("- Latency: " + ", ".join(f"{stage} {ms:.1f}" for stage, ms in latency.items()))
+
         return "\n".join(report)
@@ -1,8 +1,9 @@
 from typing import List
 import json
 import re
-from agents import Agent, Runner
+from agents import Agent
 from app.db.db import init_db
+from app.tools.mcp_tools.llm_cache import forget, run_agent
 from app.prompt.claim_feature_extract import SYSTEM_PROMPT, INSTRUCTIONS
 
 class RuleBasedClaimFeatureExtractor:
@@ -64,8 +65,7 @@ class LLMClaimFeatureExtractor:
         """
         prompt = INSTRUCTIONS.format(claim_text=claim_text)
         
-        result = await Runner.run(self.agent, prompt)
-        response_text = result.final_output
+        response_text = await run_agent(self.agent, prompt)
         
         try:
             # Clean up potential markdown formatting (```json ... ```)
@@ -77,6 +77,7 @@ class LLMClaimFeatureExtractor:
                 return [json.dumps(features)]
         except json.JSONDecodeError:
             # Fallback if JSON parsing fails
+            forget(self.agent, prompt)
             return [line.strip() for line in response_text.splitlines() if line.strip()]
 
 
@@ -1,6 +1,7 @@
 from typing import List, Dict, Set
 import json
-from agents import Agent, Runner
+from agents import Agent
+from app.tools.mcp_tools.llm_cache import forget, run_agent
 
 class FeatureComparator:
     """
@@ -144,8 +145,7 @@ class LLMFeatureComparator:
         JSON Output:
         """
         
-        result = await Runner.run(self.agent, prompt)
-        response_text = result.final_output
+        response_text = await run_agent(self.agent, prompt)
         
         try:
             # Clean up potential markdown formatting
@@ -167,6 +167,7 @@ class LLMFeatureComparator:
         except (json.JSONDecodeError, ValueError) as e:
             print(f"Warning: Failed to parse LLM response: {e}")
             print(f"Raw response: {response_text}")
+            forget(self.agent, prompt)
             # Fallback to rule-based comparison
             fallback = FeatureComparator()
             return await fallback.compare(features_a, features_b)
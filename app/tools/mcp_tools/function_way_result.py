@@ -1,6 +1,7 @@
 from typing import List, Dict, Set
 import json
-from agents import Agent, Runner
+from agents import Agent
+from app.tools.mcp_tools.llm_cache import forget, run_agent
 from app.prompt.function_way_result import SYSTEM_PROMPT, INSTRUCTIONS  
 
 
@@ -27,8 +28,7 @@ class FunctionWayResultAnalyzer:
         prompt = INSTRUCTIONS.format(claims=claims)
         
         try:
-            result = await Runner.run(self.agent, prompt)
-            response_text = result.final_output
+            response_text = await run_agent(self.agent, prompt)
         except Exception as e:
             import traceback
             print(f"ERROR: Runner.run failed: {e}\n{traceback.format_exc()}")
@@ -49,6 +49,7 @@ class FunctionWayResultAnalyzer:
         except (json.JSONDecodeError, ValueError) as e:
             print(f"Warning: Failed to parse LLM response: {e}")
             print(f"Raw response: {response_text}")
+            forget(self.agent, prompt)
             raise
 
             
\ No newline at end of file
@@ -1,8 +1,10 @@
 from typing import List
 import json
 import re
-from agents import Agent, Runner
+from agents import Agent
 from app.db.db import init_db
+from app.nlp.cpc import reset_cpc_classifier
+from app.tools.mcp_tools.llm_cache import forget, run_agent
 from app.prompt.keyword_expansion import SYSTEM_PROMPT, INSTRUCTIONS
 
 class RuleBasedKeywordExpander:
@@ -42,8 +44,7 @@ class LLMKeywordExpander:
         """
         prompt = INSTRUCTIONS.format(keyword=keyword)
         
-        result = await Runner.run(self.agent, prompt)
-        response_text = result.final_output
+        response_text = await run_agent(self.agent, prompt)
         
         try:
             # Clean up potential markdown formatting (```json ... ```)
@@ -52,6 +53,7 @@ class LLMKeywordExpander:
             return json.dumps(expanded_keywords)
         except json.JSONDecodeError:
             # Fallback if JSON parsing fails
+            forget(self.agent, prompt)
             return response_text
 
 
@@ -90,3 +92,4 @@ if __name__ == "__main__":
     
     conn.commit()
     conn.close()
+    reset_cpc_classifier()
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+from agents import Agent, Runner
+
+from app.config import CACHE_PATH
+from app.db.db import init_llm_cache_db
+
+LLM_CACHE = os.getenv("LLM_CACHE", "1") != "0"
+LLM_CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "256"))
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def agent_key(agent: Agent, prompt: str) -> Tuple[str, str, str, str]:
+    """(agent name, model, instructions hash, prompt hash) of one Runner.run call."""
+    instructions = agent.instructions if isinstance(agent.instructions, str) else repr(agent.instructions)
+    return agent.name, str(agent.model), _sha256(instructions or ""), _sha256(prompt)
+
+
+# ----------------------------
+# LLM Response Cache
+# ----------------------------
+class LlmResponseCache:
+    """
+    SQLite cache of final agent outputs for deterministic prompts. Entries
+    expire after ttl_s; past max_bytes of responses the least recently used
+    ones are evicted.
+    """
+
+    def __init__(self, path: Union[str, Path] = CACHE_PATH / "llm_cache.db", ttl_s: float = LLM_CACHE_TTL_S,
+                 max_bytes: int = LLM_CACHE_MAX_MB << 20):
+        self.path = Path(path)
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.conn = init_llm_cache_db(self.path)
+        self.size_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str, str, str]) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT response, size, created_at FROM llm_responses "
+                "WHERE agent = ? AND model = ? AND instructions_hash = ? AND prompt_hash = ?", key,
+            ).fetchone()
+            if row is not None and now - row[2] > self.ttl_s:
+                self._delete(key, row[1])
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE llm_responses SET accessed_at = ? "
+                    "WHERE agent = ? AND model = ? AND instructions_hash = ? AND prompt_hash = ?", (now, *key),
+                )
+            return row[0]
+
+    def put(self, key: Tuple[str, str, str, str], response: str):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._delete(key)
+            with self.conn:
+                self.conn.execute("INSERT INTO llm_responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (*key, response, size, now, now))
+            self.size_bytes += size
+            if self.size_bytes > self.max_bytes:
+                self._evict(now)
+
+    def invalidate(self, key: Tuple[str, str, str, str]):
+        """Forget a response, e.g. one its caller could not parse."""
+        with self._lock:
+            self._delete(key)
+
+    def _delete(self, key, size: Optional[int] = None):
+        with self.conn:
+            if size is None:
+                row = self.conn.execute(
+                    "SELECT size FROM llm_responses "
+                    "WHERE agent = ? AND model = ? AND instructions_hash = ? AND prompt_hash = ?", key,
+                ).fetchone()
+                if row is None:
+                    return
+                size = row[0]
+            self.conn.execute(
+                "DELETE FROM llm_responses WHERE agent = ? AND model = ? AND instructions_hash = ? AND prompt_hash = ?", key,
+            )
+        self.size_bytes -= size
+
+    def _evict(self, now: float):
+        # expired entries first, then least recently used until under 90% of max_bytes.
+        with self.conn:
+            self.conn.execute("DELETE FROM llm_responses WHERE created_at < ?", (now - self.ttl_s,))
+            self.size_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+            target = int(self.max_bytes * 0.9)
+            freed, cutoff = 0, None
+            for accessed_at, size in self.conn.execute("SELECT accessed_at, size FROM llm_responses ORDER BY accessed_at"):
+                if self.size_bytes - freed <= target:
+                    break
+                freed += size
+                cutoff = accessed_at
+            if cutoff is not None:
+                freed = self.conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM llm_responses WHERE accessed_at <= ?", (cutoff,)
+                ).fetchone()[0]
+                self.conn.execute("DELETE FROM llm_responses WHERE accessed_at <= ?", (cutoff,))
+                self.size_bytes -= freed
+
+    async def run(self, agent: Agent, prompt: str) -> str:
+        """Runner.run(agent, prompt).final_output, served from the cache when present."""
+        key = agent_key(agent, prompt)
+        response = self.get(key)
+        if response is None:
+            result = await Runner.run(agent, prompt)
+            response = result.final_output
+            self.put(key, response)
+        return response
+
+    def clear(self):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM llm_responses")
+            self.size_bytes = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+        return {
+            "entries": entries,
+            "size_mb": self.size_bytes / 2**20,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_cache: Optional[LlmResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LlmResponseCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LlmResponseCache()
+        return _cache
+
+
+async def run_agent(agent: Agent, prompt: str) -> str:
+    """Final output of the agent on prompt, through the shared cache unless LLM_CACHE=0."""
+    if not LLM_CACHE:
+        result = await Runner.run(agent, prompt)
+        return result.final_output
+    return await get_llm_cache().run(agent, prompt)
+
+
+def forget(agent: Agent, prompt: str):
+    """Drop a cached response that turned out unusable, so the next call asks the LLM again."""
+    if LLM_CACHE:
+        get_llm_cache().invalidate(agent_key(agent, prompt))
@@ -0,0 +1,118 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class AdmissionRejected(Exception):
+    """A call was refused because its tool's wait queue is full."""
+
+    def __init__(self, tool: str, queued: int, retry_after_s: float):
+        self.tool = tool
+        self.queued = queued
+        self.retry_after_s = retry_after_s
+        super().__init__(f"{tool} is overloaded ({queued} calls queued), retry after {retry_after_s:.0f}s")
+
+    def to_dict(self) -> Dict:
+        """Machine-readable form, for a structured error result."""
+        return {"error": "overloaded", "tool": self.tool, "queued": self.queued, "retry_after_s": self.retry_after_s}
+
+
+class ToolLimiter:
+    """
+    At most `concurrency` calls of one tool run at once; up to `max_queue` more
+    wait for a slot, and calls beyond that are rejected at once with a
+    retry-after estimate from the recent call durations.
+    """
+
+    def __init__(self, tool: str, concurrency: int, max_queue: int, window: int = 1000):
+        self.tool = tool
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._slots = asyncio.Semaphore(concurrency)
+        self.running = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._waits = deque(maxlen=window)      # seconds waited for a slot, recent calls
+        self._durations = deque(maxlen=window)  # seconds holding a slot, recent calls
+
+    def retry_after(self) -> float:
+        """Seconds until the queue ahead would have drained, at the recent mean call duration."""
+        mean = sum(self._durations) / len(self._durations) if self._durations else 1.0
+        return float(max(1, math.ceil((self.queued + 1) * mean / self.concurrency)))
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.running >= self.concurrency and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(self.tool, self.queued, self.retry_after())
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        start = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self._waits.append(time.perf_counter() - start)
+        self.admitted += 1
+        self.running += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._durations.append(time.perf_counter() - start)
+            self.running -= 1
+            self._slots.release()
+
+    def stats(self) -> Dict:
+        waits = sorted(self._waits)
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queue_depth": self.queued,
+            "max_queue_depth": self.max_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_ms_mean": 1000 * sum(waits) / len(waits) if waits else 0.0,
+            "wait_ms_p95": 1000 * waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            "wait_ms_max": 1000 * waits[-1] if waits else 0.0,
+        }
+
+
+class AdmissionController:
+    """
+    One ToolLimiter per registered tool, created up front; tools without their
+    own limits get the default ones. Unregistered tool names get no limiter.
+    """
+
+    def __init__(self, tools: Iterable[str], default: Tuple[int, int],
+                 limits: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.default = default
+        self.limits = dict(limits or {})
+        self._limiters: Dict[str, ToolLimiter] = {
+            tool: ToolLimiter(tool, *self.limits.get(tool, default)) for tool in tools
+        }
+
+    def __contains__(self, tool: str) -> bool:
+        return tool in self._limiters
+
+    def limiter(self, tool: str) -> ToolLimiter:
+        limiter = self._limiters.get(tool)
+        if limiter is None:
+            raise KeyError(f"unknown tool {tool!r}")
+        return limiter
+
+    def slot(self, tool: str):
+        """
+        async with controller.slot(tool): ... -- raises AdmissionRejected when
+        the queue is full, KeyError for an unregistered tool.
+        """
+        return self.limiter(tool).slot()
+
+    def stats(self) -> Dict:
+        return {tool: limiter.stats() for tool, limiter in self._limiters.items()}
@@ -0,0 +1,60 @@
+import asyncio
+import hashlib
+import json
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+def normalize_arguments(value: Any) -> Any:
+    """Arguments with whitespace-collapsed strings, so re-wrapped copies of a claim compare equal."""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: normalize_arguments(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_arguments(v) for v in value]
+    return value
+
+
+def call_key(name: str, arguments: Optional[Dict]) -> str:
+    """Key of a tool call: tool name plus a hash of its normalized arguments."""
+    payload = json.dumps(normalize_arguments(arguments or {}), sort_keys=True, ensure_ascii=False)
+    return f"{name}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+class SingleFlight:
+    """
+    In-flight deduplication of async calls: while a call for a key runs,
+    further calls with the same key await its result instead of starting
+    their own. The shared call runs as its own task, so one caller being
+    cancelled does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.calls: Counter = Counter()
+        self.coalesced: Counter = Counter()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], group: str = "default") -> Any:
+        self.calls[group] += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced[group] += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        calls, coalesced = sum(self.calls.values()), sum(self.coalesced.values())
+        return {
+            "calls": calls,
+            "executed": calls - coalesced,
+            "coalesced": coalesced,
+            "coalesced_rate": coalesced / calls if calls else 0.0,
+            "in_flight": len(self._in_flight),
+            "by_group": {
+                group: {"calls": n, "coalesced": self.coalesced[group]} for group, n in self.calls.items()
+            },
+        }
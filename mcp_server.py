@@ -4,17 +4,39 @@ import uvicorn
 import json
 
 from starlette.applications import Starlette
+from starlette.responses import JSONResponse
 from starlette.routing import Route, Mount
 from mcp.server.sse import SseServerTransport
 from mcp.server import Server
-from mcp.types import Tool, TextContent, ImageContent, EmbeddedResource
+from mcp.types import CallToolResult, Tool, TextContent, ImageContent, EmbeddedResource
 from app.tools.mcp_tools.claim_analyzer import ClaimAnalyzer
 from app.tools.mcp_tools.function_way_result import FunctionWayResultAnalyzer
+from app.tools.mcp_tools.llm_cache import LLM_CACHE, get_llm_cache
+from app.utils.admission import AdmissionController, AdmissionRejected
+from app.utils.single_flight import SingleFlight, call_key
 
 server = Server("LLM Patent Analyzer")
 claim_analyzer = ClaimAnalyzer()
 function_way_result_analyzer = FunctionWayResultAnalyzer()
 
+TOOL_NAMES = ("compare_claims", "compare_claims_batch", "extract_features", "function_way_result_analysis")
+
+# concurrent identical calls of these tools share one execution. compare_claims_batch
+# is left out: its progress notifications belong to the calling session.
+COALESCED_TOOLS = {"compare_claims", "extract_features", "function_way_result_analysis"}
+single_flight = SingleFlight()
+
+# admission control: (concurrent calls, queued calls) per tool; calls beyond the
+# queue are rejected with a structured retry_after_s instead of piling onto the LLM provider.
+TOOL_CONCURRENCY = int(os.getenv("MCP_TOOL_CONCURRENCY", "4"))
+TOOL_QUEUE = int(os.getenv("MCP_TOOL_QUEUE", "16"))
+admission = AdmissionController(
+    TOOL_NAMES,
+    default=(TOOL_CONCURRENCY, TOOL_QUEUE),
+    # one batch fans out to N x M comparator calls by itself.
+    limits={"compare_claims_batch": (1, 2)},
+)
+
 @server.list_tools()
 async def handle_list_tools() -> list[Tool]:
     return [
@@ -30,6 +52,23 @@ async def handle_list_tools() -> list[Tool]:
                 "required": ["claim_a", "claim_b"],
             },
         ),
+        Tool(
+            name="compare_claims_batch",
+            description=(
+                "Compares every claim of claims_a with every claim of claims_b. Returns an "
+                "N x M similarity matrix and the best matching B claim for each A claim; "
+                "pairs that failed are null in the matrix and listed in errors. "
+                f"At most {claim_analyzer.max_pairs} pairs per call."
+            ),
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "claims_a": {"type": "array", "items": {"type": "string"}},
+                    "claims_b": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["claims_a", "claims_b"],
+            },
+        ),
         Tool(
             name="extract_features",
             description="Extracts a list of distinct features from a patent claim.",
@@ -57,16 +96,52 @@ async def handle_list_tools() -> list[Tool]:
         )
     ]
 
+def _progress_notifier():
+    """Progress callback sending MCP progress notifications, when the client asked for them."""
+    ctx = server.request_context
+    token = ctx.meta.progressToken if ctx.meta else None
+    if token is None:
+        return None
+
+    async def notify(done: int, total: int):
+        await ctx.session.send_progress_notification(progress_token=token, progress=done, total=total)
+    return notify
+
+
 @server.call_tool()
-async def handle_call_tool(name: str, arguments: dict | None) -> list[TextContent | ImageContent | EmbeddedResource]:
+async def handle_call_tool(name: str, arguments: dict | None) -> list[TextContent | ImageContent | EmbeddedResource] | CallToolResult:
+    if name not in admission:
+        return CallToolResult(content=[TextContent(type="text", text=f"Unknown tool: {name}")], isError=True)
     if not arguments:
         return [TextContent(type="text", text="Missing arguments")]
+    if name in COALESCED_TOOLS:
+        # coalesced calls share the admitted one's slot.
+        return await single_flight.do(call_key(name, arguments), lambda: admit_tool(name, arguments), group=name)
+    return await admit_tool(name, arguments)
+
 
+async def admit_tool(name: str, arguments: dict) -> list[TextContent | ImageContent | EmbeddedResource] | CallToolResult:
+    try:
+        async with admission.slot(name):
+            return await run_tool(name, arguments)
+    except AdmissionRejected as e:
+        logging.warning(f"Rejected {name} call: {e}")
+        # retry_after_s is in structuredContent, so clients need not parse the message.
+        return CallToolResult(content=[TextContent(type="text", text=str(e))], structuredContent=e.to_dict(), isError=True)
+
+
+async def run_tool(name: str, arguments: dict) -> list[TextContent | ImageContent | EmbeddedResource]:
     if name == "compare_claims":
         claim_a = arguments.get("claim_a", "")
         claim_b = arguments.get("claim_b", "")
         result = await claim_analyzer.compare_claims(claim_a, claim_b)
         return [TextContent(type="text", text=result)]
+
+    elif name == "compare_claims_batch":
+        claims_a = arguments.get("claims_a") or []
+        claims_b = arguments.get("claims_b") or []
+        result = await claim_analyzer.compare_matrix(claims_a, claims_b, on_progress=_progress_notifier())
+        return [TextContent(type="text", text=json.dumps(result))]
     
     elif name == "extract_features":
         text = arguments.get("claim_text", "")
@@ -101,11 +176,19 @@ async def handle_sse(request):
     from starlette.responses import Response
     return Response()
 
+async def handle_metrics(request):
+    """Admission control, request coalescing and LLM cache counters."""
+    metrics = {"admission": admission.stats(), "single_flight": single_flight.stats()}
+    if LLM_CACHE:
+        metrics["llm_cache"] = get_llm_cache().stats()
+    return JSONResponse(metrics)
+
 # 3. Starlette App
 app = Starlette(
     debug=True,
     routes=[
         Route("/sse", endpoint=handle_sse, methods=["GET"]),
+        Route("/metrics", endpoint=handle_metrics, methods=["GET"]),
         Mount("/messages", app=sse.handle_post_message),
     ],
 )
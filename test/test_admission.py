@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from app.utils.admission import AdmissionController, AdmissionRejected
+
+
+async def hold(controller, tool, release, entered=None):
+    async with controller.slot(tool):
+        if entered is not None:
+            entered.set()
+        await release.wait()
+
+
+def test_queue_then_reject():
+    async def run():
+        controller = AdmissionController(["search"], default=(1, 1))
+        limiter = controller.limiter("search")
+        release = asyncio.Event()
+        entered = asyncio.Event()
+
+        running = asyncio.create_task(hold(controller, "search", release, entered))
+        await entered.wait()
+        queued = asyncio.create_task(hold(controller, "search", release))
+        await asyncio.sleep(0)
+        assert (limiter.running, limiter.queued) == (1, 1)
+
+        with pytest.raises(AdmissionRejected) as e:
+            async with controller.slot("search"):
+                pass
+        assert e.value.tool == "search" and e.value.queued == 1
+        assert e.value.retry_after_s >= 1
+        assert e.value.to_dict()["error"] == "overloaded"
+
+        release.set()
+        await asyncio.gather(running, queued)
+        return limiter.stats()
+
+    stats = asyncio.run(run())
+    assert stats["admitted"] == 2
+    assert stats["rejected"] == 1
+    assert stats["max_queue_depth"] == 1
+    assert stats["running"] == stats["queue_depth"] == 0
+
+
+def test_concurrency_limit_respected():
+    async def run():
+        controller = AdmissionController(["analyze"], default=(1, 0), limits={"analyze": (2, 10)})
+        active, peak = 0, 0
+
+        async def call():
+            nonlocal active, peak
+            async with controller.slot("analyze"):
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.001)
+                active -= 1
+
+        await asyncio.gather(*(call() for _ in range(8)))
+        return peak, controller.stats()["analyze"]
+
+    peak, stats = asyncio.run(run())
+    assert peak == 2
+    assert stats["admitted"] == 8 and stats["rejected"] == 0
+    assert stats["concurrency"] == 2 and stats["max_queue"] == 10
+
+
+def test_unregistered_tool():
+    controller = AdmissionController(["search"], default=(1, 1))
+    assert "search" in controller
+    assert "other" not in controller
+    with pytest.raises(KeyError):
+        controller.slot("other")
+    assert list(controller.stats()) == ["search"]
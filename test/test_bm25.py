@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from app.nlp.bm25 import Bm25Index
+
+CLAIMS = [
+    "a rotor blade coupled to an electric motor",
+    "a battery pack with a cooling plate and part PN-0042",
+    "an electric motor driving a gear shaft",
+    "a flight controller receiving rotor speed from a sensor",
+    "a cooling plate bonded to a battery cell",
+]
+
+
+@pytest.fixture
+def index():
+    index = Bm25Index()
+    index.add(range(len(CLAIMS)), CLAIMS)
+    return index
+
+
+def test_exact_term_ranks_first(index):
+    labels, scores = index.search("PN-0042", k=3)
+    assert labels.tolist() == [1]
+    assert scores[0] > 0
+
+
+def test_save_load_score_parity(index, tmp_path):
+    queries = ["electric motor rotor", "battery cooling plate", "gear shaft sensor"]
+    before = [index.search(q, k=5) for q in queries]
+    index.save(tmp_path)
+    loaded = Bm25Index.load(tmp_path)
+    for q, (labels, scores) in zip(queries, before):
+        got_labels, got_scores = loaded.search(q, k=5)
+        assert got_labels.tolist() == labels.tolist()
+        np.testing.assert_allclose(got_scores, scores, rtol=1e-6)
+
+
+def test_remove_and_add_after_load(index, tmp_path):
+    index.save(tmp_path)
+    loaded = Bm25Index.load(tmp_path)
+    loaded.remove([0])
+    loaded.add([5], ["a rotor hub with folding blade"])
+    labels, _ = loaded.search("rotor blade", k=5)
+    assert 0 not in labels.tolist() and labels[0] == 5
+
+
+def test_budget_scores_rarest_term_and_counts_truncation(index):
+    labels, _ = index.search("PN-0042 cooling plate", k=5, budget_ms=1e-9)
+    assert labels.tolist() == [1]
+    assert index.stats()["truncated"] == 1 and index.stats()["skipped_terms"] >= 1
+    assert len(index.search("PN-0042 cooling plate", k=5)[0]) == 2
+    assert index.stats()["truncated"] == 1
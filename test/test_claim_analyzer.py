@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from app.tools.mcp_tools.claim_analyzer import COMPARE_MAX_PAIRS, ClaimAnalyzer
+
+
+class FakeExtractor:
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = set(fail)
+
+    async def extract_features(self, claim_text):
+        self.calls.append(claim_text)
+        if claim_text in self.fail:
+            raise RuntimeError(f"cannot parse {claim_text!r}")
+        return claim_text.split()
+
+
+class FakeComparator:
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+    async def compare(self, features_a, features_b):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0)
+        self.active -= 1
+        shared = len(set(features_a) & set(features_b))
+        return {"overall_similarity": shared / max(len(set(features_a) | set(features_b)), 1)}
+
+
+def analyzer(fail=(), **kwargs):
+    analyzer = ClaimAnalyzer("rule", "rule", **kwargs)
+    analyzer.claim_feature_extractor = FakeExtractor(fail)
+    analyzer.feature_comparator = FakeComparator()
+    return analyzer
+
+
+def test_default_pair_limit():
+    assert COMPARE_MAX_PAIRS >= 1000
+
+
+def test_rejects_above_max_pairs():
+    claims = analyzer(max_pairs=6)
+    with pytest.raises(ValueError, match="3 x 3 = 9"):
+        asyncio.run(claims.compare_matrix(["a", "b", "c"], ["x", "y", "z"]))
+    assert claims.claim_feature_extractor.calls == []
+
+
+def test_at_max_pairs():
+    claims = analyzer(max_pairs=6, compare_concurrency=2)
+    progress = []
+
+    async def on_progress(done, total):
+        progress.append((done, total))
+
+    result = asyncio.run(claims.compare_matrix(
+        ["rotor blade", "motor", "rotor blade"], ["rotor", "blade motor"], on_progress=on_progress,
+    ))
+    assert result["shape"] == [3, 2]
+    assert result["metadata"]["pairs"] == 6
+    assert result["similarity"][0] == [0.5, 0.333]
+    assert result["best_match_b"][1] == {"b": 1, "score": 0.5}
+    assert result["errors"] == []
+    assert progress[-1] == (6, 6) and len(progress) == 6
+    assert sorted(claims.claim_feature_extractor.calls) == ["blade motor", "motor", "rotor", "rotor blade"]
+    assert claims.feature_comparator.peak <= 2
+
+
+def test_extraction_failure_is_per_pair():
+    claims = analyzer(fail={"bad"}, max_pairs=4)
+    result = asyncio.run(claims.compare_matrix(["rotor", "bad"], ["rotor", "motor"]))
+    assert result["similarity"] == [[1.0, 0.0], [None, None]]
+    assert result["best_match_b"] == [{"b": 0, "score": 1.0}, None]
+    assert [(e["a"], e["b"], e["stage"]) for e in result["errors"]] == [(1, 0, "extract"), (1, 1, "extract")]
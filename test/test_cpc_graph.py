@@ -0,0 +1,67 @@
+import pytest
+
+from app.nlp.cpc import CpcGraph, normalize_cpc
+
+
+EDGES = [
+    ("G06F", "G06F 9/00"),
+    ("G06F 9/00", "G06F 9/50"),
+    ("G06F 9/00", "G06F 9/46"),
+    ("G06F 9/50", "G06F 9/5016"),
+    ("G06F", "G06F 16/00"),
+]
+
+
+@pytest.fixture
+def graph():
+    return CpcGraph.from_edges(EDGES, nodes=["H04L"])
+
+
+def test_shape(graph):
+    assert len(graph) == 7
+    assert graph.n_edges == len(EDGES)
+    assert sorted(graph.neighbours("G06F 9/00")) == ["G06F", "G06F 9/46", "G06F 9/50"]
+    assert graph.neighbours("H04L") == []
+
+
+def test_expand_hops(graph):
+    assert sorted(graph.expand(["G06F 9/50"], hops=1)) == ["G06F 9/00", "G06F 9/50", "G06F 9/5016"]
+    assert sorted(graph.expand(["G06F 9/50"], hops=2)) == [
+        "G06F", "G06F 9/00", "G06F 9/46", "G06F 9/50", "G06F 9/5016",
+    ]
+    assert sorted(graph.expand(["G06F 9/5016"], hops=3)) == [
+        "G06F", "G06F 9/00", "G06F 9/46", "G06F 9/50", "G06F 9/5016",
+    ]
+    assert graph.expand(["G06F 9/50"], hops=0) == ["G06F 9/50"]
+
+
+def test_expand_unknown_and_isolated(graph):
+    assert sorted(graph.expand(["A01B 1/00", "H04L"], hops=2)) == ["A01B 1/00", "H04L"]
+
+
+def test_expand_multiple_seeds(graph):
+    assert sorted(graph.expand(["G06F 16/00", "G06F 9/46"], hops=1)) == [
+        "G06F", "G06F 16/00", "G06F 9/00", "G06F 9/46",
+    ]
+
+
+def test_expand_memoized(graph):
+    graph.expand(["G06F 9/50"], hops=2)
+    graph.expand(["G06F 9/50"], hops=2)
+    info = graph.cache_info()
+    assert info.hits == 1 and info.misses == 1
+
+
+def test_save_load(graph, tmp_path):
+    graph.save(tmp_path / "graph.npz")
+    loaded = CpcGraph.load(tmp_path / "graph.npz")
+    assert loaded.codes.tolist() == graph.codes.tolist()
+    assert sorted(loaded.expand(["G06F 9/50"], hops=2)) == sorted(graph.expand(["G06F 9/50"], hops=2))
+
+
+def test_from_scheme(tmp_path):
+    scheme = tmp_path / "scheme.tsv"
+    scheme.write_text("# code\tparent\nG06F\t\ng06f9/00\tG06F\nG06F  9 / 50\tG06F 9/00\tScheduling\n")
+    graph = CpcGraph.from_scheme(scheme)
+    assert normalize_cpc("g06f9/50") in graph
+    assert sorted(graph.expand(["G06F 9/50"], hops=2)) == ["G06F", "G06F 9/00", "G06F 9/50"]
@@ -0,0 +1,51 @@
+import zlib
+
+import numpy as np
+import pytest
+
+import app.nlp.feature_extraction as fe
+
+
+def fake_embed(texts):
+    """Deterministic unit vectors, one per distinct text, instead of the sentence model."""
+    vecs = np.stack([np.random.default_rng(zlib.crc32(t.encode())).normal(size=32) for t in texts])
+    return (vecs / np.linalg.norm(vecs, axis=1, keepdims=True)).astype(np.float32)
+
+
+class FakeDoc:
+    noun_chunks = ()
+
+    def __iter__(self):
+        return iter(())
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(fe, "embed_text", fake_embed)
+    monkeypatch.setattr(fe, "parse_many", lambda texts, batch_size=64: [FakeDoc() for _ in texts])
+    monkeypatch.setattr(fe, "predict_cpc_codes", lambda claim: ["G06F 9/50"])
+    claim = "a battery management system comprising an electric motor configured to rotate a propeller and transmit power to the rotor"
+    patents = [
+        {"id": "A", "claim": claim, "cpc": ["G06F 9/50"]},
+        {"id": "B", "claim": claim + " blade", "cpc": ["G06F 9/50"]},
+        {"id": "C", "claim": "a method of scheduling tasks on a distributed cluster using leases and quorum voting", "cpc": []},
+    ]
+    engine = fe.PatentSearchEngine(dedup=True)
+    engine.build_index(patents)
+    assert engine.family_of == {"B": "A"}
+    return engine
+
+
+def test_remove_representative_with_its_duplicate(engine):
+    assert engine.remove_patents(["A", "B"]) == 2
+    assert "A" not in engine.patent_map and "B" not in engine.patent_map
+    assert engine.families == {} and engine.family_of == {}
+    assert len(engine.index) == 1
+    hits = [p["id"] for p, _ in engine.search("a battery management system comprising an electric motor", k=5)]
+    assert hits == ["C"]
+
+
+def test_remove_representative_promotes_member(engine):
+    assert engine.remove_patents(["A"]) == 1
+    assert "B" in engine.index.label_of and "B" in engine.patent_map
+    assert engine.families == {}
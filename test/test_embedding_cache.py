@@ -0,0 +1,87 @@
+import gc
+
+import numpy as np
+import pytest
+
+from app.nlp.embedding import EmbeddingCache, text_key
+
+
+def keys_and_vectors(start, stop, dim=8):
+    keys = [text_key("m", f"t{i}") for i in range(start, stop)]
+    vectors = np.stack([np.full(dim, i, dtype=np.float32) for i in range(start, stop)])
+    return keys, vectors
+
+
+def crash(cache):
+    """Drop a cache without flushing its index, like a killed process would."""
+    cache._lock_file.close()
+    del cache
+    gc.collect()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "cache"
+
+
+def test_hit_after_flush_and_reopen(path):
+    cache = EmbeddingCache("m", path, max_bytes=1 << 20)
+    keys, vectors = keys_and_vectors(0, 10)
+    cache.put_many(keys, vectors)
+    cache.flush()
+    crash(cache)
+
+    cache = EmbeddingCache("m", path, max_bytes=1 << 20)
+    out, hit = cache.get_many(keys)
+    assert hit.all()
+    np.testing.assert_array_equal(out, vectors)
+
+
+def test_evicted_rows_are_not_served_after_unclean_exit(path):
+    # 1024 rows of dim 8: the first put fills the cache exactly.
+    cache = EmbeddingCache("m", path, max_bytes=1024 * 8 * 2, flush_every=10**9)
+    keys, vectors = keys_and_vectors(0, 1024)
+    cache.put_many(keys, vectors)
+    cache.flush()
+    # evicts t0..t4 and reuses their rows; the index on disk still maps t0..t4 to them.
+    new_keys, new_vectors = keys_and_vectors(1024, 1029)
+    cache.put_many(new_keys, new_vectors)
+    crash(cache)
+
+    cache = EmbeddingCache("m", path, max_bytes=1024 * 8 * 2)
+    out, hit = cache.get_many(keys[:10])
+    assert not hit[:5].any()
+    assert hit[5:].all()
+    np.testing.assert_array_equal(out[5:], vectors[5:10])
+    # the rows freed by the stale keys are reused rather than lost.
+    cache.put_many(keys[:5], vectors[:5])
+    out, hit = cache.get_many(keys[:5])
+    assert hit.all()
+    np.testing.assert_array_equal(out, vectors[:5])
+
+
+def test_lru_eviction(path):
+    cache = EmbeddingCache("m", path, max_bytes=1024 * 8 * 2)
+    keys, vectors = keys_and_vectors(0, 1024)
+    cache.put_many(keys, vectors)
+    cache.get_many(keys[:1])  # t0 becomes most recently used
+    new_keys, new_vectors = keys_and_vectors(1024, 1025)
+    cache.put_many(new_keys, new_vectors)
+    _, hit = cache.get_many([keys[0], keys[1], new_keys[0]])
+    assert hit.tolist() == [True, False, True]
+
+
+def test_second_process_opens_read_only(path):
+    writer = EmbeddingCache("m", path, max_bytes=1 << 20)
+    keys, vectors = keys_and_vectors(0, 4)
+    writer.put_many(keys, vectors)
+    writer.flush()
+
+    reader = EmbeddingCache("m", path, max_bytes=1 << 20)
+    assert reader.read_only and not writer.read_only
+    out, hit = reader.get_many(keys)
+    assert hit.all()
+    np.testing.assert_array_equal(out, vectors)
+    more_keys, more_vectors = keys_and_vectors(4, 6)
+    reader.put_many(more_keys, more_vectors)
+    assert not reader.get_many(more_keys)[1].any()
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from app.nlp.vector_index import VectorIndex
+
+
+def unit_vectors(n, dim=16, seed=0):
+    vecs = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def index():
+    index = VectorIndex(16, "flat")
+    index.add(unit_vectors(50), [f"P{i}" for i in range(50)])
+    return index
+
+
+def top_ids(index, vec, k=50):
+    return [pid for pid, _ in index.search(vec, k=k)]
+
+
+def test_remove_hides_vectors_immediately(index):
+    vecs = unit_vectors(50)
+    assert index.remove(["P3", "P7", "missing"]) == 2
+    assert len(index) == 48 and "P3" not in index
+    assert top_ids(index, vecs[3], k=1) != ["P3"]
+    assert not {"P3", "P7"} & set(top_ids(index, vecs[3]))
+
+
+def test_update_replaces_vector(index):
+    vecs = unit_vectors(50)
+    index.add(vecs[10:11], ["P3"])
+    assert len(index) == 50
+    hits = index.search(vecs[10], k=2)
+    assert {pid for pid, _ in hits} == {"P3", "P10"}
+    assert all(score == pytest.approx(1.0, abs=1e-5) for _, score in hits)
+
+
+def test_compact_drops_tombstones_and_keeps_results(index):
+    vecs = unit_vectors(50)
+    index.remove([f"P{i}" for i in range(0, 50, 2)])
+    before = index.search(vecs[1], k=10)
+    assert index.compact() == 25
+    assert index.index.ntotal == 25 and index.tombstone_ratio() == 0.0
+    after = index.search(vecs[1], k=10)
+    assert [pid for pid, _ in after] == [pid for pid, _ in before]
+    np.testing.assert_allclose([s for _, s in after], [s for _, s in before], rtol=1e-5)
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_save_load_round_trip(index, tmp_path, mmap):
+    vecs = unit_vectors(50)
+    index.remove(["P1", "P2"])
+    expected = index.search(vecs[5], k=10)
+    index.save(tmp_path)
+
+    loaded = VectorIndex.load(tmp_path, mmap=mmap)
+    assert len(loaded) == 48 and "P1" not in loaded
+    got = loaded.search(vecs[5], k=10)
+    assert [pid for pid, _ in got] == [pid for pid, _ in expected]
+    np.testing.assert_allclose([s for _, s in got], [s for _, s in expected], rtol=1e-5)
+    # a loaded index still takes writes, and tombstones survived the round trip.
+    loaded.add(vecs[1:2], ["P1"])
+    assert top_ids(loaded, vecs[1], k=1) == ["P1"]
+    assert loaded.compact() == 2